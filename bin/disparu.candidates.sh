@@ -135,6 +135,12 @@ fi
 _host=$(echo ${disparu_db_host} | cut -d':' -f1)
 _port=$(echo ${disparu_db_host} | cut -d':' -f2)
 PSQL_CMD="PGPASSWORD=\"${disparu_db_pass}\" psql --echo-all -h ${_host} -p ${_port} -U ${disparu_db_user} -d ${disparu_db_name}"
+# the auto_type index is compiled from candidatesRecord.auto_type, which it has to match to be used (needs PYTHONPATH)
+_auto_type_index=$(python3 -c 'from dsrc.models.disparu import candidates_auto_type_ddl; print(candidates_auto_type_ddl())')
+if [[ -z "${_auto_type_index}" ]]; then
+  write_red "ERROR: cannot compile the auto_type index, is PYTHONPATH set (source etc/Disparu.sh)?"
+  exit 1
+fi
 if [[ -f /tmp/disparu.candidates.sh ]]; then
   rm -f /tmp/disparu.candidates.sh
 fi
@@ -181,6 +187,18 @@ echo "    ON DELETE CASCADE"
 echo ");"                                                                               >> /tmp/disparu.candidates.sh 2>&1
 echo "END_TABLE"                                                                        >> /tmp/disparu.candidates.sh 2>&1
 echo ""                                                                                 >> /tmp/disparu.candidates.sh 2>&1
+echo "${PSQL_CMD} << END_INDEX"                                                         >> /tmp/disparu.candidates.sh 2>&1
+echo "  CREATE INDEX ON candidates (ra, id);"                                           >> /tmp/disparu.candidates.sh 2>&1
+echo "  CREATE INDEX ON candidates (dec, id);"                                          >> /tmp/disparu.candidates.sh 2>&1
+echo "  CREATE INDEX ON candidates (snr, id);"                                          >> /tmp/disparu.candidates.sh 2>&1
+echo "  CREATE INDEX ON candidates (scorr_peak, id);"                                   >> /tmp/disparu.candidates.sh 2>&1
+echo "  CREATE INDEX ON candidates (flux_aper, id);"                                    >> /tmp/disparu.candidates.sh 2>&1
+echo "  CREATE INDEX ON candidates (mag_aper, id);"                                     >> /tmp/disparu.candidates.sh 2>&1
+echo "  CREATE INDEX ON candidates (diff2sciflux, id);"                                 >> /tmp/disparu.candidates.sh 2>&1
+echo "  ${_auto_type_index}"                                                            >> /tmp/disparu.candidates.sh 2>&1
+echo "  ANALYZE VERBOSE candidates;"                                                    >> /tmp/disparu.candidates.sh 2>&1
+echo "END_INDEX"                                                                        >> /tmp/disparu.candidates.sh 2>&1
+echo ""                                                                                 >> /tmp/disparu.candidates.sh 2>&1
 
 # +
 # execute
@@ -141,7 +141,8 @@ fi
 
 
 # +
-# create table
+# create table for a new database, it drops any existing one: to add the natural key to an existing
+# table and keep its rows use disparu.natural_keys.sh instead
 # -
 echo "Creating /tmp/disparu.refs.sh"
 echo "#!/bin/sh"                                                                        >> /tmp/disparu.refs.sh 2>&1
@@ -161,6 +162,7 @@ echo "  filter VARCHAR(128),"
 echo "  base_dir text,"                                                                 >> /tmp/disparu.refs.sh 2>&1  
 echo "  filename text,"                                                                 >> /tmp/disparu.refs.sh 2>&1
 echo "  version CHAR(7),"                                                               >> /tmp/disparu.refs.sh 2>&1
+echo "  UNIQUE (galaxy_id, version, filename, base_dir),"                               >> /tmp/disparu.refs.sh 2>&1
 echo "  CONSTRAINT fk_galaxy"                                                           >> /tmp/disparu.refs.sh 2>&1
 echo "    FOREIGN KEY(galaxy_id)"                                                       >> /tmp/disparu.refs.sh 2>&1
 echo "    REFERENCES galaxies(id)"                                                      >> /tmp/disparu.refs.sh 2>&1
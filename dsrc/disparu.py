@@ -7,20 +7,37 @@
 from dsrc import *
 from dsrc.disparu_common import *
 from dsrc.utils import *
-from dsrc.utils.candidates_save import get_source_type, get_candidate_type
-
+from dsrc.utils.candidates_save import get_source_type
+from dsrc.utils.sources_match import SOURCE_MATCH_RADIUS, sources_crossmatch, source_index_get, source_index_add
+from dsrc.utils.disparu_cache import candidates_count, candidates_count_set, facets_get
+from dsrc.utils.disparu_db import db_engine, db_engine_options, db_replica, db_url
+from dsrc.utils.thumbnails import THUMBNAIL_KINDS, thumbnail_get, thumbnail_sprites, thumbnail_sprite_get
+from dsrc.utils.thumbnails import thumbnail_store_get, thumbnails_hashes
+
+import time
 import numpy as np
 from astropy.time import Time
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 
 from flask import Flask
+from flask import abort
+from flask import json
+from flask import Response
 from flask import render_template
 from flask import request
 from flask import jsonify
+from flask import redirect
 from flask import send_file
 from flask import send_from_directory
+from flask import stream_with_context
+from flask import url_for
+from flask_sqlalchemy import Pagination
 from sqlalchemy import desc, distinct
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from psycopg2.extensions import QueryCanceledError
+from concurrent.futures import ThreadPoolExecutor, wait
 from urllib.parse import urlencode
 
 from dsrc.models.disparu import db as db_disparu
@@ -34,12 +51,25 @@ from dsrc.models.disparu import sourcesRecord
 from dsrc.models.disparu import galaxies_filters
 from dsrc.models.disparu import candidates_filters
 from dsrc.models.disparu import subtractions_filters
+from dsrc.models.disparu import candidates_keyset
+from dsrc.models.disparu import candidates_facets
+from dsrc.models.disparu import candidates_fields
+from dsrc.models.disparu import candidates_projection
+from dsrc.models.disparu import candidates_serialize_rows
+from dsrc.models.disparu import CANDIDATES_FIELDS
 
 ARIZONA = pytz.timezone('America/Phoenix')
 PSQL_CONNECT_MSG = f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME} using {DISPARU_DB_USER}:{DISPARU_DB_PASS}'
 RESULTS_PER_PAGE = 200
+STREAM_BATCH_SIZE = 1000
+THUMBNAIL_DISPLAY = 200 #pixels
+THUMBNAIL_MAX_AGE = 86400 #seconds
+THUMBNAIL_IMMUTABLE_AGE = 31536000 #seconds
+THUMBNAIL_SPRITES = os.getenv('DISPARU_THUMBNAIL_SPRITES', 'false')
+BATCH_DEADLINE = float(os.getenv('DISPARU_BATCH_DEADLINE', 30.0)) #seconds
+BATCH_WORKERS = int(os.getenv('DISPARU_BATCH_WORKERS', 4))
+CANDIDATE_PAGE_FIELDS = ['id', 'galaxy_id', 'xpos', 'ypos', 'ra', 'dec', 'auto_type']
 
-SOURCE_MATCH_RADIUS = 0.05
 SOURCE_TYPES = ['VarStar', 'Transient', 'DispStar', 'Junk']
 
 # +
@@ -73,8 +103,8 @@ try:
     app.config['SECRET_KEY'] = DISPARU_SECRET_KEY
 except:
     app.config['SECRET_KEY'] = hashlib.sha256(get_isot().encode('utf-8')).hexdigest()
-app.config['SQLALCHEMY_DATABASE_URI'] = \
-    f'postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}'
+app.config['SQLALCHEMY_DATABASE_URI'] = db_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_engine_options()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 
@@ -83,6 +113,11 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # -
 with app.app_context():
     db_disparu.init_app(app)
+
+# +
+# bounded pool for the searches of POST batches
+# -
+_BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
     
 # +
 # (hidden) function: _request_wants_json()
@@ -96,6 +131,82 @@ def _request_wants_json():
             request.accept_mimetypes[best] > \
             request.accept_mimetypes['text/html']
 
+# +
+# (hidden) function: _request_wants_ndjson()
+# -
+def _request_wants_ndjson():
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson' and \
+        request.accept_mimetypes[best] > \
+        request.accept_mimetypes['application/json']
+
+# +
+# (hidden) function: _candidates_ndjson()
+# -
+def _candidates_ndjson(searches):
+    """
+    Stream the results of a POST batch as newline-delimited JSON from server-side cursors.
+    Each result is one {"query_index", "result"} line, each search ends with a
+    {"query_index", "query", "num_alerts"} line counted in the same pass, and the
+    stream ends with a {"total"} line.
+    """
+    total = 0
+    for _ix, search_args in enumerate(searches):
+        query = db_disparu.session.query(candidatesRecord.id)
+        query = candidates_filters(query, search_args)
+        query = candidates_projection(query, CANDIDATES_FIELDS, []).execution_options(stream_results=True)
+        _num = 0
+        for _row in query.yield_per(STREAM_BATCH_SIZE):
+            yield json.dumps({'query_index': _ix, 'result': dict(zip(CANDIDATES_FIELDS, _row))}) + '\n'
+            _num += 1
+        yield json.dumps({'query_index': _ix, 'query': search_args, 'num_alerts': _num}) + '\n'
+        total += _num
+    yield json.dumps({'total': total}) + '\n'
+
+# +
+# (hidden) function: _candidates_search()
+# -
+def _candidates_search(engine, search_args, expires):
+    """
+    Run one search of a POST batch on a session of its own, so the searches of a batch can
+    run concurrently. A thread cannot be stopped once it runs, so what bounds a search is what
+    is left of the batch deadline: the HTTP timeout of a Sesame lookup for a name, then the
+    statement_timeout, after which the server cancels the statement and the connection goes
+    back to the pool. A search still queued when the deadline has passed never takes a connection.
+    """
+    if time.time() >= expires:
+        return {'query': search_args, 'num_alerts': 0, 'results': [], 'error': 'deadline exceeded'}
+    _session = sessionmaker(bind=engine)()
+    try:
+        query = _session.query(candidatesRecord.id)
+        query = candidates_filters(query, search_args, timeout=expires - time.time())
+        query = candidates_projection(query, CANDIDATES_FIELDS, [])
+        if time.time() >= expires:
+            return {'query': search_args, 'num_alerts': 0, 'results': [], 'error': 'deadline exceeded'}
+        _timeout_ms = max(int((expires - time.time()) * 1000.0), 1)
+        _session.execute(text(f'SET LOCAL statement_timeout = {_timeout_ms}'))
+        _results = [dict(zip(CANDIDATES_FIELDS, _row)) for _row in query.all()]
+        return {'query': search_args, 'num_alerts': len(_results), 'results': _results}
+    finally:
+        _session.rollback()
+        _session.close()
+
+# +
+# (hidden) function: _facets_dropdowns()
+# -
+def _facets_dropdowns(_facets):
+    #the old dropdown lists from the facet rows: the galaxy records of the galaxies with candidates (by primary key),
+    #the observation dates and the versions, newest first
+    _ids = [_g['id'] for _g in _facets['galaxies']]
+    _all_galaxies_results = galaxiesRecord.serialize_list(
+        db_disparu.session.query(galaxiesRecord).filter(galaxiesRecord.id.in_(_ids)).order_by(galaxiesRecord.name).all()) \
+        if _ids else []
+    _gal_sub_dates = sorted(_d['date'] for _d in _facets['obs_dates'])
+    _sub_versions_results = sorted(({'version': _v['version']} for _v in _facets['versions']),
+                                   key=lambda _v: _v['version'], reverse=True)
+    return _all_galaxies_results, _gal_sub_dates, _sub_versions_results, _facets
+
+
 # +
 # route(s): /, /disparu.html
 # -
@@ -118,6 +229,8 @@ def disparu_candidates():
     client_ip = forwarded_ips[0].split(',')[0] if len(forwarded_ips) >= 1 else ''
     logger.info('incoming request', extra={'tags': {'requesting_ip': client_ip, 'request_args': request.args}})
     page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(404)
     response = {}
     
     # set default(s)
@@ -131,84 +244,92 @@ def disparu_candidates():
         
     # GET request
     if request.method == 'GET':
-        #need a list of all galaxies
-        all_galaxies = db_disparu.session.query(galaxiesRecord,candidatesRecord.galaxy_id).filter(candidatesRecord.galaxy_id==galaxiesRecord.id).\
-                                          distinct().order_by(galaxiesRecord.name)
-        _all_galaxies_results = galaxiesRecord.serialize_list([row[0] for row in all_galaxies.all()])
-        
-        #get subtraction dates
-        gal_subs = db_disparu.session.query(subtractionsRecord, galaxiesRecord).filter(subtractionsRecord.galaxy_id==galaxiesRecord.id).\
-                   order_by(subtractionsRecord.mjdstart).distinct(subtractionsRecord.mjdstart)
-        gal_subs = galaxies_filters(gal_subs, _args)
-        #gal_subs = subtractions_filters(gal_subs, _args)
-        _gal_subs_results = subtractionsRecord.serialize_list([row[0] for row in gal_subs.all()])
-        _gal_sub_dates = [Time(_this_sub_dict['mjdstart'], format='mjd').fits[:10].replace('-','') for _this_sub_dict in _gal_subs_results]
-
-        sub_versions = db_disparu.session.query(subtractionsRecord, galaxiesRecord).filter(subtractionsRecord.galaxy_id==galaxiesRecord.id).\
-                       order_by(desc(subtractionsRecord.version))
-        sub_versions = galaxies_filters(sub_versions, _args)
-        sub_versions = subtractions_filters(sub_versions, _args)
-        _sub_versions_results = subtractionsRecord.serialize_list([row[0] for row in sub_versions.all()])
-        
-
-        #query all the tables, I think this is ok. 
-        query = db_disparu.session.query(candidatesRecord, subtractionsRecord, galaxiesRecord).\
+        #the dropdown lists and their candidate counts per galaxy, obs. date and version from one grouped query,
+        #served from memory when cached
+        _all_galaxies_results, _gal_sub_dates, _sub_versions_results, _facets = \
+            facets_get(db_disparu.session, _args,
+                       lambda: _facets_dropdowns(candidates_facets(db_disparu.session, _args)))
+
+        #select only the columns that are returned, plus those the page itself needs (API: ?fields=id,ra,dec,sub.version)
+        _c_fields, _s_fields = candidates_fields(request.args.get('fields', '') if _request_wants_json() else '')
+        _c_select = _c_fields + [_f for _f in CANDIDATE_PAGE_FIELDS + [_args['sort_value'].lower()]
+                                 if _f in CANDIDATES_FIELDS and _f not in _c_fields]
+        _c_select = list(dict.fromkeys(_c_select))
+        query = db_disparu.session.query(candidatesRecord.id).\
                                    filter(candidatesRecord.sub_id == subtractionsRecord.id, 
                                           candidatesRecord.galaxy_id == galaxiesRecord.id)
         query = galaxies_filters(query, _args)
         query = subtractions_filters(query, _args)
         query = candidates_filters(query, _args)
-        paginator = query.paginate(page, RESULTS_PER_PAGE, True)
+        query = candidates_projection(query, _c_select, _s_fields)
+        
+        #cursor mode (?cursor=) uses keyset pagination on (sort_value, id) and only counts if asked to
+        _count_mode = request.args.get('count', 'exact', type=str)
+        _count_exact = None
+        if 'cursor' in request.args:
+            paginator = candidates_keyset(query, _args, RESULTS_PER_PAGE, key=lambda _row: _row)
+            if 'count' in request.args:
+                paginator.total, _count_exact = candidates_count(query, _args, _count_mode)
+                paginator.pages = int(math.ceil(paginator.total / float(RESULTS_PER_PAGE)))
+        else:
+            _items = query.limit(RESULTS_PER_PAGE).offset((page - 1) * RESULTS_PER_PAGE).all()
+            if len(_items) == 0 and page != 1:
+                abort(404)
+            if page == 1 and len(_items) < RESULTS_PER_PAGE:
+                _total, _count_exact = len(_items), True
+                candidates_count_set(_args, _total)
+            else:
+                _total, _count_exact = candidates_count(query, _args, _count_mode)
+            paginator = Pagination(query, page, RESULTS_PER_PAGE, _total, _items)
     
-        _c_results = candidatesRecord.serialize_list([row[0] for row in paginator.items])
-        _s_results = subtractionsRecord.serialize_list([row[1] for row in paginator.items])
-        _g_results = subtractionsRecord.serialize_list([row[2] for row in paginator.items])
+        _c_results, _s_results = candidates_serialize_rows(paginator.items, _c_select, _s_fields)
         
-        #determine source types:
+        #default candidate types are computed by the query (candidatesRecord.auto_type)
+        _s_types = [_c['auto_type'] for _c in _c_results]
         
-        #get the thumbnails, default candidate types, and any matching sources. 
-        _s_types = [None] * len(_c_results)
-        _thumbnails = [None] * len(_c_results)
-        _s_matches = [None] * len(_c_results)
-        for i in range(len(_c_results)):
-            _xpos_int = int(_c_results[i]['xpos'])
-            _ypos_int = int(_c_results[i]['ypos'])
-            _this_id = int(_c_results[i]['id'])
-            _this_tn = (f"scithumb_x{_xpos_int}_y{_ypos_int}_id{_this_id}.png", 
-                        f"refthumb_x{_xpos_int}_y{_ypos_int}_id{_this_id}.png",
-                        f"diffthumb_x{_xpos_int}_y{_ypos_int}_id{_this_id}.png")
-            _thumbnails[i] = _this_tn
-            
-            _s_types[i] = get_candidate_type(_c_results[i])
-            
-            _c_coord = SkyCoord(ra=_c_results[i]['ra']*u.degree, dec=_c_results[i]['dec']*u.degree)
-            _g_s_query = db_disparu.session.query(sourcesRecord).filter(sourcesRecord.galaxy_id==_c_results[i]['galaxy_id'])
-            _g_s_results = sourcesRecord.serialize_list([row for row in _g_s_query.all()])
-            _g_s_ra = np.array([_g_source['ra'] for _g_source in _g_s_results])
-            _g_s_dec = np.array([_g_source['dec'] for _g_source in _g_s_results])
-            _g_s_coord = SkyCoord(ra=_g_s_ra*u.degree, dec=_g_s_dec*u.degree)
-            _g_s_matches = np.where(_g_s_coord.separation(_c_coord) <= SOURCE_MATCH_RADIUS*u.arcsec)[0]
-            if len(_g_s_matches) > 0:
-                _s_match_names = [None]*len(_g_s_matches)
-                for j in range(len(_g_s_matches)):
-                    match_ix = _g_s_matches[j]
-                    _s_match_names[j] = _g_s_results[match_ix]['name']
-            else:
-                _s_match_names = ['']
-            _s_matches[i] = _s_match_names
+        #get the thumbnails by content hash, those not yet in the store are rendered by /thumbnail/ on first request
+        _hashes = thumbnails_hashes(db_disparu.session, [int(_c['id']) for _c in _c_results])
+        _thumbnails = [tuple(url_for('disparu_thumbnail_hashed', sha256=_hashes[(int(_c['id']), _k)])
+                             if (int(_c['id']), _k) in _hashes else
+                             url_for('disparu_thumbnail', cand_id=int(_c['id']), kind=_k) for _k in THUMBNAIL_KINDS)
+                       for _c in _c_results]
+        
+        #or one sprite sheet of stored thumbnails per block of rows, placed with CSS background offsets (API: ?sprites=true)
+        _sprites = None
+        if request.args.get('sprites', THUMBNAIL_SPRITES).lower() in ['1', 'true', 't', 'yes', 'y']:
+            _sprites = []
+            for _placement in thumbnail_sprites([int(_c['id']) for _c in _c_results], _hashes):
+                if _placement is None:
+                    _sprites.append(None)
+                    continue
+                _key, _row, _rows = _placement
+                _url = url_for('disparu_thumbnail_sprite', key=_key)
+                _sprites.append(tuple(f"background-image: url('{_url}'); "
+                                      f"background-position: -{_j * THUMBNAIL_DISPLAY}px -{_row * THUMBNAIL_DISPLAY}px; "
+                                      f"background-size: {len(THUMBNAIL_KINDS) * THUMBNAIL_DISPLAY}px {_rows * THUMBNAIL_DISPLAY}px"
+                                      for _j in range(len(THUMBNAIL_KINDS))))
+        
+        #crossmatch the whole page against any known sources
+        _s_matches = sources_crossmatch(db_disparu.session, _c_results, SOURCE_MATCH_RADIUS)
         
         # set response dictionary
         response = {
             'all_galaxies': _all_galaxies_results,
             'gal_sub_dates': _gal_sub_dates,
             'sub_versions': _sub_versions_results,
-            'total': paginator.total,
-            'pages': paginator.pages,
+            'facets': _facets,
+            'total': getattr(paginator, 'total', None),
+            'pages': getattr(paginator, 'pages', None),
+            'count_exact': _count_exact,
             'has_next': paginator.has_next,
             'has_prev': paginator.has_prev,
+            'next_cursor': getattr(paginator, 'next_cursor', None),
+            'prev_cursor': getattr(paginator, 'prev_cursor', None),
             'sub_results': _s_results,
-            'results': _c_results,
+            'results': _c_results if len(_c_select) == len(_c_fields) else
+                       [{_f: _c[_f] for _f in _c_fields} for _c in _c_results],
             'thumbnails': _thumbnails,
+            'sprites': _sprites,
             's_types': _s_types,
             'type_options': SOURCE_TYPES,
             's_matches': _s_matches
@@ -220,24 +341,43 @@ def disparu_candidates():
         # get search criteria
         searches = request.get_json().get('queries')
 
+        # stream newline-delimited JSON (Accept: application/x-ndjson)
+        if _request_wants_ndjson():
+            return Response(stream_with_context(_candidates_ndjson(searches)), mimetype='application/x-ndjson')
+
+        # run the searches concurrently, each on its own connection, within one deadline for the batch,
+        # on the read-only replica if there is one
+        try:
+            _deadline = min(float(request.get_json().get('deadline', BATCH_DEADLINE)), BATCH_DEADLINE)
+        except (TypeError, ValueError):
+            abort(400)
+        if not math.isfinite(_deadline) or _deadline <= 0.0:
+            abort(400)
+        _engine = db_engine(_readonly=True) if db_replica() else db_disparu.engine
+        _expires = time.time() + _deadline
+        _futures = [_BATCH_EXECUTOR.submit(_candidates_search, _engine, search_args, _expires)
+                    for search_args in searches]
+        wait(_futures, timeout=_deadline)
+
         # initialize output(s)
         search_results = []
         total = 0
 
-        # iterate over searches
-        for search_args in searches:
-
-            # initialize result(s)
-            search_result = {}
-
-            # query database
-            query = db_disparu.session.query(candidatesRecord)
-            query = candidates_filters(query, search_args)
-
-            # extract,transform and load (ETL) into result(s)
-            search_result['query'] = search_args
-            search_result['num_alerts'] = query.count()
-            search_result['results'] = candidatesRecord.serialize_list(query.all())
+        # collect results in request order
+        for search_args, _future in zip(searches, _futures):
+            if not _future.done():
+                # only a search that has not started is cancelled here, a running one holds its connection
+                # until its statement_timeout, the deadline, ends it; at most BATCH_WORKERS run at a time
+                _future.cancel()
+                search_result = {'query': search_args, 'num_alerts': 0, 'results': [], 'error': 'deadline exceeded'}
+            elif _future.exception() is not None:
+                _e = _future.exception()
+                _timeout = isinstance(getattr(_e, 'orig', None), QueryCanceledError)
+                logger.error(f'search failed, query={search_args}, error={_e}')
+                search_result = {'query': search_args, 'num_alerts': 0, 'results': [],
+                                 'error': 'deadline exceeded' if _timeout else 'search failed'}
+            else:
+                search_result = _future.result()
             search_results.append(search_result)
             total += search_result['num_alerts']
 
@@ -256,8 +396,12 @@ def disparu_candidates():
             _args.pop('page')
         except:
             pass
+        try:
+            _args.pop('cursor')
+        except:
+            pass
         arg_str = urlencode(_args)
-        return render_template('candidates.html', context=response, page=paginator.page, arg_str=arg_str, latest=latest,
+        return render_template('candidates.html', context=response, page=getattr(paginator, 'page', None), arg_str=arg_str, latest=latest,
                                url={'url': f'{DISPARU_APP_URL}', 'page': 'candidates'})
 
 # +
@@ -274,20 +418,14 @@ def disparu_candidates_save(id=0, methods=["GET"]):
     
     _c_query = db_disparu.session.query(candidatesRecord).filter(candidatesRecord.id==id).first_or_404()
 
-    #check if a matching sorce already exists
-    _c_coord = SkyCoord(ra=_c_query.ra*u.degree, dec=_c_query.dec*u.degree)
-    
-    _g_s_query = db_disparu.session.query(sourcesRecord).filter(sourcesRecord.galaxy_id==_c_query.galaxy_id)
-    _g_s_results = sourcesRecord.serialize_list([row for row in _g_s_query.all()])
-    _g_s_ra = np.array([_g_source['ra'] for _g_source in _g_s_results])
-    _g_s_dec = np.array([_g_source['dec'] for _g_source in _g_s_results])
-    _g_s_coord = SkyCoord(ra=_g_s_ra*u.degree, dec=_g_s_dec*u.degree)
-    _g_s_matches = np.where(_g_s_coord.separation(_c_coord) <= SOURCE_MATCH_RADIUS*u.arcsec)[0]
+    #check if a matching sorce already exists, reloading the galaxy's source index so the check is authoritative
+    _g_s_index = source_index_get(db_disparu.session, [_c_query.galaxy_id], _refresh=True)[_c_query.galaxy_id]
+    _g_s_matches = _g_s_index.match(_c_query.ra, _c_query.dec, SOURCE_MATCH_RADIUS)
     
     if len(_g_s_matches) > 0:
         _message = f"Found {len(_g_s_matches)} matching source(s) in database: "
-        for match_ix in _g_s_matches:
-            _message+=f"{_g_s_results[match_ix]['name']}, "
+        for _g_s_name in _g_s_matches:
+            _message+=f"{_g_s_name}, "
         _message+=f"candidate {id} not saved as new source."
         return render_template('candidate_save.html', context=_message, url={'url': f'{DISPARU_APP_URL}', 'page': 'candidates/save'})
     
@@ -295,8 +433,7 @@ def disparu_candidates_save(id=0, methods=["GET"]):
         #name the source
         _g_query = db_disparu.session.query(galaxiesRecord).filter(galaxiesRecord.id==_c_query.galaxy_id).first()
         _g_name = _g_query.name
-        _g_s_query = db_disparu.session.query(sourcesRecord).filter(sourcesRecord.galaxy_id==_c_query.galaxy_id).all()
-        _g_s_num = len(_g_s_query) + 1
+        _g_s_num = len(_g_s_index) + 1
         _s_name = f"{_g_name}_DS{_g_s_num}"
     
         if s_type != '':
@@ -322,6 +459,7 @@ def disparu_candidates_save(id=0, methods=["GET"]):
         try:
             db_disparu.session.add(_source)
             db_disparu.session.commit()
+            source_index_add(_source.galaxy_id, _source.id, _source.name, _source.ra, _source.dec)
             _message = f"Successfully saved candidate {id} to database as {_s_name} with type {s_type}."
             return render_template('candidate_save.html', context=_message, url={'url': f'{DISPARU_APP_URL}', 'page': 'candidates/save'})
             
@@ -331,6 +469,68 @@ def disparu_candidates_save(id=0, methods=["GET"]):
             return render_template('candidate_save.html', context=_message, url={'url': f'{DISPARU_APP_URL}', 'page': 'candidates/save'})
 
 
+# +
+# route(s): /thumbnail/<cand_id>/<kind>.png
+# -
+@app.route('/thumbnail/<int:cand_id>/<kind>.png')
+def disparu_thumbnail(cand_id=0, kind=''):
+    if kind not in THUMBNAIL_KINDS:
+        abort(404)
+    try:
+        _sha256 = thumbnail_get(db_disparu.session, cand_id, kind)
+    except Exception as e:
+        logger.error(f'failed to render thumbnail, cand_id={cand_id}, kind={kind}, error={e}')
+        abort(404)
+    if _sha256 is None:
+        abort(404)
+    # the content may change if the thumbnail is rendered again, so only the redirect expires
+    response = redirect(url_for('disparu_thumbnail_hashed', sha256=_sha256))
+    response.headers['Cache-Control'] = f'public, max-age={THUMBNAIL_MAX_AGE}'
+    return response
+
+
+# +
+# route(s): /thumbnail/h/<sha256>.png
+# -
+@app.route('/thumbnail/h/<sha256>.png')
+def disparu_thumbnail_hashed(sha256=''):
+    try:
+        _path = thumbnail_store_get(db_disparu.session, sha256)
+    except Exception as e:
+        logger.error(f'failed to render thumbnail, sha256={sha256}, error={e}')
+        abort(404)
+    if _path is None:
+        abort(404)
+    # the URL is the hash of the content, so it never changes
+    response = send_file(_path, mimetype='image/png')
+    response.set_etag(sha256)
+    response.headers['Cache-Control'] = f'public, max-age={THUMBNAIL_IMMUTABLE_AGE}, immutable'
+    return response.make_conditional(request)
+
+
+# +
+# route(s): /thumbnail/sprite/<key>.png, /thumbnail/sprite/<key>.json
+# -
+@app.route('/thumbnail/sprite/<key>.png')
+@app.route('/thumbnail/sprite/<key>.json')
+def disparu_thumbnail_sprite(key=''):
+    try:
+        _paths = thumbnail_sprite_get(db_disparu.session, key)
+    except Exception as e:
+        logger.error(f'failed to render sprite, key={key}, error={e}')
+        abort(404)
+    if _paths is None:
+        abort(404)
+    if request.path.endswith('.json'):
+        response = send_file(_paths[1], mimetype='application/json')
+    else:
+        response = send_file(_paths[0], mimetype='image/png')
+    # the key is a hash of the sheet's stamps, so it never changes and is its own entity tag
+    response.set_etag(key)
+    response.headers['Cache-Control'] = f'public, max-age={THUMBNAIL_IMMUTABLE_AGE}, immutable'
+    return response.make_conditional(request)
+
+
 # +
 # route(s): /galaxies/
 # -
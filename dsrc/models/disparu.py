@@ -7,12 +7,21 @@
 from astropy.coordinates import SkyCoord
 from astropy.time import Time
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import create_engine
 from sqlalchemy import func
 from sqlalchemy import desc
+from sqlalchemy import and_, or_
+from sqlalchemy import cast, literal, literal_column, null, true
+from sqlalchemy import DateTime, Integer
+from sqlalchemy import case
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import column_property
 from sqlalchemy.orm import sessionmaker
+from dsrc.utils.names_resolve import names_resolve
+from dsrc.utils.disparu_db import db_engine
 
 import argparse
+import base64
 import gzip
 import json
 import math
@@ -105,23 +114,26 @@ Notes:
 # -
 DB_VARCHAR = 128
 #GWGC_GZIP_URL = 'http://cdsarc.u-strasbg.fr/ftp/VII/267/gwgc.dat.gz'
-DISPARU_DB_HOST = os.getenv('DISPARU_DB_HOST', None)
-DISPARU_DB_NAME = os.getenv('DISPARU_DB_NAME', None)
-DISPARU_DB_PASS = os.getenv('DISPARU_DB_PASS', None)
-DISPARU_DB_PORT = os.getenv('DISPARU_DB_PORT', None)
-DISPARU_DB_USER = os.getenv('DISPARU_DB_USER', None)
 SORT_ORDER = ['asc', 'desc', 'ascending', 'descending']
 SORT_VALUE = ['id', 'pgc', 'name', 'ra', 'dec', '']
+AUTO_TYPES = ['VarStar', 'Transient', 'DispStar']
+# natural key of refs, observations and subtractions, one row per image file
+IMAGE_KEY = ['galaxy_id', 'version', 'filename', 'base_dir']
+FACET_ARGS = {'galaxy': 'gal_name', 'obs_date': 'sub_obs_dates', 'version': 'sub_version'}
+CANDIDATES_FIELDS = ['id', 'sub_id', 'galaxy_id', 'creation_date', 'xpos', 'ypos', 'ra', 'dec', 'photflags',
+                     'snr', 'flux_aper', 'fluxerr_aper', 'mag_aper', 'magerr_aper', 'elongation', 'fwhm_image',
+                     'class_star', 'scorr_peak', 'sciflux', 'diff2sciflux', 'ispos', 'auto_type']
+SUBTRACTIONS_FIELDS = ['id', 'galaxy_id', 'obs_id', 'ref_id', 'creation_date', 'mjdstart', 'mjdend',
+                       'tel', 'inst', 'filter', 'base_dir', 'filename', 'version']
 
 
 # +
 # (hidden) function: _get_astropy_coords()
 # -
 # noinspection PyBroadException
-def _get_astropy_coords(_oname=''):
+def _get_astropy_coords(_oname='', _session=None, _timeout=None):
     try:
-        _obj = SkyCoord.from_name(_oname)
-        return _obj.ra.value, _obj.dec.value
+        return names_resolve(_oname, _session, timeout=_timeout)
     except Exception:
         return math.nan, math.nan
 
@@ -206,6 +218,7 @@ class refsRecord(db.Model):
 
     # define table name
     __tablename__ = 'refs'
+    __table_args__ = (db.UniqueConstraint(*IMAGE_KEY),)
 
     id = db.Column(db.Integer, primary_key=True)
     galaxy_id = db.Column(db.Integer, db.ForeignKey('galaxies.id'), nullable=False)
@@ -266,6 +279,7 @@ class observationsRecord(db.Model):
 
     # define table name
     __tablename__ = 'observations'
+    __table_args__ = (db.UniqueConstraint(*IMAGE_KEY),)
 
     id = db.Column(db.Integer, primary_key=True)
     galaxy_id = db.Column(db.Integer, db.ForeignKey('galaxies.id'), nullable=False)
@@ -327,6 +341,7 @@ class subtractionsRecord(db.Model):
 
     # define table name
     __tablename__ = 'subtractions'
+    __table_args__ = (db.UniqueConstraint(*IMAGE_KEY),)
 
     id = db.Column(db.Integer, primary_key=True)
     galaxy_id = db.Column(db.Integer, db.ForeignKey('galaxies.id'), nullable=False)
@@ -412,6 +427,15 @@ class candidatesRecord(db.Model):
     diff2sciflux = db.Column(db.Float, nullable=True, default=None)
     ispos = db.Column(db.Boolean, nullable=True, default=None)
 
+    # automatic source type, see get_candidate_types() in dsrc/utils/candidates_save.py. PostgreSQL sorts NaN
+    # above every number, so NaN ratios are excluded explicitly to match NumPy. Indexed in disparu.candidates.sh
+    # with the DDL of candidates_auto_type_ddl(), so the index always matches this expression
+    auto_type = column_property(case([
+        (and_(ispos, diff2sciflux >= 0.5, diff2sciflux != literal_column("'NaN'")), AUTO_TYPES[2]),
+        (ispos, AUTO_TYPES[0]),
+        (or_(sciflux == -99.99, and_(diff2sciflux >= 1.0, diff2sciflux != literal_column("'NaN'"))), AUTO_TYPES[1])],
+        else_=AUTO_TYPES[0]))
+
     @property
     def pretty_serialized(self):
         return json.dumps(self.serialized(), indent=2)
@@ -438,7 +462,8 @@ class candidatesRecord(db.Model):
             'scorr_peak': self.scorr_peak,
             'sciflux': self.sciflux,
             'diff2sciflux': self.diff2sciflux,
-            'ispos': self.ispos
+            'ispos': self.ispos,
+            'auto_type': self.auto_type
         }
 
     # +
@@ -510,18 +535,220 @@ class sourcesRecord(db.Model):
     @staticmethod
     def serialize_list(m_records):
         return [_a.serialized() for _a in m_records]
-        
+
+
+# +
+# class: thumbnailsRecord(), inherits from db.Model
+# -
+# noinspection PyUnresolvedReferences
+class thumbnailsRecord(db.Model):
+
+    # +
+    # member variable(s)
+    # -
+
+    # define table name
+    __tablename__ = 'thumbnails'
+    __table_args__ = (db.UniqueConstraint('cand_id', 'kind'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    cand_id = db.Column(db.Integer, db.ForeignKey('candidates.id'), nullable=False)
+    creation_date = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    kind = db.Column(db.String(8), nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=True, default=None)
+
+    @property
+    def pretty_serialized(self):
+        return json.dumps(self.serialized(), indent=2)
+
+    def serialized(self):
+        return {
+            'id': self.id,
+            'cand_id': self.cand_id,
+            'creation_date': self.creation_date,
+            'kind': self.kind,
+            'sha256': self.sha256,
+            'size': self.size
+        }
+
+    # +
+    # (overload) method: __str__()
+    # -
+    def __str__(self):
+        return self.id
+
+    # +
+    # (static) method: serialize_list()
+    # -
+    @staticmethod
+    def serialize_list(m_records):
+        return [_a.serialized() for _a in m_records]
+
+
+# +
+# class: ingestManifestRecord(), inherits from db.Model
+# -
+# noinspection PyUnresolvedReferences
+class ingestManifestRecord(db.Model):
+
+    # +
+    # member variable(s)
+    # -
+
+    # define table name
+    __tablename__ = 'ingest_manifest'
+    __table_args__ = (db.UniqueConstraint('path', 'loader'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.Text, nullable=False, default='')
+    loader = db.Column(db.String(32), nullable=False, default='')
+    size = db.Column(db.BigInteger, nullable=True, default=None)
+    mtime = db.Column(db.Float, nullable=True, default=None)
+    sha256 = db.Column(db.String(64), nullable=True, default=None)
+    status = db.Column(db.String(16), nullable=False, default='')
+    rows = db.Column(db.Integer, nullable=True, default=None)
+    update_date = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    @property
+    def pretty_serialized(self):
+        return json.dumps(self.serialized(), indent=2)
+
+    def serialized(self):
+        return {
+            'id': self.id,
+            'path': self.path,
+            'loader': self.loader,
+            'size': self.size,
+            'mtime': self.mtime,
+            'sha256': self.sha256,
+            'status': self.status,
+            'rows': self.rows,
+            'update_date': self.update_date
+        }
+
+    # +
+    # (overload) method: __str__()
+    # -
+    def __str__(self):
+        return self.id
+
+    # +
+    # (static) method: serialize_list()
+    # -
+    @staticmethod
+    def serialize_list(m_records):
+        return [_a.serialized() for _a in m_records]
+
+
+# +
+# class: candidateBatchesRecord(), inherits from db.Model
+# -
+# noinspection PyUnresolvedReferences
+class candidateBatchesRecord(db.Model):
+
+    # +
+    # member variable(s)
+    # -
+
+    # define table name
+    __tablename__ = 'candidate_batches'
+    __table_args__ = (db.UniqueConstraint('sub_id', 'ispos'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    sub_id = db.Column(db.Integer, db.ForeignKey('subtractions.id'), nullable=False)
+    galaxy_id = db.Column(db.Integer, db.ForeignKey('galaxies.id'), nullable=False)
+    ispos = db.Column(db.Boolean, nullable=False)
+    creation_date = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    rows = db.Column(db.Integer, nullable=True, default=None)
+
+    @property
+    def pretty_serialized(self):
+        return json.dumps(self.serialized(), indent=2)
+
+    def serialized(self):
+        return {
+            'id': self.id,
+            'sub_id': self.sub_id,
+            'galaxy_id': self.galaxy_id,
+            'ispos': self.ispos,
+            'creation_date': self.creation_date,
+            'rows': self.rows
+        }
+
+    # +
+    # (overload) method: __str__()
+    # -
+    def __str__(self):
+        return self.id
+
+    # +
+    # (static) method: serialize_list()
+    # -
+    @staticmethod
+    def serialize_list(m_records):
+        return [_a.serialized() for _a in m_records]
+
+
+# +
+# function: candidates_auto_type_ddl()
+# -
+def candidates_auto_type_ddl():
+    """
+    Return the CREATE INDEX statement for candidatesRecord.auto_type, compiled from the ORM
+    expression itself. PostgreSQL only uses an expression index for a query whose expression
+    is the same, so the index is never written out by hand.
+
+    Returns:
+        (str): SQL statement
+    """
+    _expression = candidatesRecord.auto_type.property.columns[0].element
+    _sql = _expression.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    return f'CREATE INDEX ON candidates (({_sql}), id);'
+
+
+# +
+# function: record_upsert()
+# -
+def record_upsert(session, model, values, keys=IMAGE_KEY):
+    """
+    Insert a row unless one with the same natural key exists: INSERT ... ON CONFLICT (keys)
+    DO NOTHING RETURNING id, then, if nothing was inserted, SELECT the id of the existing row.
+    An existing row is neither locked nor rewritten, so loaders that share a reference or an
+    observation do not wait for each other's transactions, and no dead tuples are left.
+
+    Parameters:
+        session: database session, the caller commits
+        model: record class with a unique constraint on keys, added to an existing database by
+               bin/disparu.natural_keys.sh
+        values (dict): column values
+        keys (list): natural key columns
+    Returns:
+        _id (int): id of the new or existing row
+        _inserted (bool): True if the row is new
+    """
+    _table = model.__table__
+    _stmt = insert(_table).values(values).on_conflict_do_nothing(index_elements=keys)
+    _id = session.execute(_stmt.returning(_table.c.id)).scalar()
+    if _id is not None:
+        return _id, True
+    _id = session.query(_table.c.id).filter(*[_table.c[_k] == values[_k] for _k in keys]).scalar()
+    if _id is None:
+        raise Exception(f'invalid input, no {_table.name} row with {({_k: values[_k] for _k in keys})}')
+    return _id, False
+
+
 # +
 # function: candidates_filters() alphabetically
 # -
 # noinspection PyBroadException
-def candidates_filters(query, request_args):
+def candidates_filters(query, request_args, timeout=None):
     
-    # return records within astrocone search (API: ?cone=NGC1365,5.0)
+    # return records within astrocone search (API: ?cone=NGC1365,5.0), a name lookup takes at most timeout seconds
     if request_args.get('cand_astrocone'):
         try:
             _nam, _rad = request_args['cand_astrocone'].split(',')
-            _ra, _dec = _get_astropy_coords(_nam.strip().upper())
+            _ra, _dec = _get_astropy_coords(_nam.strip().upper(), query.session, timeout)
             query = query.filter(func.q3c_radial_query(candidatesRecord.ra, candidatesRecord.dec, _ra, _dec, _rad))
         except Exception:
             pass
@@ -547,6 +774,10 @@ def candidates_filters(query, request_args):
     #if request_args.get('num_matches'):
 
     
+    # return records with auto_type = value (API: ?auto_type=DispStar)
+    if request_args.get('auto_type'):
+        query = query.filter(candidatesRecord.auto_type == request_args['auto_type'])
+
     # return records with class_star >= value (API: ?class_star__gte=0.5)
     if request_args.get('class_star__gte'):
         query = query.filter(candidatesRecord.class_star >= float(request_args['class_star__gte']))
@@ -703,6 +934,254 @@ def candidates_filters(query, request_args):
     return query
     
 
+# +
+# class: KeysetPagination()
+# -
+class KeysetPagination(object):
+    """ one page of a keyset (cursor) paginated query """
+
+    def __init__(self, items=None, per_page=0, has_next=False, has_prev=False, next_cursor=None, prev_cursor=None):
+        self.items = items if items is not None else []
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+# +
+# function: candidates_cursor_encode()
+# -
+def candidates_cursor_encode(_sort_value, _sort_order, _direction, _value, _id):
+    """ return an opaque cursor for the (sort value, id) key of a row """
+    _payload = json.dumps([_sort_value, _sort_order, _direction, _value, _id], separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(_payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+# +
+# function: candidates_cursor_decode()
+# -
+# noinspection PyBroadException
+def candidates_cursor_decode(_cursor=''):
+    """ return the dictionary behind an opaque cursor or None if it is invalid """
+    try:
+        _payload = base64.urlsafe_b64decode(_cursor + '=' * (-len(_cursor) % 4)).decode('utf-8')
+        _sort_value, _sort_order, _direction, _value, _id = json.loads(_payload)
+        if _direction not in ['next', 'prev']:
+            return None
+        return {'sort_value': _sort_value, 'sort_order': _sort_order, 'direction': _direction,
+                'value': _value, 'id': int(_id)}
+    except Exception:
+        return None
+
+
+# +
+# (hidden) function: _keyset_after()
+# -
+def _keyset_after(_col, _id_col, _value, _id, _ascending, _nulls_last):
+    """ return the criterion for rows after (_value, _id) when ordered by (_col, _id_col) """
+    _after_id = (_id_col > _id) if _ascending else (_id_col < _id)
+    if _value is None:
+        if _nulls_last:
+            return and_(_col.is_(None), _after_id)
+        return or_(and_(_col.is_(None), _after_id), _col.isnot(None))
+    _after_value = (_col > _value) if _ascending else (_col < _value)
+    _criterion = or_(_after_value, and_(_col == _value, _after_id))
+    if _nulls_last:
+        _criterion = or_(_criterion, _col.is_(None))
+    return _criterion
+
+
+# +
+# function: candidates_keyset()
+# -
+def candidates_keyset(query, request_args, per_page=200, key=None):
+    """
+    Keyset (cursor) pagination of a filtered candidates query, ordered by (sort_value, id)
+    with NULL sort values last. The page after a cursor only depends on the key of the
+    row it was made from, so pages stay stable while new candidates are ingested.
+
+    Parameters:
+        query: query built with candidates_filters()
+        request_args (dict): request arguments with sort_value, sort_order and cursor
+        per_page (int): number of rows per page
+        key (callable): returns the candidatesRecord of a row, default: the row or its first element
+    Returns:
+        (KeysetPagination): the page
+    """
+
+    # check the sort request the same way as candidates_filters()
+    sort_value = request_args.get('sort_value', SORT_VALUE[0]).lower()
+    sort_order = request_args.get('sort_order', SORT_ORDER[0]).lower()
+    if not hasattr(candidatesRecord, sort_value):
+        sort_value = SORT_VALUE[0]
+    _ascending = not sort_order.startswith(SORT_ORDER[1])
+    _col = getattr(candidatesRecord, sort_value)
+    key = key if callable(key) else (lambda _row: _row if isinstance(_row, candidatesRecord) else _row[0])
+
+    # cursors made for another sort are ignored
+    _cursor = candidates_cursor_decode(request_args.get('cursor', ''))
+    if _cursor is not None and (_cursor['sort_value'] != sort_value or _cursor['sort_order'] != sort_order):
+        _cursor = None
+    _forward = _cursor is None or _cursor['direction'] == 'next'
+
+    # a previous page is read by walking the ordering backwards and reversing the rows
+    _asc = _ascending if _forward else not _ascending
+    _nulls_last = _forward
+    query = query.order_by(None)
+    if _cursor is not None:
+        query = query.filter(_keyset_after(_col, candidatesRecord.id, _cursor['value'], _cursor['id'], _asc, _nulls_last))
+    _order = _col.asc() if _asc else _col.desc()
+    _order = _order.nullslast() if _nulls_last else _order.nullsfirst()
+    query = query.order_by(_order, candidatesRecord.id.asc() if _asc else candidatesRecord.id.desc())
+
+    _items = query.limit(per_page + 1).all()
+    _has_more = len(_items) > per_page
+    _items = _items[:per_page]
+    if not _forward:
+        _items.reverse()
+
+    _page = KeysetPagination(items=_items, per_page=per_page)
+    _page.has_next = _has_more if _forward else True
+    _page.has_prev = (_cursor is not None) if _forward else _has_more
+    if len(_items) > 0:
+        _first, _last = key(_items[0]), key(_items[-1])
+        if _page.has_next:
+            _page.next_cursor = candidates_cursor_encode(sort_value, sort_order, 'next', getattr(_last, sort_value), _last.id)
+        if _page.has_prev:
+            _page.prev_cursor = candidates_cursor_encode(sort_value, sort_order, 'prev', getattr(_first, sort_value), _first.id)
+
+    # return page
+    return _page
+
+
+# +
+# function: candidates_facets()
+# -
+def candidates_facets(session, request_args):
+    """
+    Count the candidates per galaxy, per observation date and per subtraction version
+    for a set of filters in one grouped SQL statement. Each facet is counted with every
+    filter applied except its own selection (gal_name, sub_obs_dates, sub_version), so
+    the other choices of a facet keep their counts once one is selected.
+
+    Parameters:
+        session: database session
+        request_args (dict): request arguments as used by the *_filters() functions
+    Returns:
+        (dict): lists of {'id', 'name', 'count'}, {'date', 'count'} and {'version', 'count'}
+                under 'galaxies', 'obs_dates' and 'versions'
+    """
+
+    # filter on everything but the facet selections
+    _base_args = {_k: _v for _k, _v in request_args.items() if _k not in FACET_ARGS.values()}
+    query = session.query(candidatesRecord.id).filter(candidatesRecord.sub_id == subtractionsRecord.id,
+                                                      candidatesRecord.galaxy_id == galaxiesRecord.id)
+    query = galaxies_filters(query, _base_args)
+    query = subtractions_filters(query, _base_args)
+    query = candidates_filters(query, _base_args)
+
+    # the facet selections become flags on each row
+    _selected = {_f: request_args.get(_a, '') for _f, _a in FACET_ARGS.items()}
+    _galaxy_sel = (galaxiesRecord.name == _selected['galaxy']) if _selected['galaxy'] else true()
+    _date_sel = subtractions_filters(session.query(subtractionsRecord), {'sub_obs_dates': _selected['obs_date']}).\
+        whereclause if _selected['obs_date'] else true()
+    _version_sel = (subtractionsRecord.version == _selected['version']) if _selected['version'] else true()
+
+    # observation date as YYYYMMDD, from MJD = days since 1858-11-17
+    _obs_date = func.to_char(cast(literal_column("DATE '1858-11-17'") + cast(func.floor(subtractionsRecord.mjdstart), Integer),
+                                  DateTime), 'YYYYMMDD')
+
+    _base = query.order_by(None).with_entities(
+        galaxiesRecord.id.label('galaxy_id'), galaxiesRecord.name.label('galaxy_name'),
+        _obs_date.label('obs_date'), subtractionsRecord.version.label('version'),
+        _galaxy_sel.label('galaxy_sel'), _date_sel.label('date_sel'), _version_sel.label('version_sel')).cte('facet_base')
+    _c = _base.c
+
+    _galaxies = session.query(literal('galaxy').label('facet'), _c.galaxy_id.label('id'), _c.galaxy_name.label('value'),
+                              func.count().filter(and_(_c.date_sel, _c.version_sel)).label('count')).\
+        group_by(_c.galaxy_id, _c.galaxy_name)
+    _dates = session.query(literal('obs_date').label('facet'), cast(null(), Integer).label('id'), _c.obs_date.label('value'),
+                           func.count().filter(and_(_c.galaxy_sel, _c.version_sel)).label('count')).\
+        group_by(_c.obs_date)
+    _versions = session.query(literal('version').label('facet'), cast(null(), Integer).label('id'), _c.version.label('value'),
+                              func.count().filter(and_(_c.galaxy_sel, _c.date_sel)).label('count')).\
+        group_by(_c.version)
+
+    # drop empty choices but keep whatever is selected
+    _facets = {'galaxies': [], 'obs_dates': [], 'versions': []}
+    for _facet, _id, _value, _count in _galaxies.union_all(_dates, _versions).all():
+        if _value is None or (_count == 0 and _value != _selected[_facet]):
+            continue
+        if _facet == 'galaxy':
+            _facets['galaxies'].append({'id': _id, 'name': _value, 'count': _count})
+        elif _facet == 'obs_date':
+            _facets['obs_dates'].append({'date': _value, 'count': _count})
+        else:
+            _facets['versions'].append({'version': _value, 'count': _count})
+
+    # order the choices as the dropdowns show them
+    _facets['galaxies'].sort(key=lambda _e: _e['name'])
+    _facets['obs_dates'].sort(key=lambda _e: _e['date'])
+    _facets['versions'].sort(key=lambda _e: _e['version'], reverse=True)
+    return _facets
+
+
+# +
+# function: candidates_fields()
+# -
+def candidates_fields(fields=''):
+    """
+    Parse a fields request (API: ?fields=id,ra,dec,snr,sub.version) into the candidate
+    and subtraction fields to return. Subtraction fields take a 'sub.' prefix, unknown
+    fields are ignored and an empty request returns every serialized field.
+
+    Parameters:
+        fields (str): comma-separated field names
+    Returns:
+        _c_fields (list): candidate fields, in serialized order
+        _s_fields (list): subtraction fields, in serialized order
+    """
+
+    if not isinstance(fields, str) or fields.strip() == '':
+        return list(CANDIDATES_FIELDS), list(SUBTRACTIONS_FIELDS)
+
+    _requested = set(_f.strip().lower() for _f in fields.split(','))
+    _c_fields = [_f for _f in CANDIDATES_FIELDS if _f in _requested or _f == 'id']
+    _s_fields = [_f for _f in SUBTRACTIONS_FIELDS if f'sub.{_f}' in _requested]
+    return _c_fields, _s_fields
+
+
+# +
+# function: candidates_projection()
+# -
+def candidates_projection(query, c_fields, s_fields):
+    """
+    Replace the entities of a query joining candidates and subtractions by plain columns.
+    Candidate columns are labelled with their field name, so the rows work as keys for
+    candidates_keyset(), and subtraction columns are labelled 'subtraction_<field>'.
+
+    Parameters:
+        query: query built with candidates_filters()
+        c_fields (list): candidate fields to select
+        s_fields (list): subtraction fields to select
+    Returns:
+        query: the projected query
+    """
+    return query.with_entities(*[getattr(candidatesRecord, _f).label(_f) for _f in c_fields],
+                               *[getattr(subtractionsRecord, _f).label(f'subtraction_{_f}') for _f in s_fields])
+
+
+# +
+# function: candidates_serialize_rows()
+# -
+def candidates_serialize_rows(rows, c_fields, s_fields):
+    """ serialize the rows of candidates_projection() into candidate and subtraction dictionaries """
+    _c_ix = list(enumerate(c_fields))
+    _s_ix = list(enumerate(s_fields, len(c_fields)))
+    return [{_f: _r[_i] for _i, _f in _c_ix} for _r in rows], [{_f: _r[_i] for _i, _f in _s_ix} for _r in rows]
+
+
 # +
 # function: galaxies_filters() alphabetically
 # -
@@ -713,7 +1192,7 @@ def galaxies_filters(query, request_args):
     if request_args.get('gal_astrocone'):
         try:
             _nam, _rad = request_args['gal_astrocone'].split(',')
-            _ra, _dec = _get_astropy_coords(_nam.strip().upper())
+            _ra, _dec = _get_astropy_coords(_nam.strip().upper(), query.session)
             query = query.filter(func.q3c_radial_query(galaxiesRecord.ra, galaxiesRecord.dec, _ra, _dec, _rad))
         except Exception:
             pass
@@ -817,7 +1296,7 @@ def sources_filters(query, request_args):
     if request_args.get('source_astrocone'):
         try:
             _nam, _rad = request_args['source_astrocone'].split(',')
-            _ra, _dec = _get_astropy_coords(_nam.strip().upper())
+            _ra, _dec = _get_astropy_coords(_nam.strip().upper(), query.session)
             query = query.filter(func.q3c_radial_query(sourcesRecord.ra, sourcesRecord.dec, _ra, _dec, _rad))
         except Exception:
             pass
@@ -1029,17 +1508,10 @@ def galaxies_cli_db(iargs=None):
 
     # set up access to database
     try:
-        if iargs.verbose:
-            print(f'connecting via postgresql+psycopg2://'
-                  f'{DISPARU_DB_USER}:{DISPARU_DB_PASS}@{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        engine = create_engine(
-            f'postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
+        engine = db_engine(_readonly=True)
         if iargs.verbose:
             print(f'engine = {engine}')
-        get_session = sessionmaker(bind=engine)
-        if iargs.verbose:
-            print(f'Session = {get_session}')
-        session = get_session()
+        session = sessionmaker(bind=engine)()
         if iargs.verbose:
             print(f'session = {session}')
     except Exception as e:
@@ -6,9 +6,10 @@
 # -
 from astropy.coordinates import SkyCoord
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import create_engine
 from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
+from dsrc.utils.names_resolve import names_resolve
+from dsrc.utils.disparu_db import db_engine
 
 import argparse
 import gzip
@@ -122,11 +123,6 @@ Acknowledgements:
 # -
 DB_VARCHAR = 128
 GWGC_GZIP_URL = 'http://cdsarc.u-strasbg.fr/ftp/VII/267/gwgc.dat.gz'
-SASSY_DB_HOST = os.getenv('SASSY_DB_HOST', None)
-SASSY_DB_NAME = os.getenv('SASSY_DB_NAME', None)
-SASSY_DB_PASS = os.getenv('SASSY_DB_PASS', None)
-SASSY_DB_PORT = os.getenv('SASSY_DB_PORT', None)
-SASSY_DB_USER = os.getenv('SASSY_DB_USER', None)
 SORT_ORDER = ['asc', 'desc', 'ascending', 'descending']
 SORT_VALUE = ['id', 'pgc', 'name', 'ra', 'dec', 'tt', 'b_app', 'a', 'e_a', 'b', 'e_b', 'b_div_a', 'e_b_div_a',
               'pa', 'b_abs', 'dist', 'e_dist', 'e_b_app', 'e_b_abs']
@@ -136,10 +132,9 @@ SORT_VALUE = ['id', 'pgc', 'name', 'ra', 'dec', 'tt', 'b_app', 'a', 'e_a', 'b',
 # (hidden) function: _get_astropy_coords()
 # -
 # noinspection PyBroadException
-def _get_astropy_coords(_oname=''):
+def _get_astropy_coords(_oname='', _session=None):
     try:
-        _obj = SkyCoord.from_name(_oname)
-        return _obj.ra.value, _obj.dec.value
+        return names_resolve(_oname, _session)
     except Exception:
         return math.nan, math.nan
 
@@ -234,7 +229,7 @@ def gwgc_q3c_filters(query, request_args):
     if request_args.get('astrocone'):
         try:
             _nam, _rad = request_args['astrocone'].split(',')
-            _ra, _dec = _get_astropy_coords(_nam.strip().upper())
+            _ra, _dec = _get_astropy_coords(_nam.strip().upper(), query.session)
             query = query.filter(func.q3c_radial_query(GwgcQ3cRecord.ra, GwgcQ3cRecord.dec, _ra, _dec, _rad))
         except Exception:
             pass
@@ -527,17 +522,10 @@ def gwgc_q3c_cli_db(iargs=None):
 
     # set up access to database
     try:
-        if iargs.verbose:
-            print(f'connecting via postgresql+psycopg2://'
-                  f'{SASSY_DB_USER}:{SASSY_DB_PASS}@{SASSY_DB_HOST}:{SASSY_DB_PORT}/{SASSY_DB_NAME}')
-        engine = create_engine(
-            f'postgresql+psycopg2://{SASSY_DB_USER}:{SASSY_DB_PASS}@{SASSY_DB_HOST}:{SASSY_DB_PORT}/{SASSY_DB_NAME}')
+        engine = db_engine(_readonly=True, _database='SASSY')
         if iargs.verbose:
             print(f'engine = {engine}')
-        get_session = sessionmaker(bind=engine)
-        if iargs.verbose:
-            print(f'Session = {get_session}')
-        session = get_session()
+        session = sessionmaker(bind=engine)()
         if iargs.verbose:
             print(f'session = {session}')
     except Exception as e:
@@ -6,9 +6,10 @@
 # -
 from astropy.coordinates import SkyCoord
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import create_engine
 from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
+from dsrc.utils.names_resolve import names_resolve
+from dsrc.utils.disparu_db import db_engine
 
 import argparse
 import gzip
@@ -79,11 +80,6 @@ Description:
 # -
 DB_VARCHAR = 128
 #GWGC_GZIP_URL = 'http://cdsarc.u-strasbg.fr/ftp/VII/267/gwgc.dat.gz'
-DISPARU_DB_HOST = os.getenv('DISPARU_DB_HOST', None)
-DISPARU_DB_NAME = os.getenv('DISPARU_DB_NAME', None)
-DISPARU_DB_PASS = os.getenv('DISPARU_DB_PASS', None)
-DISPARU_DB_PORT = os.getenv('DISPARU_DB_PORT', None)
-DISPARU_DB_USER = os.getenv('DISPARU_DB_USER', None)
 SORT_ORDER = ['asc', 'desc', 'ascending', 'descending']
 SORT_VALUE = ['id', 'pgc', 'name', 'ra', 'dec', '']
 
@@ -92,10 +88,9 @@ SORT_VALUE = ['id', 'pgc', 'name', 'ra', 'dec', '']
 # (hidden) function: _get_astropy_coords()
 # -
 # noinspection PyBroadException
-def _get_astropy_coords(_oname=''):
+def _get_astropy_coords(_oname='', _session=None):
     try:
-        _obj = SkyCoord.from_name(_oname)
-        return _obj.ra.value, _obj.dec.value
+        return names_resolve(_oname, _session)
     except Exception:
         return math.nan, math.nan
 
@@ -174,7 +169,7 @@ def galaxies_filters(query, request_args):
     if request_args.get('astrocone'):
         try:
             _nam, _rad = request_args['astrocone'].split(',')
-            _ra, _dec = _get_astropy_coords(_nam.strip().upper())
+            _ra, _dec = _get_astropy_coords(_nam.strip().upper(), query.session)
             query = query.filter(func.q3c_radial_query(galaxiesRecord.ra, galaxiesRecord.dec, _ra, _dec, _rad))
         except Exception:
             pass
@@ -348,17 +343,10 @@ def galaxies_cli_db(iargs=None):
 
     # set up access to database
     try:
-        if iargs.verbose:
-            print(f'connecting via postgresql+psycopg2://'
-                  f'{DISPARU_DB_USER}:{DISPARU_DB_PASS}@{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        engine = create_engine(
-            f'postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
+        engine = db_engine(_readonly=True)
         if iargs.verbose:
             print(f'engine = {engine}')
-        get_session = sessionmaker(bind=engine)
-        if iargs.verbose:
-            print(f'Session = {get_session}')
-        session = get_session()
+        session = sessionmaker(bind=engine)()
         if iargs.verbose:
             print(f'session = {session}')
     except Exception as e:
@@ -4,23 +4,30 @@
 # +
 # import(s)
 # -
-from dsrc.models.disparu import candidatesRecord
+from dsrc.models.disparu import candidatesRecord, candidateBatchesRecord
 from dsrc.models.disparu import subtractionsRecord
 from dsrc.models.disparu import observationsRecord
 from dsrc.models.disparu import refsRecord
 from dsrc.models.disparu import galaxiesRecord
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dsrc.models.disparu import sourcesRecord
+from dsrc.utils.catalog_read import catalog_read
+from dsrc.utils.ingest_manifest import manifest_check, manifest_update
+from dsrc.utils.ingest_session import ingest_after_commit, ingest_unit
+from dsrc.utils.thumbnails import THUMBNAIL_SIZE, THUMBNAIL_STORE_DIR, make_thumbnail_batch, thumbnails_ingest
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
 
 import argparse
+import io
 import math
 import os
+import re
 import sys
 import glob
+import shutil
 import subprocess
+import tempfile
 import numpy as np
-from astropy.io import fits
-import matplotlib.pyplot as plt
 
 
 # +
@@ -53,27 +60,96 @@ CANDIDATES_FORMAT = {
     'diff2sciflux':   [174, 186,  'float',    'None',     'ratio of FLUX_APER to sciflux']
 }
 
-DISPARU_DB_HOST = os.getenv('DISPARU_DB_HOST', None)
-DISPARU_DB_USER = os.getenv('DISPARU_DB_USER', None)
-DISPARU_DB_PASS = os.getenv('DISPARU_DB_PASS', None)
-DISPARU_DB_NAME = os.getenv('DISPARU_DB_NAME', None)
-DISPARU_DB_PORT = os.getenv('DISPARU_DB_PORT', None)
+# text (_cand.cat) or binary FITS table, e.g. SExtractor FITS_LDAC (_cand.fits, _cand.ldac), catalogs
+CANDIDATES_SUFFIX = r'_cand\.(cat|fits|ldac)$'
+
+# catalog columns a FITS table must have, the others are filled with missing values: a candidate is
+# nothing without its number, position and aperture photometry
+CANDIDATES_REQUIRED = ['num', 'XWIN_IMAGE', 'YWIN_IMAGE', 'ALPHAWIN_J2000', 'DELTAWIN_J2000',
+                       'FLUX_APER', 'FLUXERR_APER', 'MAG_APER', 'MAGERR_APER']
+
+# candidates table column: catalog column
+CANDIDATES_COLUMNS = {
+    'xpos': 'XWIN_IMAGE',
+    'ypos': 'YWIN_IMAGE',
+    'ra': 'ALPHAWIN_J2000',
+    'dec': 'DELTAWIN_J2000',
+    'photflags': 'FLAGS',
+    'snr': 'snr',
+    'flux_aper': 'FLUX_APER',
+    'fluxerr_aper': 'FLUXERR_APER',
+    'mag_aper': 'MAG_APER',
+    'magerr_aper': 'MAGERR_APER',
+    'elongation': 'ELONGATION',
+    'fwhm_image': 'FWHM_IMAGE',
+    'class_star': 'CLASS_STAR',
+    'scorr_peak': 'Scorr_peak',
+    'sciflux': 'sciflux',
+    'diff2sciflux': 'diff2sciflux'
+}
+
 DISPARU_SRC = os.getenv('DISPARU_SRC', None)
 DISPARU_DATA = os.getenv('DISPARU_DATA', None)
 DISPARU_PUBLIC_SRC = os.getenv('DISPARU_PUBLIC_SRC', None)
 
 # +
-# function: subtractions_load()
+# function: candidates_copy()
+# -
+def candidates_copy(_session, _columns, _sub_id, _galaxy_id, _ispos=True):
+    """
+    Bulk insert parsed catalog rows with one COPY ... FROM STDIN. The ids are drawn from the
+    table's sequence first, in one query, so they are known without a round trip per row.
+    Runs in the session's transaction, the caller commits.
+
+    Parameters:
+        _session: database session
+        _columns (dict): parsed catalog columns keyed by CANDIDATES_FORMAT, see catalog_read()
+        _sub_id (int): subtraction id
+        _galaxy_id (int): galaxy id
+        _ispos (bool): Is this a positive (sci - ref) or negative (ref - sci) subtraction catalog.
+    Returns:
+        (list): ids of the inserted rows, in catalog order
+    """
+
+    _n = len(_columns['XWIN_IMAGE'])
+    if _n == 0:
+        return []
+    _ids = [_r[0] for _r in _session.execute(
+        text("SELECT nextval(pg_get_serial_sequence('candidates', 'id')) FROM generate_series(1, :n)"),
+        {'n': _n})]
+
+    # text format, PostgreSQL reads nan as NaN
+    _prefix = f"{_sub_id}\t{_galaxy_id}\t{'t' if _ispos else 'f'}"
+    _buffer = io.StringIO()
+    for _id, _row in zip(_ids, zip(*[_columns[_c].tolist() for _c in CANDIDATES_COLUMNS.values()])):
+        _buffer.write('\t'.join([f'{_id}', _prefix] + [f'{_v}' for _v in _row]) + '\n')
+    _buffer.seek(0)
+
+    _cursor = _session.connection().connection.cursor()
+    try:
+        _cursor.copy_expert(f"COPY candidates (id, sub_id, galaxy_id, ispos, {', '.join(CANDIDATES_COLUMNS)}) "
+                            f"FROM STDIN", _buffer)
+    finally:
+        _cursor.close()
+    return _ids
+
+
+# +
+# function: candidates_load()
 # -
-def candidates_load(_file='', _ispos=True):
+def candidates_load(_file='', _ispos=True, _thumbnails=False, _workers=1, _quiet=False, _session=None):
     """
     Loads a candidates catalog into the Disparu database. 
 
     Parameters:
-        _catalog_file (str): the input file to be loaded.
+        _catalog_file (str): the input file to be loaded, fixed-width text or a binary FITS table (FITS_LDAC).
         _ispos (bool): Is this a positive (sci - ref) or negative (ref - sci) subtraction catalog. 
+        _thumbnails (bool): pre-render the thumbnails, otherwise /thumbnail/ renders them on first request.
+        _workers (int): number of processes encoding the thumbnails.
+        _quiet (bool): only report errors.
+        _session: session of an ingest_unit() to join, default: a unit of work of its own
     Returns:
-    
+        (list): ids of the inserted candidates, empty if the catalog was already loaded and is unchanged
     """
     
     # check input(s)
@@ -84,122 +160,130 @@ def candidates_load(_file='', _ispos=True):
     #get basic image info
     _base_dir = os.path.dirname(_file).replace(DISPARU_DATA, '$DISPARU_DATA')
     _filename = os.path.basename(_file)
-    _diff_filename = _filename.replace('_cand.cat', '.fits')
-    _sub_filename = _filename.replace('_cand.cat', '.fits').replace('_negsub', '')
+    _diff_filename = re.sub(CANDIDATES_SUFFIX, '.fits', _filename)
+    _sub_filename = _diff_filename.replace('_negsub', '')
     _galaxy_name = _base_dir.split('/')[-3]
     #_inst = _base_dir.split('/')[-2]
     _version = _base_dir.split('/')[-1]
     _arcnum = _filename.split('arc')[1].split('_')[0]
-    print(_arcnum)
+    if not _quiet:
+        print(_arcnum)
     
-    # read contents of candidates catalog
-    with open(os.path.abspath(os.path.expanduser(_file)), 'r') as _fd:
-        _lines = set(_fd.readlines()[1:])
-
-    # get results
-    _all_results = []
-    for _i, _e in enumerate(_lines):
-        _this_result = {}
-        for _l in CANDIDATES_FORMAT:
-            _xoffset, _yoffset = CANDIDATES_FORMAT[_l][0], CANDIDATES_FORMAT[_l][1]
-            _value = _e[_xoffset:_yoffset].strip()
-            if CANDIDATES_FORMAT[_l][2].strip().lower() == 'int':
-                _this_result[_l] = -1 if _value == '' else int(_value)
-            elif CANDIDATES_FORMAT[_l][2].strip().lower() == 'float':
-                _this_result[_l] = float(math.nan) if _value == '' else float(_value)
-            else:
-                _this_result[_l] = _value
-            #_this_result['id'] = int(_i)  # let the database do this itself
-        _all_results.append(_this_result)
+    # skip a catalog that is unchanged since it was loaded without reading it, a changed one replaces its candidates
+    _state, _fingerprint = manifest_check(_file, 'candidates')
+    if _state == 'unchanged' and not _thumbnails:
+        if not _quiet:
+            print(f"Candidate catalog {_filename} {_version} is unchanged since it was loaded. Skipping.")
+        return []
     
-    # noinspection PyBroadException
-    try:
-        # connect to database
-        print(f'connection string = postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-              f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        engine = create_engine(f'postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-                               f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        get_session = sessionmaker(bind=engine)
-        session = get_session()
-    except Exception as e:
-        raise Exception(f'Failed to connect to database, error={e}')
+    # read contents of candidates catalog, in file order, a FITS table is read memory-mapped by column name
+    _all_results = catalog_read(_file, CANDIDATES_FORMAT, 1, CANDIDATES_REQUIRED) if _state != 'unchanged' else None
     
-    _galaxy_id = session.query(galaxiesRecord).filter(galaxiesRecord.name == _galaxy_name).first().id
-    _sub_id = session.query(subtractionsRecord).filter(subtractionsRecord.filename == _sub_filename,
-                                                       subtractionsRecord.base_dir == _base_dir,
-                                                       subtractionsRecord.version == _version).first().id                                    
-    #check if candidates have already been entered for this sub. 
-    _check_q = session.query(candidatesRecord).filter(candidatesRecord.galaxy_id == _galaxy_id, 
-                                                      candidatesRecord.sub_id == _sub_id,
-                                                      candidatesRecord.ispos == _ispos)
-    if session.query(_check_q.exists()).scalar():
-        print(f"Entries for candidate catalog {_filename} {_version} already exist. Skipping.")
-    else:
-        try:
-            for _record in _all_results:
-                _candidate = candidatesRecord(
-                                sub_id=_sub_id,
-                                galaxy_id=_galaxy_id, 
-                                xpos=_record['XWIN_IMAGE'],
-                                ypos=_record['YWIN_IMAGE'],
-                                ra=_record['ALPHAWIN_J2000'],
-                                dec=_record['DELTAWIN_J2000'],
-                                photflags=_record['FLAGS'],
-                                snr=_record['snr'],
-                                flux_aper=_record['FLUX_APER'],
-                                fluxerr_aper=_record['FLUXERR_APER'],
-                                mag_aper=_record['MAG_APER'],
-                                magerr_aper=_record['MAGERR_APER'],
-                                elongation=_record['ELONGATION'],
-                                fwhm_image=_record['FWHM_IMAGE'],
-                                class_star=_record['CLASS_STAR'],
-                                scorr_peak=_record['Scorr_peak'],
-                                sciflux=_record['sciflux'],
-                                diff2sciflux=_record['diff2sciflux'],
-                                ispos=_ispos)
-        
-                print(f'{_candidate.serialized()}')
-                # update database with results
-                this_xpos = _record['XWIN_IMAGE']
-                this_ypos = _record['YWIN_IMAGE']
-                print(f"Inserting {_galaxy_name} candidate from {_filename} {_version} at x={this_xpos}, y={this_ypos} into database.")
-                session.add(_candidate)
-            
-            session.commit()
-            print(f"Inserted {_galaxy_name} candidate catalog {_filename} {_version} into database.")
-        except Exception as e:
-            session.rollback()
-            raise Exception(f"Failed to insert {_galaxy_name} candidate catalog {_filename} {_version} into database, error={e}")
-            
-        
-    #make thumbnails
+    # the candidates of a catalog are one unit of work, or part of the caller's
+    with ingest_unit(_session) as session:
+        _galaxy_id = session.query(galaxiesRecord).filter(galaxiesRecord.name == _galaxy_name).first().id
+        _sub_id = session.query(subtractionsRecord).filter(subtractionsRecord.filename == _sub_filename,
+                                                           subtractionsRecord.base_dir == _base_dir,
+                                                           subtractionsRecord.version == _version).first().id                                    
+        # claim the (sub_id, ispos) batch first: a concurrent load of the same catalog waits on the row and then
+        # finds it taken, a changed catalog takes the row over and replaces its candidates
+        _ids = []
+        if _state == 'unchanged':
+            if not _quiet:
+                print(f"Entries for candidate catalog {_filename} {_version} already exist. Skipping.")
+        else:
+            try:
+                _batch = insert(candidateBatchesRecord.__table__).values(sub_id=_sub_id, galaxy_id=_galaxy_id,
+                                                                         ispos=_ispos)
+                if _state == 'changed':
+                    _batch = _batch.on_conflict_do_update(index_elements=['sub_id', 'ispos'], set_={'rows': None})
+                else:
+                    _batch = _batch.on_conflict_do_nothing(index_elements=['sub_id', 'ispos'])
+                _batch_id = session.execute(_batch.returning(candidateBatchesRecord.id)).scalar()
+                if _batch_id is None:
+                    _rows = session.query(candidateBatchesRecord.rows).filter(candidateBatchesRecord.sub_id == _sub_id,
+                                                                              candidateBatchesRecord.ispos == _ispos).scalar()
+                    if not _quiet:
+                        print(f"Entries for candidate catalog {_filename} {_version} already exist. Skipping.")
+                    ingest_after_commit(session, manifest_update, _file, 'candidates', _fingerprint, 'done', _rows)
+                else:
+                    if _state == 'changed':
+                        # saved sources keep their record, only the link to the old candidate is dropped
+                        if not _quiet:
+                            print(f"Candidate catalog {_filename} {_version} changed, replacing its candidates.")
+                        _old = session.query(candidatesRecord.id).filter(candidatesRecord.galaxy_id == _galaxy_id,
+                                                                         candidatesRecord.sub_id == _sub_id,
+                                                                         candidatesRecord.ispos == _ispos)
+                        session.query(sourcesRecord).filter(sourcesRecord.cand_id.in_(_old.subquery())).\
+                            update({sourcesRecord.cand_id: None}, synchronize_session=False)
+                        session.query(candidatesRecord).filter(candidatesRecord.galaxy_id == _galaxy_id,
+                                                               candidatesRecord.sub_id == _sub_id,
+                                                               candidatesRecord.ispos == _ispos).\
+                            delete(synchronize_session=False)
+                    _ids = candidates_copy(session, _all_results, _sub_id, _galaxy_id, _ispos)
+                    session.query(candidateBatchesRecord).filter(candidateBatchesRecord.id == _batch_id).\
+                        update({candidateBatchesRecord.rows: len(_ids)}, synchronize_session=False)
+                    ingest_after_commit(session, manifest_update, _file, 'candidates', _fingerprint, 'done', len(_ids))
+                    if not _quiet:
+                        for _id, _x, _y in zip(_ids, _all_results['XWIN_IMAGE'], _all_results['YWIN_IMAGE']):
+                            print(f"Inserted {_galaxy_name} candidate {_id} from {_filename} {_version} "
+                                  f"at x={_x}, y={_y} into database.")
+                        print(f"Inserted {_galaxy_name} candidate catalog {_filename} {_version} into database.")
+            except Exception as e:
+                manifest_update(_file, 'candidates', _fingerprint, 'failed')
+                raise Exception(f"Failed to insert {_galaxy_name} candidate catalog {_filename} {_version} into database, error={e}")
+
+        #make thumbnails once the candidates are committed, if asked to
+        if _thumbnails:
+            ingest_after_commit(session, _candidates_thumbnails, _sub_id, _ispos, _base_dir, _sub_filename,
+                                _diff_filename, _arcnum, _workers, _quiet)
+    return _ids
+
+
+# +
+# (hidden) function: _candidates_thumbnails()
+# -
+def _candidates_thumbnails(_sub_id=0, _ispos=True, _base_dir='', _sub_filename='', _diff_filename='', _arcnum='',
+                           _workers=1, _quiet=False):
+    """ render the thumbnails of the candidates of a subtraction catalog into the thumbnail store """
+
     #_thumb_path = os.path.join(_base_dir, 'candidate_thumbnails')
-    _thumb_path = os.path.expandvars(os.path.join(DISPARU_SRC, 'static/img/thumbnails'))
-    if not os.path.isdir(_thumb_path):
-        os.makedirs(_thumb_path)
+    if not os.path.isdir(THUMBNAIL_STORE_DIR):
+        os.makedirs(THUMBNAIL_STORE_DIR)
         
     #get all the candidates for this subtraction
-    _these_candidates = session.query(candidatesRecord).filter(candidatesRecord.sub_id == _sub_id,
-                                                               candidatesRecord.ispos == _ispos)
+    with ingest_unit() as session:
+        _these_candidates = session.query(candidatesRecord.id, candidatesRecord.xpos, candidatesRecord.ypos).\
+                                    filter(candidatesRecord.sub_id == _sub_id, candidatesRecord.ispos == _ispos).\
+                                    order_by(candidatesRecord.id).all()
         
     _sci_file = os.path.expandvars(os.path.join(_base_dir, _sub_filename.replace('_D', '')))
     _ref_file = glob.glob(os.path.expandvars(os.path.join(_base_dir, f'*ref_drc_sci_eps_arc{_arcnum}.fits')))[0]
     _diff_file = os.path.expandvars(os.path.join(_base_dir, _diff_filename))
     
-    print(_sci_file)
+    if not _quiet:
+        print(_sci_file)
                                                            
-    for _this_candidate in _these_candidates:
-        _cand_id = _this_candidate.id
-        _xcen = _this_candidate.xpos
-        _ycen = _this_candidate.ypos
-            
-        _label = f'id{_cand_id}'
-        try:
-            make_thumbnail_trio(_sci_file, _ref_file, _diff_file, _thumb_path, _xcen, _ycen, _size=50, _ext=0, label=_label)
-        except Exception as e:
-            raise Exception(f'failed to make thumbnails for candidate id {_cand_id}, error={e}')
-            
-        
+    _cand_ids, _xcens, _ycens = [], [], []
+    for _cand_id, _xcen, _ycen in _these_candidates:
+        _cand_ids.append(_cand_id)
+        _xcens.append(_xcen)
+        _ycens.append(_ycen)
+    
+    #open the three images once, cut every stamp from them and file the PNGs in the thumbnail store
+    _thumb_path = tempfile.mkdtemp(dir=THUMBNAIL_STORE_DIR)
+    try:
+        make_thumbnail_batch(_sci_file, _ref_file, _diff_file, _thumb_path, _xcens, _ycens,
+                             [f'id{_cand_id}' for _cand_id in _cand_ids], _size=THUMBNAIL_SIZE, _ext=0,
+                             _workers=_workers, _progress=not _quiet)
+        with ingest_unit() as session:
+            thumbnails_ingest(session, _thumb_path)
+    except Exception as e:
+        raise Exception(f'failed to make thumbnails for candidates of {_diff_filename}, error={e}')
+    finally:
+        shutil.rmtree(_thumb_path, ignore_errors=True)
+
+
 def str2bool(_in_str):
     """
     Take an input T/F string and output the boolean value.  
@@ -221,59 +305,6 @@ def str2bool(_in_str):
         'False', 'false', 'FALSE', 'no', 'NO', 'No', 'n', 'N', 'f', 'F'""")
         
 
-def make_thumbnail_trio(_sci_file, _ref_file, _diff_file, _out_dir, _xcen, _ycen, _size=50, _ext=0, label=''):
-    """
-    Create a sci/ref/diff thumbnail trio centered at _xcen, _ycen of _size pixels from input images.
-    
-    Parameters:
-        _sci_file (str): input science image fits file. 
-        _ref_file (str): input science image fits file. 
-        _diff_file (str): input science image fits file. 
-        _xcen (int): x position where thumbnail should be centered
-        _ycen (int): y position where thumbnail should be centered
-        _size (int): size of square in pixels for thumbnail 
-        _ext (int or str): fits extension to be read. 
-    
-    Returns:
-    
-    """
-    
-    out_sci = os.path.join(_out_dir, f"scithumb_x{int(_xcen)}_y{int(_ycen)}_{label}.png")
-    out_ref = os.path.join(_out_dir, f"refthumb_x{int(_xcen)}_y{int(_ycen)}_{label}.png")
-    out_diff = os.path.join(_out_dir, f"diffthumb_x{int(_xcen)}_y{int(_ycen)}_{label}.png")
-    
-    _sci_hdu = fits.open(_sci_file)
-    _sci_data = _sci_hdu[_ext].data
-    
-    _ref_hdu = fits.open(_ref_file)
-    _ref_data = _ref_hdu[_ext].data
-    
-    _diff_hdu = fits.open(_diff_file)
-    _diff_data = _diff_hdu[_ext].data
-    
-    _ymin = int(np.maximum(_ycen-_size/2, 0.0))
-    _ymax = int(np.minimum(_ycen+_size/2, np.shape(_sci_data)[0]))
-    _xmin = int(np.maximum(_xcen-_size/2, 0.0))
-    _xmax = int(np.minimum(_xcen+_size/2, np.shape(_sci_data)[1]))
-    
-    _sci_thumb =  _sci_data[_ymin:_ymax, _xmin:_xmax]
-    _ref_thumb =  _ref_data[_ymin:_ymax, _xmin:_xmax]
-    _diff_thumb =  _diff_data[_ymin:_ymax, _xmin:_xmax]
-
-    #sci and ref file should be scaled the same way for display.
-    _sciref_min = np.minimum(np.amin(_sci_thumb.flatten()), np.amin(_ref_thumb.flatten()))
-    _sciref_max = np.maximum(np.amax(_sci_thumb.flatten()), np.amax(_ref_thumb.flatten()))
-    
-    plt.imsave(out_sci, _sci_thumb, cmap='gray', vmin=_sciref_min, vmax=_sciref_max)
-    plt.imsave(out_ref, _ref_thumb, cmap='gray', vmin=_sciref_min, vmax=_sciref_max)
-    plt.imsave(out_diff, _diff_thumb, cmap='gray')
-    
-    _sci_hdu.close()
-    _ref_hdu.close()
-    _diff_hdu.close()
-
-
-        
 # +
 # main()
 # -
@@ -286,12 +317,15 @@ if __name__ == '__main__':
     _p.add_argument('-f', '--file', default=CANDIDATES_CATALOG_FILE, help="""Input file [%(default)s]""")
     _p.add_argument('--ispos', default='True', help=""" [%(default)s]""")
     _p.add_argument('--copy', default='True', help=""" [%(default)s]""")
+    _p.add_argument('--thumbnails', default=False, action='store_true', help='if present, pre-render the thumbnails')
+    _p.add_argument('--workers', default=1, type=int, help="""Thumbnail encoding processes [%(default)s]""")
+    _p.add_argument('--quiet', default=False, action='store_true', help='if present, only report errors')
     args = _p.parse_args()
     
     _ispos = str2bool(args.ispos)
     
     # execute
     if (args.file and args.ispos):
-        candidates_load(args.file.strip(), _ispos)
+        candidates_load(args.file.strip(), _ispos, bool(args.thumbnails), int(args.workers), bool(args.quiet))
     else:
         print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
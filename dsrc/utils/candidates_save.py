@@ -14,8 +14,9 @@ from dsrc.models.disparu import observationsRecord
 from dsrc.models.disparu import refsRecord
 from dsrc.models.disparu import galaxiesRecord
 from dsrc.models.disparu import sourcesRecord
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dsrc.models.disparu import AUTO_TYPES
+from dsrc.utils.sources_match import SOURCE_MATCH_RADIUS, source_index_get, source_index_add
+from dsrc.utils.disparu_db import db_session
 
 import argparse
 import math
@@ -38,13 +39,7 @@ __doc__ = """
 # +
 # constant(s)
 # -
-DISPARU_DB_HOST = os.getenv('DISPARU_DB_HOST', None)
-DISPARU_DB_USER = os.getenv('DISPARU_DB_USER', None)
-DISPARU_DB_PASS = os.getenv('DISPARU_DB_PASS', None)
-DISPARU_DB_NAME = os.getenv('DISPARU_DB_NAME', None)
-DISPARU_DB_PORT = os.getenv('DISPARU_DB_PORT', None)
 
-SOURCE_MATCH_RADIUS = 0.05 #arcsec, one ACS/WFC pixel
 
 # +
 # function: subtractions_load()
@@ -66,12 +61,7 @@ def candidates_save(_cand_id: int, _type: str):
     # noinspection PyBroadException
     try:
         # connect to database
-        print(f'connection string = postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-              f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        engine = create_engine(f'postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-                               f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        get_session = sessionmaker(bind=engine)
-        session = get_session()
+        session = db_session()
     except Exception as e:
         raise Exception(f'Failed to connect to database, error={e}')
     
@@ -81,27 +71,20 @@ def candidates_save(_cand_id: int, _type: str):
         sys.exit()
     
     #check if a matching sorce already exists
-    _c_coord = SkyCoord(ra=_c_query.ra*u.degree, dec=_c_query.dec*u.degree)
-    
-    _g_s_query = session.query(sourcesRecord).filter(sourcesRecord.galaxy_id==_c_query.galaxy_id)
-    _g_s_results = sourcesRecord.serialize_list([row for row in _g_s_query.all()])
-    _g_s_ra = np.array([_g_source['ra'] for _g_source in _g_s_results])
-    _g_s_dec = np.array([_g_source['dec'] for _g_source in _g_s_results])
-    _g_s_coord = SkyCoord(ra=_g_s_ra*u.degree, dec=_g_s_dec*u.degree)
-    _g_s_matches = np.where(_g_s_coord.separation(_c_coord) <= SOURCE_MATCH_RADIUS*u.arcsec)[0]
+    _g_s_index = source_index_get(session, [_c_query.galaxy_id], _refresh=True)[_c_query.galaxy_id]
+    _g_s_matches = _g_s_index.match(_c_query.ra, _c_query.dec, SOURCE_MATCH_RADIUS)
     
     if len(_g_s_matches) > 0:
         print(f"Found {len(_g_s_matches)} matching source(s) in database:")
-        for match_ix in _g_s_matches:
-            print(_g_s_results[match_ix]['name'])
+        for _g_s_name in _g_s_matches:
+            print(_g_s_name)
         print("Candidate not saved as new source.")
         
     else:
         #name the source
         _g_query = session.query(galaxiesRecord).filter(galaxiesRecord.id==_c_query.galaxy_id).first()
         _g_name = _g_query.name
-        _g_s_query = session.query(sourcesRecord).filter(sourcesRecord.galaxy_id==_c_query.galaxy_id).all()
-        _g_s_num = len(_g_s_query) + 1
+        _g_s_num = len(_g_s_index) + 1
         _s_name = f"{_g_name}_DS{_g_s_num}"
         
         print(f"Saving candidate {_cand_id} to database as {_s_name}.")
@@ -132,6 +115,7 @@ def candidates_save(_cand_id: int, _type: str):
             print(f'{_source.serialized()}')
             session.add(_source)
             session.commit()
+            source_index_add(_source.galaxy_id, _source.id, _source.name, _source.ra, _source.dec)
             print(f"Successfully saved candidate {_cand_id} to database as {_s_name}.")
             
         except Exception as e:
@@ -140,6 +124,33 @@ def candidates_save(_cand_id: int, _type: str):
     
     
 
+def get_candidate_types(_ispos, _sciflux, _diff2sciflux):
+    """
+    Determine the types (VarStar, Transient, DispStar) of many candidates at once
+    based on their candidate data. This is the NumPy form of candidatesRecord.auto_type,
+    used for offline batches. Missing values behave as SQL NULLs.
+
+    Parameters:
+        _ispos (array-like): candidate ispos flags
+        _sciflux (array-like): candidate science fluxes
+        _diff2sciflux (array-like): candidate difference to science flux ratios
+    Returns:
+        _s_types (numpy.ndarray): source types.
+    """
+    
+    _c_ispos = np.array(_ispos, dtype=object).astype(bool)
+    _c_sciflux = np.array(_sciflux, dtype=np.float64)
+    _c_diff2sciflux = np.array(_diff2sciflux, dtype=np.float64)
+    
+    #if a disappearing source: faded by half compared to an archival counterpart -> DispStar, otherwise -> VarStar
+    #if a brightening source, no archival counterpart, or brightened by factor of 2 -> Transient
+    #Otherwise a variable
+    with np.errstate(invalid='ignore'):
+        _conditions = [_c_ispos & (_c_diff2sciflux >= 0.5),
+                       _c_ispos,
+                       (_c_sciflux == -99.99) | (_c_diff2sciflux >= 1.0)]
+    return np.select(_conditions, [AUTO_TYPES[2], AUTO_TYPES[0], AUTO_TYPES[1]], default=AUTO_TYPES[0]).astype(object)
+
 def get_source_type(_c_query):
     """
     Determine the type (VarStar, Transient, DispStar, Junk) of a candidate
@@ -151,29 +162,9 @@ def get_source_type(_c_query):
         _s_type (str): source type.
     """
     
-    _c_ispos = _c_query.ispos
-    _c_sciflux = _c_query.sciflux
-    _c_diff2sciflux = _c_query.diff2sciflux
-    
-    
-    #if a disappearing source
-    if _c_ispos:
-        #if faded by half compared to an archival counterpart -> DispStar
-        if _c_diff2sciflux >= 0.5:
-            _s_type = 'DispStar'
-        
-        #otherwhise -> VarStar
-        else:
-            _s_type = 'VarStar'
-    
-    #if a brightening source, no archival counterpart, or brightened by factor of 2 -> Transient
-    elif (_c_sciflux == -99.99) or (_c_diff2sciflux >= 1.0):
-        _s_type = 'Transient'
-    #Otherwise a variable
-    else:
-         _s_type = 'VarStar'
-    
-    return(_s_type)
+    if getattr(_c_query, 'auto_type', None) is not None:
+        return _c_query.auto_type
+    return get_candidate_types([_c_query.ispos], [_c_query.sciflux], [_c_query.diff2sciflux])[0]
 
 def get_candidate_type(_c_query):
     """
@@ -186,29 +177,9 @@ def get_candidate_type(_c_query):
         _s_type (str): source type.
     """
     
-    _c_ispos = _c_query['ispos']
-    _c_sciflux = _c_query['sciflux']
-    _c_diff2sciflux = _c_query['diff2sciflux']
-    
-    
-    #if a disappearing source
-    if _c_ispos:
-        #if faded by half compared to an archival counterpart -> DispStar
-        if _c_diff2sciflux >= 0.5:
-            _s_type = 'DispStar'
-        
-        #otherwhise -> VarStar
-        else:
-            _s_type = 'VarStar'
-    
-    #if a brightening source, no archival counterpart, or brightened by factor of 2 -> Transient
-    elif (_c_sciflux == -99.99) or (_c_diff2sciflux >= 1.0):
-        _s_type = 'Transient'
-    #Otherwise a variable
-    else:
-         _s_type = 'VarStar'
-    
-    return(_s_type)
+    if _c_query.get('auto_type') is not None:
+        return _c_query['auto_type']
+    return get_candidate_types([_c_query['ispos']], [_c_query['sciflux']], [_c_query['diff2sciflux']])[0]
         
 # +
 # main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from astropy.io import fits
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.catalog_read import catalog_read, catalog_records
+    from dsrc.utils.catalog_read import catalog_read_fits
+    % python3 catalog_read.py --help
+"""
+
+
+# +
+# constant(s)
+# -
+CATALOG_MISSING = {'int': -1, 'float': np.nan}
+
+# format column: SExtractor column, where the names differ
+CATALOG_FITS_ALIASES = {'num': 'NUMBER'}
+CATALOG_FITS_EXTNAME = 'LDAC_OBJECTS'
+
+
+# +
+# function: catalog_is_fits()
+# -
+def catalog_is_fits(_file=''):
+    """ return True if a file is FITS (e.g. a SExtractor FITS_LDAC catalog) rather than text """
+    with open(_file, 'rb') as _fd:
+        return _fd.read(9) == b'SIMPLE  ='
+
+
+# +
+# function: catalog_read_fits()
+# -
+def catalog_read_fits(_file='', _format=None, _required=None):
+    """
+    Read the columns of a _format from a binary FITS table, memory-mapped, without going
+    through text. The table is the LDAC_OBJECTS extension of a FITS_LDAC catalog, or else
+    the first binary table. A vector column (e.g. FLUX_APER of several apertures) gives its
+    first element. A _required column the table does not have is an error, any other is
+    filled with the missing value.
+
+    Parameters:
+        _file (str): input file
+        _format (dict): {column: [start, end, type, unit, description]}, as for catalog_read()
+        _required (list): columns of _format the table must have, e.g. positions and fluxes
+    Returns:
+        (dict): {column: numpy.ndarray}, in _format order
+    """
+
+    with fits.open(_file, memmap=True) as _hdul:
+        _tables = [_h for _h in _hdul if isinstance(_h, fits.BinTableHDU)]
+        _table = next((_h for _h in _tables if _h.name == CATALOG_FITS_EXTNAME), _tables[0] if _tables else None)
+        if _table is None:
+            raise Exception(f'invalid input, no binary table in _file={_file}')
+        _data, _names = _table.data, {_n.upper(): _n for _n in _table.columns.names}
+        _missing = [_n for _n in (_required or []) if CATALOG_FITS_ALIASES.get(_n, _n).upper() not in _names]
+        if _missing:
+            raise Exception(f'invalid input, no column(s) {_missing} in _file={_file}')
+
+        _columns = {}
+        for _name, _spec in _format.items():
+            _type = _spec[2].strip().lower()
+            _fits_name = _names.get(CATALOG_FITS_ALIASES.get(_name, _name).upper())
+            if _fits_name is None:
+                if _type in CATALOG_MISSING:
+                    _columns[_name] = np.full(len(_data), CATALOG_MISSING[_type],
+                                              dtype=np.int64 if _type == 'int' else np.float64)
+                else:
+                    _columns[_name] = np.full(len(_data), '', dtype=str)
+                continue
+            _values = _data[_fits_name]
+            if _values.ndim > 1:
+                _values = _values.reshape(len(_values), -1)[:, 0]
+            # copies to native byte order, the memory map is closed on return
+            if _type == 'int':
+                _columns[_name] = _values.astype(np.int64)
+            elif _type == 'float':
+                _columns[_name] = _values.astype(np.float64)
+            else:
+                _columns[_name] = np.char.strip(_values.astype(str))
+    return _columns
+
+
+# +
+# function: catalog_read()
+# -
+def catalog_read(_file='', _format=None, _skip=0, _required=None):
+    """
+    Parse a fixed-width text catalog into one NumPy array per column in a single pass over
+    the file. Rows keep their file order, duplicates included, and blank lines are skipped.
+    Missing 'int' values are -1 and missing 'float' values NaN, other columns are strings.
+    A FITS catalog is read by catalog_read_fits() instead.
+
+    Parameters:
+        _file (str): input file
+        _format (dict): {column: [start, end, type, unit, description]}, e.g. GALAXIES_FORMAT
+        _skip (int): number of header lines, ignored for FITS
+        _required (list): columns a FITS table must have, see catalog_read_fits()
+    Returns:
+        (dict): {column: numpy.ndarray}, in _format order
+    """
+
+    # check input(s)
+    _file = os.path.abspath(os.path.expanduser(os.path.expandvars(_file)))
+    if not os.path.exists(_file):
+        raise Exception(f'invalid input, _file={_file}')
+    if not isinstance(_format, dict) or len(_format) == 0:
+        raise Exception(f'invalid input, _format={_format}')
+    if catalog_is_fits(_file):
+        return catalog_read_fits(_file, _format, _required)
+
+    with open(_file, 'r') as _fd:
+        _lines = [_l for _l in _fd.read().splitlines()[_skip:] if _l.strip() != '']
+
+    # one fixed-width character grid, offsets are in characters as before
+    _width = max(int(_v[1]) for _v in _format.values())
+    _grid = np.array(_lines, dtype=f'U{_width}').view(np.uint32).reshape(len(_lines), _width)
+
+    _columns = {}
+    for _name, _spec in _format.items():
+        _start, _end, _type = int(_spec[0]), int(_spec[1]), _spec[2].strip().lower()
+        _cells = np.char.strip(np.ascontiguousarray(_grid[:, _start:_end]).view(f'U{_end - _start}').ravel())
+        if _type in CATALOG_MISSING:
+            _dtype = np.int64 if _type == 'int' else np.float64
+            _values = np.full(len(_cells), CATALOG_MISSING[_type], dtype=_dtype)
+            _present = _cells != ''
+            try:
+                _values[_present] = _cells[_present].astype(_dtype)
+            except ValueError as e:
+                raise Exception(f'invalid {_type} in column {_name} of {_file}, error={e}')
+            _columns[_name] = _values
+        else:
+            _columns[_name] = _cells.astype(str)
+    return _columns
+
+
+# +
+# function: catalog_records()
+# -
+def catalog_records(_columns):
+    """ return the rows of catalog_read() output as a list of dictionaries of Python values, in file order """
+    _names = list(_columns)
+    return [dict(zip(_names, _row)) for _row in zip(*[_columns[_n].tolist() for _n in _names])]
+
+
+# +
+# main()
+# -
+if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _p = argparse.ArgumentParser(description='Time the fixed-width reader on a candidates catalog',
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    _p.add_argument('-f', '--file', default='', help="""Input file [%(default)s]""")
+    _p.add_argument('--skip', default=1, type=int, help="""Header lines [%(default)s]""")
+    args = _p.parse_args()
+
+    # execute
+    if args.file.strip():
+        from dsrc.utils.candidates_load import CANDIDATES_FORMAT
+        _start = time.perf_counter()
+        _cols = catalog_read(args.file.strip(), CANDIDATES_FORMAT, int(args.skip))
+        print(f'{len(next(iter(_cols.values())))} rows in {time.perf_counter() - _start:.3f}s')
+    else:
+        print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
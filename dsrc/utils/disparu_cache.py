@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from sqlalchemy import text
+
+import os
+import threading
+import time
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.disparu_cache import candidates_count
+"""
+
+
+# +
+# constant(s)
+# -
+CACHE_GENERATION_CHECK = float(os.getenv('DISPARU_CACHE_GENERATION_CHECK', 10.0)) #seconds
+COUNT_CACHE_TTL = float(os.getenv('DISPARU_COUNT_CACHE_TTL', 300.0)) #seconds
+COUNT_ESTIMATE_THRESHOLD = int(os.getenv('DISPARU_COUNT_ESTIMATE_THRESHOLD', 100000))
+COUNT_MODES = ['exact', 'estimated', 'auto']
+FACET_CACHE_TTL = float(os.getenv('DISPARU_FACET_CACHE_TTL', 3600.0)) #seconds
+FACET_FILTERED_CACHE_SIZE = int(os.getenv('DISPARU_FACET_FILTERED_CACHE_SIZE', 256))
+FACET_FILTERED_CACHE_TTL = float(os.getenv('DISPARU_FACET_FILTERED_CACHE_TTL', 60.0)) #seconds
+
+# the loaders commit new candidates and subtractions with new serial ids, so the largest ids change whenever
+# another process loads data, two index lookups
+CACHE_GENERATION_SQL = 'SELECT (SELECT max(id) FROM candidates), (SELECT max(id) FROM subtractions)'
+
+# request arguments that do not change which rows a query returns
+UNFILTERED_ARGS = ['count', 'cursor', 'fields', 'format', 'page', 'sprites',
+                   'sort_order', 'sort_value', 'gal_sort_order', 'gal_sort_value',
+                   'source_sort_order', 'source_sort_value', 'sub_sort_order', 'sub_sort_value']
+
+
+# +
+# class: TTLCache()
+# -
+class TTLCache(object):
+    """ thread-safe in-process cache whose entries expire after ttl seconds """
+
+    # +
+    # method: __init__
+    # -
+    def __init__(self, ttl=300.0, maxsize=4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.__entries = {}
+        self.__lock = threading.Lock()
+
+    # +
+    # method: get()
+    # -
+    def get(self, key, default=None):
+        with self.__lock:
+            _entry = self.__entries.get(key)
+            if _entry is None:
+                return default
+            if (time.time() - _entry[0]) >= self.ttl:
+                self.__entries.pop(key, None)
+                return default
+            return _entry[1]
+
+    # +
+    # method: set()
+    # -
+    def set(self, key, value):
+        with self.__lock:
+            if len(self.__entries) >= self.maxsize and key not in self.__entries:
+                self.__entries.pop(min(self.__entries, key=lambda _k: self.__entries[_k][0]), None)
+            self.__entries[key] = (time.time(), value)
+
+    # +
+    # method: invalidate()
+    # -
+    def invalidate(self, key=None):
+        """ drop one entry, or every entry if key is None """
+        with self.__lock:
+            if key is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(key, None)
+
+
+# +
+# cache(s)
+# -
+_COUNT_CACHE = TTLCache(ttl=COUNT_CACHE_TTL)
+_GENERATION = {'value': None, 'checked': 0.0}
+_GENERATION_LOCK = threading.Lock()
+_FACET_CACHE = TTLCache(ttl=FACET_CACHE_TTL)
+_FACET_FILTERED_CACHE = TTLCache(ttl=FACET_FILTERED_CACHE_TTL, maxsize=FACET_FILTERED_CACHE_SIZE)
+
+
+# +
+# function: normalize_args()
+# -
+def normalize_args(request_args, ignore=UNFILTERED_ARGS):
+    """ return a hashable, order-independent key for the filter arguments of a request """
+    return tuple(sorted((str(_k), str(_v).strip()) for _k, _v in request_args.items()
+                        if _k not in ignore and str(_v).strip() != ''))
+
+
+# +
+# function: cache_generation()
+# -
+def cache_generation(session):
+    """
+    Check, at most every CACHE_GENERATION_CHECK seconds, whether data was loaded since the
+    cached entries were computed. The loaders run in other processes and cannot reach this
+    process's memory, so the app compares the database's generation, the largest candidate
+    and subtraction ids, with the one it last saw and drops every cached entry when it moved.
+
+    Parameters:
+        session: database session
+    Returns:
+        (tuple): the current generation
+    """
+
+    with _GENERATION_LOCK:
+        if _GENERATION['value'] is not None and (time.time() - _GENERATION['checked']) < CACHE_GENERATION_CHECK:
+            return _GENERATION['value']
+    _value = tuple(session.execute(text(CACHE_GENERATION_SQL)).first())
+    with _GENERATION_LOCK:
+        if _GENERATION['value'] is not None and _value != _GENERATION['value']:
+            candidates_count_invalidate()
+            facets_invalidate()
+        _GENERATION['value'], _GENERATION['checked'] = _value, time.time()
+    return _value
+
+
+# +
+# function: query_estimate()
+# -
+def query_estimate(query):
+    """ return the PostgreSQL planner's row estimate for a query via EXPLAIN """
+    _session = query.session
+    _compiled = query.order_by(None).statement.compile(dialect=_session.get_bind().dialect)
+    _cursor = _session.connection().connection.cursor()
+    try:
+        _cursor.execute(f'EXPLAIN (FORMAT JSON) {_compiled}', _compiled.params)
+        _plan = _cursor.fetchone()[0]
+    finally:
+        _cursor.close()
+    return int(_plan[0]['Plan']['Plan Rows'])
+
+
+# +
+# function: candidates_count()
+# -
+def candidates_count(query, request_args, mode=COUNT_MODES[0]):
+    """
+    Count the rows of a filtered candidates query, caching the result by the
+    normalized filter arguments.
+
+    Parameters:
+        query: filtered query
+        request_args (dict): the request arguments used to build the query
+        mode (str): 'exact' for COUNT(*), 'estimated' for the planner estimate, or
+                    'auto' for the estimate when it exceeds COUNT_ESTIMATE_THRESHOLD
+    Returns:
+        _total (int): number of rows
+        _exact (bool): True if _total is an exact count
+    """
+
+    mode = mode.lower() if isinstance(mode, str) and mode.lower() in COUNT_MODES else COUNT_MODES[0]
+    _key = normalize_args(request_args)
+    cache_generation(query.session)
+
+    # an exact count is always the best answer
+    _total = _COUNT_CACHE.get(('exact', _key))
+    if _total is not None:
+        return _total, True
+
+    if mode != 'exact':
+        _estimate = _COUNT_CACHE.get(('estimated', _key))
+        if _estimate is None:
+            _estimate = query_estimate(query)
+            _COUNT_CACHE.set(('estimated', _key), _estimate)
+        if mode == 'estimated' or _estimate >= COUNT_ESTIMATE_THRESHOLD:
+            return _estimate, False
+
+    _total = query.order_by(None).count()
+    _COUNT_CACHE.set(('exact', _key), _total)
+    return _total, True
+
+
+# +
+# function: candidates_count_set()
+# -
+def candidates_count_set(request_args, total):
+    """ record an exact count that was found for free, e.g. from a short first page """
+    _COUNT_CACHE.set(('exact', normalize_args(request_args)), total)
+
+
+# +
+# function: candidates_count_invalidate()
+# -
+def candidates_count_invalidate():
+    """ drop every cached count, called by cache_generation() when new candidates were loaded """
+    _COUNT_CACHE.invalidate()
+
+
+# +
+# function: facets_get()
+# -
+def facets_get(session, request_args, compute):
+    """
+    Return the facets for a request from memory, computing them on a miss. The unfiltered
+    facets, what most page views ask for, are kept for FACET_CACHE_TTL seconds; those of a
+    filter combination are rarely asked for twice, so they are kept apart, for
+    FACET_FILTERED_CACHE_TTL seconds and at most FACET_FILTERED_CACHE_SIZE of them.
+
+    Parameters:
+        session: database session, for cache_generation()
+        request_args (dict): the request arguments
+        compute (callable): returns the facets for request_args
+    Returns:
+        the cached or computed facets
+    """
+    _key = normalize_args(request_args)
+    _cache = _FACET_CACHE if len(_key) == 0 else _FACET_FILTERED_CACHE
+    cache_generation(session)
+    _facets = _cache.get(_key)
+    if _facets is None:
+        _facets = compute()
+        _cache.set(_key, _facets)
+    return _facets
+
+
+# +
+# function: facets_invalidate()
+# -
+def facets_invalidate():
+    """ drop every cached facet, called by cache_generation() when subtractions or candidates were loaded """
+    _FACET_CACHE.invalidate()
+    _FACET_FILTERED_CACHE.invalidate()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import argparse
+import os
+import sys
+import threading
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.disparu_db import db_engine, db_session
+    _session = db_session()
+    _session = db_session(_readonly=True)
+    _session = db_session(_database='SASSY')
+    % python3 disparu_db.py --help
+"""
+
+
+# +
+# constant(s)
+# -
+DB_DATABASES = ['DISPARU', 'SASSY']
+DB_MAX_OVERFLOW = int(os.getenv('DISPARU_DB_MAX_OVERFLOW', 10))
+DB_POOL_PRE_PING = os.getenv('DISPARU_DB_POOL_PRE_PING', 'true').strip().lower() in ['1', 'true', 'yes']
+DB_POOL_RECYCLE = int(os.getenv('DISPARU_DB_POOL_RECYCLE', 1800)) #seconds
+DB_POOL_SIZE = int(os.getenv('DISPARU_DB_POOL_SIZE', 5))
+DB_POOL_TIMEOUT = int(os.getenv('DISPARU_DB_POOL_TIMEOUT', 30)) #seconds
+DB_STATEMENT_TIMEOUT = int(os.getenv('DISPARU_DB_STATEMENT_TIMEOUT', 0)) #milliseconds, 0 for none
+DB_RO_STATEMENT_TIMEOUT = int(os.getenv('DISPARU_DB_RO_STATEMENT_TIMEOUT', DB_STATEMENT_TIMEOUT)) #milliseconds
+
+
+# +
+# engine state, one pool per database and process
+# -
+_DB_ENGINES = {}
+_DB_INHERITED = []
+_DB_LOCK = threading.Lock()
+_DB_PID = None
+
+
+# +
+# function: db_replica()
+# -
+def db_replica(_database=DB_DATABASES[0]):
+    """ return True if <_database>_DB_RO_HOST names a read-only replica """
+    return bool(os.getenv(f'{_database}_DB_RO_HOST', '').strip())
+
+
+# +
+# function: db_url()
+# -
+def db_url(_readonly=False, _database=DB_DATABASES[0]):
+    """
+    Return the connection string of a database from its <_database>_DB_* environment
+    variables. A read-only URL points at <_database>_DB_RO_HOST and _RO_PORT if they are set.
+
+    Parameters:
+        _readonly (bool): the replica, if there is one
+        _database (str): one of DB_DATABASES
+    Returns:
+        (str): connection string
+    """
+
+    # check input(s)
+    if _database not in DB_DATABASES:
+        raise Exception(f'invalid input, _database={_database}')
+
+    _host = os.getenv(f'{_database}_DB_HOST', None)
+    _port = os.getenv(f'{_database}_DB_PORT', None)
+    if _readonly and db_replica(_database):
+        _host = os.getenv(f'{_database}_DB_RO_HOST')
+        _port = os.getenv(f'{_database}_DB_RO_PORT', _port)
+    return f'postgresql+psycopg2://{os.getenv(f"{_database}_DB_USER", None)}:' \
+           f'{os.getenv(f"{_database}_DB_PASS", None)}@{_host}:{_port}/{os.getenv(f"{_database}_DB_NAME", None)}'
+
+
+# +
+# function: db_engine_options()
+# -
+def db_engine_options(_readonly=False):
+    """
+    Return the create_engine() keyword arguments for the pool settings of DISPARU_DB_*: pool
+    size, overflow, pre-ping, recycle and timeout, and the server-side statement timeout. A
+    read-only engine also opens its connections with default_transaction_read_only on.
+
+    Parameters:
+        _readonly (bool): options for the read-only engine
+    Returns:
+        (dict): keyword arguments, also valid as SQLALCHEMY_ENGINE_OPTIONS
+    """
+
+    _options = {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_MAX_OVERFLOW, 'pool_pre_ping': DB_POOL_PRE_PING,
+                'pool_recycle': DB_POOL_RECYCLE, 'pool_timeout': DB_POOL_TIMEOUT}
+    _settings = []
+    _timeout = DB_RO_STATEMENT_TIMEOUT if _readonly else DB_STATEMENT_TIMEOUT
+    if _timeout > 0:
+        _settings.append(f'-c statement_timeout={_timeout}')
+    if _readonly:
+        _settings.append('-c default_transaction_read_only=on')
+    if _settings:
+        _options['connect_args'] = {'options': ' '.join(_settings)}
+    return _options
+
+
+# +
+# function: db_engine()
+# -
+def db_engine(_readonly=False, _database=DB_DATABASES[0]):
+    """
+    Return this process's engine for a database, created on first use and again in a forked
+    child, so every session of a process draws on one pool. Without a replica the read-only
+    engine is the primary one.
+
+    Parameters:
+        _readonly (bool): the engine of the replica, if there is one
+        _database (str): one of DB_DATABASES
+    Returns:
+        the engine
+    """
+
+    global _DB_PID
+    _readonly = bool(_readonly) and db_replica(_database)
+    with _DB_LOCK:
+        if _DB_PID != os.getpid():
+            # a forked child must not close the sockets its parent still uses: drop the inherited
+            # pools without closing them and keep them referenced so their connections are never
+            # garbage-collected here, dispose(close=False) only exists from SQLAlchemy 1.4.33
+            for _engine in _DB_ENGINES.values():
+                try:
+                    _engine.dispose(close=False)
+                except TypeError:
+                    pass
+                _DB_INHERITED.append(_engine)
+            _DB_ENGINES.clear()
+            _DB_PID = os.getpid()
+        if (_database, _readonly) not in _DB_ENGINES:
+            _DB_ENGINES[(_database, _readonly)] = create_engine(db_url(_readonly, _database),
+                                                                **db_engine_options(_readonly))
+        return _DB_ENGINES[(_database, _readonly)]
+
+
+# +
+# function: db_session()
+# -
+def db_session(_readonly=False, _database=DB_DATABASES[0]):
+    """ return a new session on this process's engine for a database, the caller closes it """
+    return sessionmaker(bind=db_engine(_readonly, _database))()
+
+
+# +
+# main()
+# -
+if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _p = argparse.ArgumentParser(description='Check the database engine settings',
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    _p.add_argument('-d', '--database', default=DB_DATABASES[0],
+                    help=f"""Database, one of {DB_DATABASES} [%(default)s]""")
+    _p.add_argument('--readonly', default=False, action='store_true', help='if present, use the read-only engine')
+    args = _p.parse_args()
+
+    # execute
+    if args.database.strip().upper() in DB_DATABASES:
+        _database = args.database.strip().upper()
+        _engine = db_engine(bool(args.readonly), _database)
+        print(f'engine = {_engine}, options = {db_engine_options(bool(args.readonly) and db_replica(_database))}')
+        with _engine.connect() as _connection:
+            print(f"server = {_connection.execute(text('SELECT version()')).scalar()}")
+    else:
+        print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
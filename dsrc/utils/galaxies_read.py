@@ -5,8 +5,8 @@
 # import(s)
 # -
 from dsrc.models.disparu import galaxiesRecord
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dsrc.utils.catalog_read import catalog_read, catalog_records
+from dsrc.utils.disparu_db import db_session
 
 import argparse
 import math
@@ -38,11 +38,6 @@ GALAXIES_FORMAT = {
     'dm_ref':    [73,   92,  'string',  'None',    'ADS bibcode for distance reference']
 }
 
-DISPARU_DB_HOST = os.getenv('DISPARU_DB_HOST', None)
-DISPARU_DB_USER = os.getenv('DISPARU_DB_USER', None)
-DISPARU_DB_PASS = os.getenv('DISPARU_DB_PASS', None)
-DISPARU_DB_NAME = os.getenv('DISPARU_DB_NAME', None)
-DISPARU_DB_PORT = os.getenv('DISPARU_DB_PORT', None)
 
 
 # +
@@ -55,35 +50,13 @@ def galaxies_read(_file=''):
     if not isinstance(_file, str) or not os.path.exists(_file):
         raise Exception(f'invalid input, _file={_file}')
 
-    # read contents
-    with open(os.path.abspath(os.path.expanduser(_file)), 'r') as _fd:
-        _lines = set(_fd.readlines())
-
-    # get results
-    _all_results = []
-    for _i, _e in enumerate(_lines):
-        _this_result = {}
-        for _l in GALAXIES_FORMAT:
-            _xoffset, _yoffset = GALAXIES_FORMAT[_l][0], GALAXIES_FORMAT[_l][1]
-            _value = _e[_xoffset:_yoffset].strip()
-            if GALAXIES_FORMAT[_l][2].strip().lower() == 'int':
-                _this_result[_l] = -1 if _value == '' else int(_value)
-            elif GALAXIES_FORMAT[_l][2].strip().lower() == 'float':
-                _this_result[_l] = float(math.nan) if _value == '' else float(_value)
-            else:
-                _this_result[_l] = _value
-            #_this_result['id'] = int(_i)  # let the database do this itself
-        _all_results.append(_this_result)
+    # read contents, in file order
+    _all_results = catalog_records(catalog_read(_file, GALAXIES_FORMAT))
 
     # noinspection PyBroadException
     try:
         # connect to database
-        print(f'connection string = postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-              f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        engine = create_engine(f'postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-                               f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        get_session = sessionmaker(bind=engine)
-        session = get_session()
+        session = db_session()
     except Exception as e:
         raise Exception(f'Failed to connect to database, error={e}')
 
@@ -5,8 +5,8 @@
 # import(s)
 # -
 from dsrc.models.gwgc_q3c import GwgcQ3cRecord
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dsrc.utils.catalog_read import catalog_read, catalog_records
+from dsrc.utils.disparu_db import db_session
 
 import argparse
 import math
@@ -47,11 +47,6 @@ GWGC_FORMAT = {
     'e_BMAG': [144, 148,  'float',   'mag'      'Error in absolute blue magnitude']
 }
 
-SASSY_DB_HOST = os.getenv('SASSY_DB_HOST', None)
-SASSY_DB_USER = os.getenv('SASSY_DB_USER', None)
-SASSY_DB_PASS = os.getenv('SASSY_DB_PASS', None)
-SASSY_DB_NAME = os.getenv('SASSY_DB_NAME', None)
-SASSY_DB_PORT = os.getenv('SASSY_DB_PORT', None)
 
 
 # +
@@ -64,35 +59,15 @@ def gwgc_q3c_read(_file=''):
     if not isinstance(_file, str) or not os.path.exists(_file):
         raise Exception(f'invalid input, _file={_file}')
 
-    # read contents
-    with open(os.path.abspath(os.path.expanduser(_file)), 'r') as _fd:
-        _lines = set(_fd.readlines())
-
-    # get results
-    _all_results = []
-    for _i, _e in enumerate(_lines):
-        _this_result = {}
-        for _l in GWGC_FORMAT:
-            _xoffset, _yoffset = GWGC_FORMAT[_l][0], GWGC_FORMAT[_l][1]
-            _value = _e[_xoffset:_yoffset].strip()
-            if GWGC_FORMAT[_l][2].strip().lower() == 'int':
-                _this_result[_l] = -1 if _value == '' else int(_value)
-            elif GWGC_FORMAT[_l][2].strip().lower() == 'float':
-                _this_result[_l] = float(math.nan) if _value == '' else float(_value)
-            else:
-                _this_result[_l] = _value
-            _this_result['id'] = int(_i)
-        _all_results.append(_this_result)
+    # read contents, in file order
+    _all_results = catalog_records(catalog_read(_file, GWGC_FORMAT))
+    for _i, _this_result in enumerate(_all_results):
+        _this_result['id'] = int(_i)
 
     # noinspection PyBroadException
     try:
         # connect to database
-        print(f'connection string = postgresql+psycopg2://{SASSY_DB_USER}:{SASSY_DB_PASS}@'
-              f'{SASSY_DB_HOST}:{SASSY_DB_PORT}/{SASSY_DB_NAME}')
-        engine = create_engine(f'postgresql+psycopg2://{SASSY_DB_USER}:{SASSY_DB_PASS}@'
-                               f'{SASSY_DB_HOST}:{SASSY_DB_PORT}/{SASSY_DB_NAME}')
-        get_session = sessionmaker(bind=engine)
-        session = get_session()
+        session = db_session(_database='SASSY')
     except Exception as e:
         raise Exception(f'Failed to connect to database, error={e}')
 
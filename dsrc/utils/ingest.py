@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from dsrc.utils.candidates_load import CANDIDATES_SUFFIX, candidates_load
+from dsrc.utils.ingest_manifest import manifest_check
+from dsrc.utils.ingest_session import ingest_unit
+from dsrc.utils.observations_load import observations_load
+from dsrc.utils.refs_load import refs_load
+from dsrc.utils.subtractions_load import subtraction_images, subtractions_load
+from dsrc.utils.thumbnails import thumbnails_render
+
+import argparse
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.ingest import ingest, subtraction_ingest
+    % python3 ingest.py --help
+"""
+
+
+# +
+# constant(s)
+# -
+DISPARU_DATA = os.getenv('DISPARU_DATA', None)
+INGEST_STAGES = ['refs', 'observations', 'subtractions', 'candidates', 'thumbnails']
+INGEST_SUBTRACTION = r'_D\.fits$'
+
+
+# +
+# function: ingest_plan()
+# -
+def ingest_plan(_root=DISPARU_DATA, _galaxies=None, _thumbnails=False):
+    """
+    Walk <_root>/<galaxy>/<inst>/<version>/ and return the tasks that load it, in INGEST_STAGES
+    order. A task is a dictionary of 'key', 'stage', 'file', 'ispos', 'candidates' and 'after',
+    the keys of the tasks it depends on. The references and observations named by the
+    subtraction records are tasks of their own, one per file however many subtractions share
+    it, that the subtractions depend on. A subtraction task is a unit of work with its candidate
+    catalogs, see subtraction_ingest(). Only a catalog without a subtraction in the tree is a
+    candidates task of its own.
+
+    Parameters:
+        _root (str): data directory
+        _galaxies (list): only these galaxies, default: all
+        _thumbnails (bool): add one thumbnails task per galaxy
+    Returns:
+        (list): tasks
+    """
+
+    # check input(s)
+    _root = os.path.abspath(os.path.expanduser(os.path.expandvars(_root or '')))
+    if not os.path.isdir(_root):
+        raise Exception(f'invalid input, _root={_root}')
+
+    _tasks = {}
+
+    def _add(_stage, _file, _ispos=True, _after=None, _key=None):
+        _key = _key or f'{_stage}:{_file}'
+        if _key not in _tasks:
+            _tasks[_key] = {'key': _key, 'stage': _stage, 'file': _file, 'ispos': _ispos, 'candidates': [],
+                            'after': list(_after or [])}
+        return _key
+
+    for _galaxy in sorted(os.listdir(_root)):
+        if not os.path.isdir(os.path.join(_root, _galaxy)) or (_galaxies and _galaxy not in _galaxies):
+            continue
+        _galaxy_tasks = []
+        for _dir, _, _files in sorted(os.walk(os.path.join(_root, _galaxy))):
+            # only <galaxy>/<inst>/<version>/
+            if len(os.path.relpath(_dir, _root).split(os.sep)) != 3:
+                continue
+            _subtractions = {}
+            for _f in sorted(_files):
+                if not re.search(INGEST_SUBTRACTION, _f) or '_negsub' in _f:
+                    continue
+                # a subtraction without a readable record fails in its own task, with the loader's error
+                _after = []
+                try:
+                    _ref_file, _obs_file = subtraction_images(os.path.join(_dir, _f))
+                    _after = [_add('refs', os.path.abspath(_ref_file)), _add('observations', os.path.abspath(_obs_file))]
+                except Exception:
+                    pass
+                _subtractions[_f] = _add('subtractions', os.path.join(_dir, _f), _after=_after)
+            for _f in sorted(_files):
+                if not re.search(CANDIDATES_SUFFIX, _f):
+                    continue
+                _sub = _subtractions.get(re.sub(CANDIDATES_SUFFIX, '.fits', _f).replace('_negsub', ''))
+                if _sub:
+                    _tasks[_sub]['candidates'].append([os.path.join(_dir, _f), '_negsub' not in _f])
+                    if _sub not in _galaxy_tasks:
+                        _galaxy_tasks.append(_sub)
+                else:
+                    _galaxy_tasks.append(_add('candidates', os.path.join(_dir, _f), '_negsub' not in _f))
+        if _thumbnails and _galaxy_tasks:
+            _add('thumbnails', _galaxy, _after=_galaxy_tasks, _key=f'thumbnails:{_galaxy}')
+
+    return sorted(_tasks.values(), key=lambda _t: INGEST_STAGES.index(_t['stage']))
+
+
+# +
+# function: ingest_task_done()
+# -
+def ingest_task_done(_task=None):
+    """
+    Return True if the ingest manifest table records every file of a task as loaded and
+    unchanged, see manifest_check(): a reference, an observation, a subtraction with its
+    candidate catalogs, or a catalog of its own. The loaders write that table when their unit of work commits, so it is the one
+    record of what is loaded. A thumbnails task is never done, it only renders what is missing.
+    """
+    if _task['stage'] in ['refs', 'observations']:
+        return manifest_check(_task['file'], _task['stage'])[0] == 'unchanged'
+    if _task['stage'] == 'subtractions':
+        return manifest_check(_task['file'], 'subtractions')[0] == 'unchanged' and \
+            all(manifest_check(_c, 'candidates')[0] == 'unchanged' for _c, _ in _task['candidates'])
+    if _task['stage'] == 'candidates':
+        return manifest_check(_task['file'], 'candidates')[0] == 'unchanged'
+    return False
+
+
+# +
+# function: subtraction_ingest()
+# -
+def subtraction_ingest(_file='', _candidates=None, _verbose=False):
+    """
+    Load a subtraction as one unit of work: the subtraction and its candidate catalogs share one
+    session and one transaction on this process's pooled engine, so either all of them are
+    committed or, if any fails, none. Its reference and observation are loaded and committed by
+    the earlier stages of ingest(), so the subtractions that share them run in parallel.
+
+    Parameters:
+        _file (str): subtraction image
+        _candidates (list): [catalog, ispos] of its candidate catalogs
+        _verbose (bool): show the output of the loaders
+    Returns:
+        (list): ids of the inserted candidates
+    """
+
+    _ids = []
+    with ingest_unit() as _session:
+        subtractions_load(_file, _session=_session)
+        for _catalog, _ispos in _candidates or []:
+            _ids += candidates_load(_catalog, _ispos, _quiet=not _verbose, _session=_session)
+    return _ids
+
+
+# +
+# (hidden) function: _ingest_task()
+# -
+def _ingest_task(_stage, _file, _ispos=True, _candidates=None, _verbose=False):
+    """ worker process, runs one task and returns its duration in seconds """
+    _start = time.time()
+    _out = contextlib.nullcontext() if _verbose else contextlib.redirect_stdout(io.StringIO())
+    with _out:
+        if _stage == 'refs':
+            refs_load(_file)
+        elif _stage == 'observations':
+            observations_load(_file)
+        elif _stage == 'subtractions':
+            subtraction_ingest(_file, _candidates, _verbose)
+        elif _stage == 'candidates':
+            candidates_load(_file, _ispos, _quiet=not _verbose)
+        elif _stage == 'thumbnails':
+            thumbnails_render(_file, 1)
+        else:
+            raise Exception(f'invalid input, _stage={_stage}')
+    return time.time() - _start
+
+
+# +
+# function: ingest()
+# -
+def ingest(_root=DISPARU_DATA, _galaxies=None, _workers=1, _thumbnails=False, _dry_run=False, _verbose=False):
+    """
+    Load a whole data tree in one process pool: the tasks of ingest_plan() run stage by stage,
+    those of a stage in parallel, each worker on one pooled connection. A run that is
+    interrupted, or has failures, resumes where it stopped: tasks whose files the ingest
+    manifest table records as loaded and unchanged are skipped, see ingest_task_done(), and
+    tasks whose dependencies have not succeeded are left for the next run.
+
+    Parameters:
+        _root (str): data directory
+        _galaxies (list): only these galaxies, default: all
+        _workers (int): number of worker processes
+        _thumbnails (bool): render the thumbnails of each galaxy after its candidates
+        _dry_run (bool): print the tasks that would run
+        _verbose (bool): show the output of the loaders
+    Returns:
+        (dict): number of tasks per status
+    """
+
+    _plan = ingest_plan(_root, _galaxies, _thumbnails)
+    _done = {_t['key'] for _t in _plan if ingest_task_done(_t)}
+    _counts = {'done': 0, 'failed': 0, 'blocked': 0, 'skipped': sum(1 for _t in _plan if _t['key'] in _done)}
+    print(f'ingest: {len(_plan)} tasks in {_root}, {_counts["skipped"]} already done')
+
+    if _dry_run:
+        for _t in _plan:
+            if _t['key'] not in _done:
+                print(f"Dry-Run> {_t['stage']} {_t['file']}" + ('' if _t['ispos'] else ' --ispos=False') +
+                      ''.join(f' + {os.path.basename(_c)}' for _c, _ in _t['candidates']))
+        return _counts
+
+    with ProcessPoolExecutor(max_workers=max(_workers, 1)) as _pool:
+        for _stage in INGEST_STAGES:
+            _todo = [_t for _t in _plan if _t['stage'] == _stage and _t['key'] not in _done]
+            _ready = [_t for _t in _todo if all(_a in _done for _a in _t['after'])]
+            _counts['blocked'] += len(_todo) - len(_ready)
+            _futures = {_pool.submit(_ingest_task, _t['stage'], _t['file'], _t['ispos'], _t['candidates'],
+                                     _verbose): _t for _t in _ready}
+            for _i, _future in enumerate(as_completed(_futures)):
+                _t, _error, _seconds = _futures[_future], '', 0.0
+                try:
+                    _seconds = _future.result()
+                    _status = 'done'
+                    _done.add(_t['key'])
+                except Exception as e:
+                    _status, _error = 'failed', f'{e}'
+                _counts[_status] += 1
+                print(f"ingest: {_stage} {_i + 1}/{len(_ready)} {_status} {_t['file']} in {_seconds:.3f}s" +
+                      (f', error={_error}' if _error else ''))
+
+    print(f'ingest: {_counts}')
+    return _counts
+
+
+# +
+# main()
+# -
+if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _p = argparse.ArgumentParser(description='Load a whole DISPARU_DATA tree into the database',
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    _p.add_argument('-d', '--data', default=DISPARU_DATA, help="""Data directory [%(default)s]""")
+    _p.add_argument('-g', '--galaxy', default='', help="""Comma separated galaxy names, default: all""")
+    _p.add_argument('--workers', default=os.cpu_count() or 1, type=int, help="""Worker processes [%(default)s]""")
+    _p.add_argument('--thumbnails', default=False, action='store_true', help='if present, render the thumbnails')
+    _p.add_argument('--dry-run', default=False, action='store_true', help='if present, show (but do not run) tasks')
+    _p.add_argument('--verbose', default=False, action='store_true', help='if present, show the loaders output')
+    args = _p.parse_args()
+
+    # execute
+    if args.data:
+        _counts = ingest(args.data.strip(), [_g.strip() for _g in args.galaxy.split(',') if _g.strip()] or None,
+                         int(args.workers), bool(args.thumbnails), bool(args.dry_run), bool(args.verbose))
+        sys.exit(1 if _counts['failed'] or _counts['blocked'] else 0)
+    else:
+        print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
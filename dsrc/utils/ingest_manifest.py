@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from dsrc.models.disparu import ingestManifestRecord
+from dsrc.utils.disparu_db import db_session
+from sqlalchemy.dialects.postgresql import insert
+
+import argparse
+import datetime
+import hashlib
+import os
+import sys
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.ingest_manifest import manifest_check, manifest_update
+    % python3 ingest_manifest.py --help
+"""
+
+
+# +
+# constant(s)
+# -
+DISPARU_DATA = os.getenv('DISPARU_DATA', None)
+MANIFEST_STATES = ['new', 'unchanged', 'changed']
+
+
+# +
+# function: manifest_path()
+# -
+def manifest_path(_file=''):
+    """ return the manifest key of a file, with $DISPARU_DATA put back in as for base_dir """
+    _file = os.path.abspath(os.path.expanduser(os.path.expandvars(_file)))
+    return _file.replace(DISPARU_DATA, '$DISPARU_DATA') if DISPARU_DATA else _file
+
+
+# +
+# function: file_sha256()
+# -
+def file_sha256(_file='', _chunk=1024**2):
+    """ return the SHA-256 of a file's content """
+    _hash = hashlib.sha256()
+    with open(_file, 'rb') as _fd:
+        for _block in iter(lambda: _fd.read(_chunk), b''):
+            _hash.update(_block)
+    return _hash.hexdigest()
+
+
+# +
+# function: manifest_check()
+# -
+# noinspection PyBroadException
+def manifest_check(_file='', _loader=''):
+    """
+    Compare a file with what the manifest recorded when _loader last loaded it. An unchanged
+    size and mtime is one stat() and one indexed lookup; only if they differ is the content
+    hashed, so a file that was merely touched still counts as unchanged. Without a manifest
+    table every file is 'new' and the loaders behave as before.
+
+    Parameters:
+        _file (str): input file
+        _loader (str): loader name, e.g. 'candidates'
+    Returns:
+        _state (str): one of MANIFEST_STATES
+        _fingerprint (dict): 'size', 'mtime' and, if it was needed, 'sha256', for manifest_update()
+    """
+
+    _stat = os.stat(os.path.expandvars(_file))
+    _fingerprint = {'size': _stat.st_size, 'mtime': _stat.st_mtime, 'sha256': None}
+    _session = None
+    try:
+        _session = db_session()
+        _entry = _session.query(ingestManifestRecord).filter(ingestManifestRecord.path == manifest_path(_file),
+                                                             ingestManifestRecord.loader == _loader).first()
+        if _entry is None or _entry.status != 'done':
+            return MANIFEST_STATES[0], _fingerprint
+        if _entry.size == _fingerprint['size'] and _entry.mtime == _fingerprint['mtime']:
+            return MANIFEST_STATES[1], _fingerprint
+        _fingerprint['sha256'] = file_sha256(os.path.expandvars(_file))
+        if _fingerprint['sha256'] != _entry.sha256:
+            return MANIFEST_STATES[2], _fingerprint
+        # same content, remember the new mtime so the next check is a stat() again
+        _entry.mtime = _fingerprint['mtime']
+        _session.commit()
+        return MANIFEST_STATES[1], _fingerprint
+    except Exception:
+        if _session is not None:
+            _session.rollback()
+        return MANIFEST_STATES[0], _fingerprint
+    finally:
+        # a session per call, so a forked worker never inherits one that is in use
+        if _session is not None:
+            _session.close()
+
+
+# +
+# function: manifest_update()
+# -
+# noinspection PyBroadException
+def manifest_update(_file='', _loader='', _fingerprint=None, _status='done', _rows=None):
+    """
+    Record the outcome of loading a file. A manifest that cannot be written only costs a
+    full check next time, so failures are ignored.
+
+    Parameters:
+        _file (str): input file
+        _loader (str): loader name, e.g. 'candidates'
+        _fingerprint (dict): from manifest_check(), default: taken now
+        _status (str): 'done' or 'failed'
+        _rows (int): number of rows the file gave
+    """
+
+    _fingerprint = dict(_fingerprint or {})
+    if not _fingerprint.get('size') or not _fingerprint.get('mtime'):
+        _stat = os.stat(os.path.expandvars(_file))
+        _fingerprint['size'], _fingerprint['mtime'] = _stat.st_size, _stat.st_mtime
+    if _fingerprint.get('sha256') is None:
+        _fingerprint['sha256'] = file_sha256(os.path.expandvars(_file))
+
+    _values = {'path': manifest_path(_file), 'loader': _loader, 'size': _fingerprint['size'],
+               'mtime': _fingerprint['mtime'], 'sha256': _fingerprint['sha256'], 'status': _status,
+               'rows': _rows, 'update_date': datetime.datetime.utcnow()}
+    _session = None
+    try:
+        _session = db_session()
+        _stmt = insert(ingestManifestRecord.__table__).values(_values)
+        _session.execute(_stmt.on_conflict_do_update(index_elements=['path', 'loader'],
+                                                     set_={_k: _stmt.excluded[_k] for _k in _values
+                                                           if _k not in ['path', 'loader']}))
+        _session.commit()
+    except Exception:
+        if _session is not None:
+            _session.rollback()
+    finally:
+        if _session is not None:
+            _session.close()
+
+
+# +
+# main()
+# -
+if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _p = argparse.ArgumentParser(description='Show the ingest manifest state of files',
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    _p.add_argument('files', nargs='*', help="""Input file(s)""")
+    _p.add_argument('-l', '--loader', default='candidates', help="""Loader name [%(default)s]""")
+    args = _p.parse_args()
+
+    # execute
+    if args.files:
+        for _f in args.files:
+            print(f'{_f}: {manifest_check(_f, args.loader)[0]}')
+    else:
+        print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
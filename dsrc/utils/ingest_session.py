@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from dsrc.utils.disparu_db import db_session
+
+import contextlib
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.ingest_session import ingest_after_commit, ingest_unit
+    with ingest_unit() as _session:
+        subtractions_load(_file, _session=_session)
+"""
+
+
+# +
+# constant(s)
+# -
+INGEST_AFTER_COMMIT = 'ingest_after_commit'
+
+
+# +
+# function: ingest_after_commit()
+# -
+def ingest_after_commit(_session=None, _callback=None, *_args):
+    """ run _callback(*_args) once the unit of work of an ingest_unit() session commits, never if it rolls back """
+    _session.info.setdefault(INGEST_AFTER_COMMIT, []).append((_callback, _args))
+
+
+# +
+# function: ingest_unit()
+# -
+@contextlib.contextmanager
+def ingest_unit(_session=None):
+    """
+    Unit of work for the loaders. Without _session, open a session on this process's pooled
+    engine, see db_engine(), commit it when the block ends or roll it back if the block raises,
+    then run what was registered with ingest_after_commit(), e.g. manifest updates and cache
+    invalidation. With _session, the block joins that unit of work and its owner commits or
+    rolls back.
+
+    Parameters:
+        _session: session of an enclosing ingest_unit(), default: a new unit of work
+    Returns:
+        (context manager): yields the session
+    """
+
+    if _session is not None:
+        yield _session
+        return
+
+    _session = db_session()
+    try:
+        yield _session
+        _session.commit()
+        _callbacks = _session.info.pop(INGEST_AFTER_COMMIT, [])
+    except BaseException:
+        _session.rollback()
+        raise
+    finally:
+        _session.close()
+    for _callback, _args in _callbacks:
+        _callback(*_args)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from astropy.coordinates import SkyCoord
+from astropy.coordinates.name_resolve import sesame_database, sesame_url
+from dsrc.utils.disparu_db import db_engine, db_session
+from sqlalchemy import text
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.names_resolve import names_resolve
+    % python3 names_resolve.py --help
+"""
+
+
+# +
+# constant(s)
+# -
+RESOLVER_CACHE_FILE = os.getenv('DISPARU_RESOLVER_CACHE',
+                                os.path.join(os.getenv('DISPARU_ETC', os.path.expanduser('~')), 'names_resolve.json'))
+# gwgc_q3c_read.py loads the GWGC into the SASSY database with ra in hours, as the catalog gives it (RAhour)
+RESOLVER_GWGC_DATABASE = 'SASSY'
+RESOLVER_GWGC_RA_SCALE = 15.0 #degrees per hour
+RESOLVER_CATALOG_TTL = float(os.getenv('DISPARU_RESOLVER_CATALOG_TTL', 3600.0)) #seconds
+RESOLVER_MISS_TTL = float(os.getenv('DISPARU_RESOLVER_MISS_TTL', 600.0)) #seconds
+RESOLVER_NETWORK = os.getenv('DISPARU_RESOLVER_NETWORK', 'true').lower() in ['1', 'true', 't', 'yes', 'y']
+
+
+# +
+# resolver state, guarded by one lock
+# -
+_CATALOG = {}
+_CATALOG_LOADED = 0.0
+_DISK_CACHE = None
+_MISSES = {}
+_RESOLVER_LOCK = threading.RLock()
+
+
+# +
+# function: names_normalize()
+# -
+def names_normalize(name=''):
+    """ return a lookup key for a name, e.g. 'ngc 0628', 'NGC_628' and 'NGC628' all give 'NGC628' """
+    if not isinstance(name, str):
+        name = f'{name}'
+    _name = re.sub(r'[\s_\-]+', '', name.strip().upper())
+    return re.sub(r'(?<=[A-Z])0+(?=\d)', '', _name)
+
+
+# +
+# (hidden) function: _catalog_load()
+# -
+def _catalog_load(_session):
+    """ read the names and PGC numbers of the galaxies and gwgc_q3c tables into a dictionary """
+    _catalog = {}
+
+    # the GWGC is in the SASSY database, which may not be configured or may not have the table
+    # noinspection PyBroadException
+    try:
+        with db_engine(True, RESOLVER_GWGC_DATABASE).connect() as _connection:
+            if _connection.execute(text("SELECT to_regclass('gwgc_q3c')")).scalar() is not None:
+                for _name, _pgc, _ra, _dec in _connection.execute(text('SELECT name, pgc, ra, dec FROM gwgc_q3c')):
+                    if _ra is None or _dec is None:
+                        continue
+                    if _pgc is not None and _pgc > 0:
+                        _catalog[names_normalize(f'PGC{_pgc}')] = (_ra * RESOLVER_GWGC_RA_SCALE, _dec)
+                    if _name:
+                        _catalog[names_normalize(_name)] = (_ra * RESOLVER_GWGC_RA_SCALE, _dec)
+    except Exception:
+        pass
+
+    # the project's own galaxies take precedence
+    with _session.get_bind().connect() as _connection:
+        for _name, _pgc, _ra, _dec in _connection.execute(text('SELECT name, pgc, ra, dec FROM galaxies')):
+            if _pgc:
+                _pgc = names_normalize(_pgc)
+                _catalog[_pgc if _pgc.startswith('PGC') else f'PGC{_pgc}'] = (_ra, _dec)
+            if _name:
+                _catalog[names_normalize(_name)] = (_ra, _dec)
+
+    return _catalog
+
+
+# +
+# (hidden) function: _disk_cache()
+# -
+# noinspection PyBroadException
+def _disk_cache():
+    """ return the persistent cache of earlier network lookups, reading it on first use """
+    global _DISK_CACHE
+    if _DISK_CACHE is None:
+        try:
+            with open(RESOLVER_CACHE_FILE, 'r') as _fd:
+                _DISK_CACHE = {_k: tuple(_v) for _k, _v in json.load(_fd).items()}
+        except Exception:
+            _DISK_CACHE = {}
+    return _DISK_CACHE
+
+
+# +
+# (hidden) function: _disk_cache_save()
+# -
+# noinspection PyBroadException
+def _disk_cache_save():
+    """ write the persistent cache atomically, a failure only costs a later network lookup """
+    try:
+        _tmp = f'{RESOLVER_CACHE_FILE}.{os.getpid()}.tmp'
+        with open(_tmp, 'w') as _fd:
+            json.dump(_DISK_CACHE, _fd, indent=0, sort_keys=True)
+        os.replace(_tmp, RESOLVER_CACHE_FILE)
+    except Exception:
+        pass
+
+
+# +
+# (hidden) function: _sesame_resolve()
+# -
+def _sesame_resolve(name='', timeout=0.0):
+    """ return (ra, dec) from Sesame as SkyCoord.from_name() does, within timeout seconds over all servers, or None """
+    _db = sesame_database.get().upper()[0]
+    _db = 'SNV' if _db == 'A' else _db
+    _expires = time.time() + timeout
+    for _url in sesame_url.get():
+        _left = _expires - time.time()
+        if _left <= 0.0:
+            break
+        try:
+            with urllib.request.urlopen(f"{_url.rstrip('/')}/{_db}?{urllib.parse.quote(name)}", timeout=_left) as _fd:
+                _data = _fd.read().decode('utf-8', 'replace')
+        except OSError:
+            continue
+        _match = re.search(r'%J\s*([0-9.]+)\s*([+\-.0-9]+)', _data)
+        if _match is None:
+            raise Exception(f'invalid input, name={name} is unknown to Sesame')
+        return float(_match.group(1)), float(_match.group(2))
+    return None
+
+
+# +
+# function: names_resolve()
+# -
+# noinspection PyBroadException
+def names_resolve(name='', session=None, network=RESOLVER_NETWORK, timeout=None):
+    """
+    Resolve an object name to co-ordinates without a network round trip where possible.
+    Names are looked up, after normalization, in the galaxies table and the SASSY database's
+    gwgc_q3c table (read once per RESOLVER_CATALOG_TTL), then in the on-disk cache of earlier lookups, and only
+    then through Sesame, whose answers are added to the on-disk cache.
+
+    Parameters:
+        name (str): object name, e.g. 'NGC1365' or 'PGC 13179'
+        session: database session used to read the catalogs, optional
+        network (bool): fall back to SkyCoord.from_name() for unknown names
+        timeout (float): seconds the network lookup may take, default: astropy's remote_timeout per server
+    Returns:
+        (ra, dec) in degrees, or (nan, nan) if the name is unknown
+    """
+
+    global _CATALOG, _CATALOG_LOADED
+    _key = names_normalize(name)
+    if _key == '':
+        return math.nan, math.nan
+
+    # catalogs
+    if session is not None and (time.time() - _CATALOG_LOADED) >= RESOLVER_CATALOG_TTL:
+        try:
+            _catalog = _catalog_load(session)
+            with _RESOLVER_LOCK:
+                _CATALOG, _CATALOG_LOADED = _catalog, time.time()
+        except Exception:
+            with _RESOLVER_LOCK:
+                _CATALOG_LOADED = time.time() - RESOLVER_CATALOG_TTL + RESOLVER_MISS_TTL
+    with _RESOLVER_LOCK:
+        if _key in _CATALOG:
+            return _CATALOG[_key]
+
+        # earlier lookups
+        _cache = _disk_cache()
+        if _key in _cache:
+            return _cache[_key]
+
+        # recent failures are not retried
+        if not network or (time.time() - _MISSES.get(_key, 0.0)) < RESOLVER_MISS_TTL:
+            return math.nan, math.nan
+
+    # network, a lookup that runs out of time is not a miss
+    try:
+        if timeout is None:
+            _obj = SkyCoord.from_name(name)
+            _coords = (float(_obj.ra.value), float(_obj.dec.value))
+        else:
+            _coords = _sesame_resolve(name, timeout)
+            if _coords is None:
+                return math.nan, math.nan
+    except Exception:
+        with _RESOLVER_LOCK:
+            _MISSES[_key] = time.time()
+        return math.nan, math.nan
+
+    with _RESOLVER_LOCK:
+        _disk_cache()[_key] = _coords
+        _disk_cache_save()
+    return _coords
+
+
+# +
+# main()
+# -
+if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _p = argparse.ArgumentParser(description='Resolve object names to co-ordinates.',
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    _p.add_argument('names', nargs='+', help="""Object name(s)""")
+    _p.add_argument('--offline', default=False, action='store_true', help='if present, do not use the network')
+    args = _p.parse_args()
+
+    # connect to database, the catalogs are skipped if that fails
+    # noinspection PyBroadException
+    try:
+        session = db_session(_readonly=True)
+    except Exception:
+        session = None
+
+    # execute
+    for _n in args.names:
+        _ra, _dec = names_resolve(_n, session, not args.offline)
+        print(f'{_n}: ra={_ra}, dec={_dec}')
+    sys.exit(0)
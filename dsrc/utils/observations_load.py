@@ -4,11 +4,11 @@
 # +
 # import(s)
 # -
-from dsrc.models.disparu import observationsRecord
+from dsrc.models.disparu import observationsRecord, record_upsert
 from dsrc.models.disparu import galaxiesRecord
 from dsrc.utils.disparu_instruments import ACS_utils, WFC3_UVIS_utils
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dsrc.utils.ingest_manifest import manifest_check, manifest_update
+from dsrc.utils.ingest_session import ingest_after_commit, ingest_unit
 
 import argparse
 import math
@@ -26,24 +26,20 @@ __doc__ = """
 # -
 OBSERVATION_FILE = os.path.abspath(os.path.expanduser('/Users/jacobjencson/HST_FSNe/data/observations/NGC1058/WFC3_UVIS/v200812/f814w_20131213_WFC3-UVIS_arc1_drc.fits'))
 
-DISPARU_DB_HOST = os.getenv('DISPARU_DB_HOST', None)
-DISPARU_DB_USER = os.getenv('DISPARU_DB_USER', None)
-DISPARU_DB_PASS = os.getenv('DISPARU_DB_PASS', None)
-DISPARU_DB_NAME = os.getenv('DISPARU_DB_NAME', None)
-DISPARU_DB_PORT = os.getenv('DISPARU_DB_PORT', None)
 DISPARU_DATA = os.getenv('DISPARU_DATA', None)
 
 # +
 # function: galaxies_read()
 # -
-def observations_load(_file=''):
+def observations_load(_file='', _session=None):
     """
     Loads an observation into the Disparu database. 
 
     Parameters:
         _file (str): the input fits file to be loaded.
+        _session: session of an ingest_unit() to join, default: a unit of work of its own
     Returns:
-        
+        _obs_id (int): id of the observation, also if the file was skipped as unchanged
 
     """
     
@@ -58,6 +54,17 @@ def observations_load(_file=''):
     _galaxy_name = _base_dir.split('/')[-3]
     _inst = _base_dir.split('/')[-2]
     _version = _base_dir.split('/')[-1]
+
+    # skip a file that is unchanged since it was loaded without opening it, unless its row is gone (e.g. recreated tables)
+    _state, _fingerprint = manifest_check(_file, 'observations')
+    if _state == 'unchanged':
+        with ingest_unit(_session) as session:
+            _obs = session.query(observationsRecord.id).filter(observationsRecord.filename == _filename,
+                                                               observationsRecord.base_dir == _base_dir).first()
+        if _obs is not None:
+            print(f"Observation {_file} is unchanged since it was loaded. Skipping.")
+            return _obs.id
+        print(f"Observation {_file} is unchanged since it was loaded but not in the database. Reloading.")
     
     if _inst == 'WFC3_UVIS':
         _record = WFC3_UVIS_utils().get_WFC3_UVIS_img_info(_file)
@@ -66,50 +73,32 @@ def observations_load(_file=''):
         _record = ACS_utils().get_ACS_img_info(_file)
         _filter = ACS_utils.get_ACS_filter_name(_record['filter1'], _record['filter2'])
     
-    # noinspection PyBroadException
-    try:
-        # connect to database
-        print(f'connection string = postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-              f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        engine = create_engine(f'postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-                               f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        get_session = sessionmaker(bind=engine)
-        session = get_session()
-    except Exception as e:
-        raise Exception(f'Failed to connect to database, error={e}')
-    
-    _galaxy_id = session.query(galaxiesRecord).filter(galaxiesRecord.name == _galaxy_name).first().id
-    
-    #check if entry already exists, if so skip. 
-    _check_q = session.query(observationsRecord).filter(observationsRecord.galaxy_id == _galaxy_id, 
-                             observationsRecord.version == _version,
-                             observationsRecord.filename == _filename,
-                             observationsRecord.base_dir == _base_dir)
-    if session.query(_check_q.exists()).scalar():
-        print(f"Entry for {_galaxy_name} observation {_filename} {_version} already exists. Skipping.")
-    else:
+    with ingest_unit(_session) as session:
+        _galaxy_id = session.query(galaxiesRecord).filter(galaxiesRecord.name == _galaxy_name).first().id
+
+        # insert unless the image is already there, one statement that concurrent loaders cannot race
         try:
-            _observation = observationsRecord(
-                                galaxy_id=_galaxy_id, 
-                                mjdstart=_record['mjdstart'],
-                                mjdend=_record['mjdend'], 
-                                exptime=_record['exptime'], 
-                                tel = _record['tel'],
-                                inst =  _inst,
-                                filter = _filter,
-                                base_dir = _base_dir,
-                                filename = _filename,
-                                version= _version)
-        
-            print(f'{_observation.serialized()}')
-            # update database with results
-            print(f"Inserting {_galaxy_name} image file {_filename} {_version} into database")
-            session.add(_observation)
-            session.commit()
-            print(f"Inserted {_galaxy_name} image file {_filename} {_version} into database")
+            _values = dict(
+                galaxy_id=_galaxy_id,
+                mjdstart=_record['mjdstart'],
+                mjdend=_record['mjdend'],
+                exptime=_record['exptime'],
+                tel = _record['tel'],
+                inst =  _inst,
+                filter = _filter,
+                base_dir = _base_dir,
+                filename = _filename,
+                version= _version)
+            print(f'{_values}')
+            _obs_id, _inserted = record_upsert(session, observationsRecord, _values)
         except Exception as e:
-            session.rollback()
             raise Exception(f"Failed to insert {_galaxy_name} image file {_filename} {_version} into database, error={e}")
+        if _inserted:
+            print(f"Inserted {_galaxy_name} image file {_filename} {_version} into database")
+        else:
+            print(f"Entry for {_galaxy_name} observation {_filename} {_version} already exists. Skipping.")
+        ingest_after_commit(session, manifest_update, _file, 'observations', _fingerprint, 'done', 1)
+    return _obs_id
     
 
 # +
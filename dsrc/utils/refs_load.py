@@ -4,11 +4,11 @@
 # +
 # import(s)
 # -
-from dsrc.models.disparu import refsRecord
+from dsrc.models.disparu import refsRecord, record_upsert
 from dsrc.models.disparu import galaxiesRecord, galaxies_filters
 from dsrc.utils.disparu_instruments import ACS_utils
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dsrc.utils.ingest_manifest import manifest_check, manifest_update
+from dsrc.utils.ingest_session import ingest_after_commit, ingest_unit
 
 import argparse
 import math
@@ -26,24 +26,20 @@ __doc__ = """
 # -
 ACS_REF_FILE = os.path.abspath(os.path.expanduser('~/HST_FSNe/data/refs/NGC1058/v200810/f814w_20190718_ref_drc.fits'))
 
-DISPARU_DB_HOST = os.getenv('DISPARU_DB_HOST', None)
-DISPARU_DB_USER = os.getenv('DISPARU_DB_USER', None)
-DISPARU_DB_PASS = os.getenv('DISPARU_DB_PASS', None)
-DISPARU_DB_NAME = os.getenv('DISPARU_DB_NAME', None)
-DISPARU_DB_PORT = os.getenv('DISPARU_DB_PORT', None)
 DISPARU_DATA = os.getenv('DISPARU_DATA', None)
 
 # +
 # function: galaxies_read()
 # -
-def refs_load(_file=''):
+def refs_load(_file='', _session=None):
     """
     Loads a reference image into the Disparu database. 
 
     Parameters:
         _file (str): the input fits file to be loaded.
+        _session: session of an ingest_unit() to join, default: a unit of work of its own
     Returns:
-        
+        _ref_id (int): id of the reference image, also if the file was skipped as unchanged
 
     """
     
@@ -52,58 +48,52 @@ def refs_load(_file=''):
     if not isinstance(_file, str) or not os.path.exists(_file):
         raise Exception(f'invalid input, _file={_file}')
     
+    _base_dir = os.path.dirname(_file).replace(DISPARU_DATA, '$DISPARU_DATA') #put the env variable back in
+    _filename = os.path.basename(_file)
+
+    # skip a file that is unchanged since it was loaded without opening it, unless its row is gone (e.g. recreated tables)
+    _state, _fingerprint = manifest_check(_file, 'refs')
+    if _state == 'unchanged':
+        with ingest_unit(_session) as session:
+            _ref = session.query(refsRecord.id).filter(refsRecord.filename == _filename,
+                                                       refsRecord.base_dir == _base_dir).first()
+        if _ref is not None:
+            print(f"Reference image {_file} is unchanged since it was loaded. Skipping.")
+            return _ref.id
+        print(f"Reference image {_file} is unchanged since it was loaded but not in the database. Reloading.")
+    
     # get ref image info
     _record = ACS_utils().get_ACS_img_info(_file)
     _galaxy_name = _record['targname'].split('_')[0].split('POS')[0]
-    _base_dir = os.path.dirname(_file).replace(DISPARU_DATA, '$DISPARU_DATA') #put the env variable back in
-    _filename = os.path.basename(_file)
     _version = _base_dir.split('/')[-1]
     _filter = ACS_utils.get_ACS_filter_name(_record['filter1'], _record['filter2'])
     
-    # noinspection PyBroadException
-    try:
-        # connect to database
-        print(f'connection string = postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-              f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        engine = create_engine(f'postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-                               f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        get_session = sessionmaker(bind=engine)
-        session = get_session()
-    except Exception as e:
-        raise Exception(f'Failed to connect to database, error={e}')
-    
-    _galaxy_id = session.query(galaxiesRecord).filter(galaxiesRecord.name == _galaxy_name).first().id
-    
-    #check if entry already exists, if so skip. 
-    _check_q = session.query(refsRecord).filter(refsRecord.galaxy_id == _galaxy_id, 
-                                                refsRecord.version == _version,
-                                                refsRecord.filename == _filename,
-                                                refsRecord.base_dir == _base_dir)
-    if session.query(_check_q.exists()).scalar():
-        print(f"Entry for {_galaxy_name} reference image {_version} already exists. Skipping.")
-    else:
+    with ingest_unit(_session) as session:
+        _galaxy_id = session.query(galaxiesRecord).filter(galaxiesRecord.name == _galaxy_name).first().id
+
+        # insert unless the image is already there, one statement that concurrent loaders cannot race
         try:
-            _ref = refsRecord( 
-                galaxy_id=_galaxy_id, 
+            _values = dict(
+                galaxy_id=_galaxy_id,
                 mjdstart=_record['mjdstart'],
-                mjdend=_record['mjdend'], 
-                exptime=_record['exptime'], 
+                mjdend=_record['mjdend'],
+                exptime=_record['exptime'],
                 tel = _record['tel'],
                 inst =  _record['inst'],
                 filter = _filter,
                 base_dir = _base_dir,
                 filename = _filename,
                 version= _version)
-        
-            print(f'{_ref.serialized()}')
-            # update database with results
-            print(f"Inserting {_galaxy_name} reference image {_version} into database")
-            session.add(_ref)
-            session.commit()
-            print(f"Inserted {_galaxy_name} reference image {_version} into database")
+            print(f'{_values}')
+            _ref_id, _inserted = record_upsert(session, refsRecord, _values)
         except Exception as e:
-            session.rollback()
             raise Exception(f"Failed to insert {_galaxy_name} reference image {_version} into database, error={e}")
+        if _inserted:
+            print(f"Inserted {_galaxy_name} reference image {_version} into database")
+        else:
+            print(f"Entry for {_galaxy_name} reference image {_version} already exists. Skipping.")
+        ingest_after_commit(session, manifest_update, _file, 'refs', _fingerprint, 'done', 1)
+    return _ref_id
     
 
 # +
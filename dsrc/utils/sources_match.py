@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from dsrc.models.disparu import sourcesRecord
+from sqlalchemy import func
+
+import threading
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import angular_separation
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.sources_match import sources_crossmatch
+"""
+
+
+# +
+# constant(s)
+# -
+SOURCE_MATCH_RADIUS = 0.05 #arcsec, one ACS/WFC pixel
+
+
+# +
+# class: SourceIndex()
+# -
+class SourceIndex(object):
+    """
+    Spatial index of the saved sources of one galaxy. Positions are kept sorted
+    by declination so a lookup is a binary search for the declination band
+    followed by an exact separation test on the few sources inside it. Its
+    generation is the (count, max(id)) of the sources it holds.
+    """
+
+    # +
+    # method: __init__
+    # -
+    def __init__(self, _ids=(), _names=(), _ras=(), _decs=()):
+        self.generation = (len(_ids), max(_ids, default=None))
+        _decs = np.array(_decs, dtype=np.float64)
+        _order = np.argsort(_decs, kind='stable')
+        # the four arrays are replaced together, in one assignment, so a reader never mixes two versions
+        self.__arrays = (np.array(_ids, dtype=np.int64)[_order], np.array(_names, dtype=object)[_order],
+                         np.array(_ras, dtype=np.float64)[_order], _decs[_order])
+
+    # +
+    # (overload) method: __len__()
+    # -
+    def __len__(self):
+        return len(self.__arrays[0])
+
+    # +
+    # method: add()
+    # -
+    def add(self, _id, _name, _ra, _dec):
+        """ insert one source, keeping the declination order, callers hold _SOURCE_INDEX_LOCK """
+        _ids, _names, _ras, _decs = self.__arrays
+        _ix = int(np.searchsorted(_decs, _dec, side='right'))
+        self.__arrays = (np.insert(_ids, _ix, _id), np.insert(_names, _ix, _name),
+                         np.insert(_ras, _ix, _ra), np.insert(_decs, _ix, _dec))
+        self.generation = (len(_ids) + 1, max(_id, self.generation[1] if self.generation[1] is not None else _id))
+
+    # +
+    # method: match()
+    # -
+    def match(self, _ra, _dec, _radius=SOURCE_MATCH_RADIUS):
+        """
+        Find the sources within _radius of a position.
+
+        Parameters:
+            _ra (float): right ascension in degrees
+            _dec (float): declination in degrees
+            _radius (float): match radius in arcsec
+        Returns:
+            (list): names of the matching sources, ordered by source id
+        """
+        _ids, _names, _ras, _decs = self.__arrays
+        _lo = np.searchsorted(_decs, _dec - _radius/3600.0, side='left')
+        _hi = np.searchsorted(_decs, _dec + _radius/3600.0, side='right')
+        if _hi <= _lo:
+            return []
+        _sep = angular_separation(_ras[_lo:_hi]*u.degree, _decs[_lo:_hi]*u.degree,
+                                  _ra*u.degree, _dec*u.degree)
+        _match_ix = np.where(_sep <= _radius*u.arcsec)[0] + _lo
+        _match_ix = _match_ix[np.argsort(_ids[_match_ix], kind='stable')]
+        return [_names[_k] for _k in _match_ix]
+
+
+# +
+# source index cache, keyed by galaxy_id
+# -
+_SOURCE_INDEX_CACHE = {}
+_SOURCE_INDEX_LOCK = threading.Lock()
+
+
+# +
+# function: source_index_generations()
+# -
+def source_index_generations(_session, _galaxy_ids):
+    """ return {galaxy_id: (count, max(id))} of the saved sources of some galaxies, in one grouped query """
+    _generations = {_galaxy_id: (0, None) for _galaxy_id in _galaxy_ids}
+    for _galaxy_id, _count, _max_id in _session.query(sourcesRecord.galaxy_id, func.count(sourcesRecord.id),
+                                                      func.max(sourcesRecord.id)).\
+                                                filter(sourcesRecord.galaxy_id.in_(_galaxy_ids)).\
+                                                group_by(sourcesRecord.galaxy_id):
+        _generations[_galaxy_id] = (_count, _max_id)
+    return _generations
+
+
+# +
+# function: source_index_get()
+# -
+def source_index_get(_session, _galaxy_ids, _refresh=False):
+    """
+    Get the source indices for some galaxies. Sources are saved by other processes too, a
+    candidates_save.py run or another web worker, so a cached index is only used while its
+    generation matches the database's, see source_index_generations(); those that are missing
+    or stale are loaded again in a single query.
+
+    Parameters:
+        _session: database session
+        _galaxy_ids (iterable): galaxy ids
+        _refresh (bool): reload the indices from the database regardless of generation
+    Returns:
+        _indices (dict): SourceIndex for each galaxy id
+    """
+
+    _galaxy_ids = sorted(set(_galaxy_ids))
+    _indices = {}
+    if not _refresh and len(_galaxy_ids) > 0:
+        _generations = source_index_generations(_session, _galaxy_ids)
+        with _SOURCE_INDEX_LOCK:
+            for _galaxy_id in _galaxy_ids:
+                _index = _SOURCE_INDEX_CACHE.get(_galaxy_id)
+                if _index is not None and _index.generation == _generations[_galaxy_id]:
+                    _indices[_galaxy_id] = _index
+
+    _missing = [_galaxy_id for _galaxy_id in _galaxy_ids if _galaxy_id not in _indices]
+    if len(_missing) > 0:
+        _rows = {_galaxy_id: ([], [], [], []) for _galaxy_id in _missing}
+        _g_s_query = _session.query(sourcesRecord.galaxy_id, sourcesRecord.id, sourcesRecord.name,
+                                    sourcesRecord.ra, sourcesRecord.dec).\
+                              filter(sourcesRecord.galaxy_id.in_(_missing))
+        for _galaxy_id, _id, _name, _ra, _dec in _g_s_query.all():
+            for _l, _v in zip(_rows[_galaxy_id], (_id, _name, _ra, _dec)):
+                _l.append(_v)
+        with _SOURCE_INDEX_LOCK:
+            for _galaxy_id in _missing:
+                _SOURCE_INDEX_CACHE[_galaxy_id] = _indices[_galaxy_id] = SourceIndex(*_rows[_galaxy_id])
+
+    return _indices
+
+
+# +
+# function: source_index_add()
+# -
+def source_index_add(_galaxy_id, _id, _name, _ra, _dec):
+    """ patch a cached source index with a newly saved source """
+    with _SOURCE_INDEX_LOCK:
+        _index = _SOURCE_INDEX_CACHE.get(_galaxy_id)
+        if _index is not None:
+            _index.add(_id, _name, _ra, _dec)
+
+
+# +
+# function: source_index_invalidate()
+# -
+def source_index_invalidate(_galaxy_id=None):
+    """ drop the cached source index for a galaxy, or for all galaxies if _galaxy_id is None """
+    with _SOURCE_INDEX_LOCK:
+        if _galaxy_id is None:
+            _SOURCE_INDEX_CACHE.clear()
+        else:
+            _SOURCE_INDEX_CACHE.pop(_galaxy_id, None)
+
+
+# +
+# function: sources_crossmatch()
+# -
+def sources_crossmatch(_session, _candidates, _radius=SOURCE_MATCH_RADIUS):
+    """
+    Crossmatch a page of candidates against the saved sources of their galaxies
+    using the cached per-galaxy source indices.
+
+    Parameters:
+        _session: database session, only used to load indices not yet cached
+        _candidates (list): serialized candidates, each with 'galaxy_id', 'ra' and 'dec'
+        _radius (float): match radius in arcsec
+    Returns:
+        _s_matches (list): for each candidate, the names of the matching sources or [''] if none
+    """
+
+    if len(_candidates) == 0:
+        return []
+
+    _indices = source_index_get(_session, [_c['galaxy_id'] for _c in _candidates])
+    _s_matches = []
+    for _c in _candidates:
+        _names = _indices[_c['galaxy_id']].match(_c['ra'], _c['dec'], _radius)
+        _s_matches.append(_names if len(_names) > 0 else [''])
+
+    return _s_matches
@@ -4,15 +4,15 @@
 # +
 # import(s)
 # -
-from dsrc.models.disparu import subtractionsRecord
+from dsrc.models.disparu import subtractionsRecord, record_upsert
 from dsrc.models.disparu import observationsRecord
 from dsrc.models.disparu import refsRecord
 from dsrc.models.disparu import galaxiesRecord
 from dsrc.utils.refs_load import refs_load
 from dsrc.utils.observations_load import observations_load
 from dsrc.utils.disparu_instruments import ACS_utils, WFC3_UVIS_utils
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dsrc.utils.ingest_manifest import manifest_check, manifest_update
+from dsrc.utils.ingest_session import ingest_after_commit, ingest_unit
 
 import argparse
 import math
@@ -30,25 +30,21 @@ __doc__ = """
 # -
 SUBTRACTION_FILE = os.path.abspath(os.path.expanduser('/Users/jacobjencson/HST_FSNe/data/subtractions/NGC1058/WFC3_UVIS/v200813/f814w_20131213_WFC3-UVIS_arc1_drc_sci_eps_bgsub_D.fits'))
 
-DISPARU_DB_HOST = os.getenv('DISPARU_DB_HOST', None)
-DISPARU_DB_USER = os.getenv('DISPARU_DB_USER', None)
-DISPARU_DB_PASS = os.getenv('DISPARU_DB_PASS', None)
-DISPARU_DB_NAME = os.getenv('DISPARU_DB_NAME', None)
-DISPARU_DB_PORT = os.getenv('DISPARU_DB_PORT', None)
 DISPARU_DATA = os.getenv('DISPARU_DATA', None)
 
 
 # +
 # function: subtractions_load()
 # -
-def subtractions_load(_file=''):
+def subtractions_load(_file='', _session=None):
     """
     Loads a subtraction image and relevant catalogs into the Disparu database. 
 
     Parameters:
         _file (str): the input fits file to be loaded.
+        _session: session of an ingest_unit() to join, default: a unit of work of its own
     Returns:
-    
+        _sub_id (int): id of the subtraction, also if the file was skipped as unchanged
     """
     
     # check input(s)
@@ -59,33 +55,26 @@ def subtractions_load(_file=''):
     #get basic image info
     _base_dir = os.path.dirname(_file).replace(DISPARU_DATA, '$DISPARU_DATA')
     _filename = os.path.basename(_file)
-    _arcnum = _filename.split('arc')[1].split('_')[0]
     _galaxy_name = _base_dir.split('/')[-3]
     _inst = _base_dir.split('/')[-2]
     _version = _base_dir.split('/')[-1]
+
+    # skip a file that is unchanged since it was loaded without opening it or its reference and observation,
+    # unless its row is gone (e.g. recreated tables)
+    _state, _fingerprint = manifest_check(_file, 'subtractions')
+    if _state == 'unchanged':
+        with ingest_unit(_session) as session:
+            _sub = session.query(subtractionsRecord.id).filter(subtractionsRecord.filename == _filename,
+                                                               subtractionsRecord.base_dir == _base_dir,
+                                                               subtractionsRecord.version == _version).first()
+        if _sub is not None:
+            print(f"Subtraction image {_file} is unchanged since it was loaded. Skipping.")
+            return _sub.id
+        print(f"Subtraction image {_file} is unchanged since it was loaded but not in the database. Reloading.")
     
     #get ref image and obs image, and load into databse if they aren't already. 
-    _record_file = os.path.expandvars(os.path.join(_base_dir, f'arc{_arcnum}_subtraction_record.txt'))
-    _ref_file, _obs_file = read_subtraction_record(_record_file)
-    _ref_base_dir = os.path.dirname(_ref_file).replace(DISPARU_DATA, '$DISPARU_DATA')
-    _ref_filename = os.path.basename(_ref_file)
-    _obs_base_dir = os.path.dirname(_obs_file).replace(DISPARU_DATA, '$DISPARU_DATA')
-    _obs_filename = os.path.basename(_obs_file)
-
-    try:
-        print(f"Loading reference image {_ref_file} into database.")
-        refs_load(_ref_file)
-    except Exception as e:
-        session.rollback()
-        raise Exception(f"Failed to load reference image {_ref_file} into database, error={e}")
-        
-    try:
-        print(f"Loading archival observation image {_obs_file} into database.")
-        observations_load(_obs_file)
-    except Exception as e:
-        session.rollback()
-        raise Exception(f"Failed to load archival observation image {_obs_file} into database, error={e}")
-    
+    _ref_file, _obs_file = subtraction_images(_file)
+
     #read header info from the original observation file
     #this is because not all header keywords are transfered to difference image. 
     if _inst == 'WFC3_UVIS':
@@ -95,55 +84,56 @@ def subtractions_load(_file=''):
         _record = ACS_utils().get_ACS_img_info(_obs_file)
         _filter = ACS_utils.get_ACS_filter_name(_record['filter1'], _record['filter2'])
     
-    # noinspection PyBroadException
-    try:
-        # connect to database
-        print(f'connection string = postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-              f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        engine = create_engine(f'postgresql+psycopg2://{DISPARU_DB_USER}:{DISPARU_DB_PASS}@'
-                               f'{DISPARU_DB_HOST}:{DISPARU_DB_PORT}/{DISPARU_DB_NAME}')
-        get_session = sessionmaker(bind=engine)
-        session = get_session()
-    except Exception as e:
-        raise Exception(f'Failed to connect to database, error={e}')
-    
-    _galaxy_id = session.query(galaxiesRecord).filter(galaxiesRecord.name == _galaxy_name).first().id
-    _ref_id = session.query(refsRecord).filter(refsRecord.filename == _ref_filename,
-                                               refsRecord.base_dir == _ref_base_dir).first().id
-    _obs_id = session.query(observationsRecord).filter(observationsRecord.filename == _obs_filename,
-                                                       observationsRecord.base_dir == _obs_base_dir).first().id
-                                              
-    #check if entry already exists, if so skip. 
-    _check_q = session.query(subtractionsRecord).filter(subtractionsRecord.galaxy_id == _galaxy_id, 
-                             subtractionsRecord.version == _version,
-                             subtractionsRecord.filename == _filename)
-    if session.query(_check_q.exists()).scalar():
-        print(f"Entry for {_galaxy_name} subtraction image {_filename} {_version} already exists. Skipping.")
-    else:
+    # reference, observation and subtraction share one transaction, all of them are loaded or none
+    with ingest_unit(_session) as session:
+        try:
+            print(f"Loading reference image {_ref_file} into database.")
+            _ref_id = refs_load(_ref_file, session)
+        except Exception as e:
+            raise Exception(f"Failed to load reference image {_ref_file} into database, error={e}")
+            
         try:
-            _subtraction = subtractionsRecord(
-                                galaxy_id=_galaxy_id, 
-                                obs_id=_obs_id,
-                                ref_id=_ref_id,
-                                mjdstart=_record['mjdstart'],
-                                mjdend=_record['mjdend'], 
-                                exptime=_record['exptime'], 
-                                tel = _record['tel'],
-                                inst =  _inst,
-                                filter = _filter,
-                                base_dir = _base_dir,
-                                filename = _filename,
-                                version= _version)
+            print(f"Loading archival observation image {_obs_file} into database.")
+            _obs_id = observations_load(_obs_file, session)
+        except Exception as e:
+            raise Exception(f"Failed to load archival observation image {_obs_file} into database, error={e}")
         
-            print(f'{_subtraction.serialized()}')
-            # update database with results
-            print(f"Inserting {_galaxy_name} subtraction image {_filename} {_version} into database")
-            session.add(_subtraction)
-            session.commit()
-            print(f"Inserted {_galaxy_name} subtraction image {_filename} {_version} into database")
+        _galaxy_id = session.query(galaxiesRecord).filter(galaxiesRecord.name == _galaxy_name).first().id
+                                                  
+        # insert unless the image is already there, one statement that concurrent loaders cannot race
+        try:
+            _values = dict(
+                galaxy_id=_galaxy_id,
+                obs_id=_obs_id,
+                ref_id=_ref_id,
+                mjdstart=_record['mjdstart'],
+                mjdend=_record['mjdend'],
+                exptime=_record['exptime'],
+                tel = _record['tel'],
+                inst =  _inst,
+                filter = _filter,
+                base_dir = _base_dir,
+                filename = _filename,
+                version= _version)
+            print(f'{_values}')
+            _sub_id, _inserted = record_upsert(session, subtractionsRecord, _values)
         except Exception as e:
-            session.rollback()
             raise Exception(f"Failed to insert {_galaxy_name} subtraction image {_filename} {_version} into database, error={e}")
+        if _inserted:
+            print(f"Inserted {_galaxy_name} subtraction image {_filename} {_version} into database")
+        else:
+            print(f"Entry for {_galaxy_name} subtraction image {_filename} {_version} already exists. Skipping.")
+        ingest_after_commit(session, manifest_update, _file, 'subtractions', _fingerprint, 'done', 1)
+    return _sub_id
+
+# +
+# function: subtraction_images()
+# -
+def subtraction_images(_file=''):
+    """ return the (_ref_file, _obs_file) of a subtraction image, from the arc<N>_subtraction_record.txt beside it """
+    _arcnum = os.path.basename(_file).split('arc')[1].split('_')[0]
+    return read_subtraction_record(os.path.join(os.path.dirname(_file), f'arc{_arcnum}_subtraction_record.txt'))
+
 
 # +
 # function: read_subtraction_record()
@@ -0,0 +1,732 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from dsrc.models.disparu import candidatesRecord
+from dsrc.models.disparu import subtractionsRecord
+from dsrc.models.disparu import galaxiesRecord
+from dsrc.models.disparu import thumbnailsRecord
+from sqlalchemy.dialects.postgresql import insert
+
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import resource_tracker, shared_memory
+from astropy.io import fits
+from dsrc.utils.thumbnails_png import THUMBNAIL_INTERVALS, THUMBNAIL_STRETCHES, png_decode, png_encode, png_save, stamp_limits
+from dsrc.utils.disparu_db import db_session
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.thumbnails import thumbnail_get, thumbnail_store_get
+    % python3 thumbnails.py --help
+"""
+
+
+# +
+# constant(s)
+# -
+DISPARU_SRC = os.getenv('DISPARU_SRC', os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+THUMBNAIL_CACHE_BYTES = int(os.getenv('DISPARU_THUMBNAIL_CACHE_BYTES', 2 * 1024**3)) #store and sprite sheets
+THUMBNAIL_DIR = os.getenv('DISPARU_THUMBNAIL_DIR', os.path.join(DISPARU_SRC, 'static/img/thumbnails'))
+THUMBNAIL_INTERVAL = os.getenv('DISPARU_THUMBNAIL_INTERVAL', THUMBNAIL_INTERVALS[0])
+THUMBNAIL_STRETCH = os.getenv('DISPARU_THUMBNAIL_STRETCH', THUMBNAIL_STRETCHES[0])
+THUMBNAIL_KINDS = ['sci', 'ref', 'diff']
+THUMBNAIL_SIZE = 50 #pixels
+THUMBNAIL_SPRITE_DIR = os.path.join(THUMBNAIL_DIR, 'sprites')
+THUMBNAIL_SPRITE_ROWS = int(os.getenv('DISPARU_THUMBNAIL_SPRITE_ROWS', 50))
+THUMBNAIL_STORE_BATCH = 1000
+# the store and the sprite sheets are a cache of what the subtraction images render to, 'thumbnails.py --evict'
+# (e.g. from cron) keeps them under THUMBNAIL_CACHE_BYTES and an evicted thumbnail is rendered again on request
+THUMBNAIL_STORE_DIR = os.getenv('DISPARU_THUMBNAIL_STORE', os.path.join(DISPARU_SRC, 'static/img/thumbnail_store'))
+
+# file names written by make_thumbnail_batch(), see thumbnail_filename()
+THUMBNAIL_NAME_RE = re.compile(r'^(sci|ref|diff)thumb_x-?\d+_y-?\d+_id(\d+)\.png$')
+
+
+# +
+# function: thumbnail_filename()
+# -
+def thumbnail_filename(_kind, _xcen, _ycen, _cand_id):
+    """ return the file name of a thumbnail, as written by make_thumbnail_trio() """
+    return f"{_kind}thumb_x{int(_xcen)}_y{int(_ycen)}_id{_cand_id}.png"
+
+
+# +
+# function: thumbnail_images()
+# -
+def thumbnail_images(_base_dir, _sub_filename, _ispos=True):
+    """
+    Find the science, reference and difference images of a subtraction, named as
+    candidates_load.py expects them.
+
+    Parameters:
+        _base_dir (str): subtraction base directory, may contain $DISPARU_DATA
+        _sub_filename (str): subtraction file name
+        _ispos (bool): positive (sci - ref) or negative (ref - sci) subtraction
+    Returns:
+        (_sci_file, _ref_file, _diff_file)
+    """
+
+    _base_dir = os.path.expandvars(_base_dir)
+    _arcnum = _sub_filename.split('arc')[1].split('_')[0]
+    _sci_file = os.path.join(_base_dir, _sub_filename.replace('_D', ''))
+    _ref_file = glob.glob(os.path.join(_base_dir, f'*ref_drc_sci_eps_arc{_arcnum}.fits'))[0]
+    if _ispos:
+        _diff_file = os.path.join(_base_dir, _sub_filename)
+    else:
+        _diff_file = [_f for _f in glob.glob(os.path.join(_base_dir, '*_negsub*.fits'))
+                      if os.path.basename(_f).replace('_negsub', '') == _sub_filename][0]
+    return _sci_file, _ref_file, _diff_file
+
+
+# +
+# function: thumbnail_stamps()
+# -
+def thumbnail_stamps(_data, _xcens, _ycens, _size=THUMBNAIL_SIZE):
+    """
+    Cut square stamps of _size pixels centered on many positions of an image in one
+    fancy-indexing operation. Stamps that run off the image are clipped as before,
+    the clipped part is NaN in the returned array.
+
+    Parameters:
+        _data (numpy.ndarray): 2d image
+        _xcens (array-like): x positions
+        _ycens (array-like): y positions
+        _size (int): stamp size in pixels
+    Returns:
+        _stamps (numpy.ndarray): (n, _size, _size) float array
+        _shapes (numpy.ndarray): (n, 2) valid (height, width) of each stamp
+    """
+
+    _xcens = np.asarray(_xcens, dtype=np.float64)
+    _ycens = np.asarray(_ycens, dtype=np.float64)
+    _ny, _nx = np.shape(_data)
+    _ymin = np.maximum(_ycens-_size/2, 0.0).astype(int)
+    _ymax = np.minimum(_ycens+_size/2, _ny).astype(int)
+    _xmin = np.maximum(_xcens-_size/2, 0.0).astype(int)
+    _xmax = np.minimum(_xcens+_size/2, _nx).astype(int)
+
+    _rows = _ymin[:, None] + np.arange(_size)[None, :]
+    _cols = _xmin[:, None] + np.arange(_size)[None, :]
+    _valid = (_rows < _ymax[:, None])[:, :, None] & (_cols < _xmax[:, None])[:, None, :]
+    _stamps = np.asarray(_data[np.minimum(_rows, _ny-1)[:, :, None], np.minimum(_cols, _nx-1)[:, None, :]],
+                         dtype=np.float64)
+    _stamps[~_valid] = np.nan
+    return _stamps, np.stack([np.maximum(_ymax-_ymin, 0), np.maximum(_xmax-_xmin, 0)], axis=1)
+
+
+# +
+# function: thumbnail_batch_cut()
+# -
+def thumbnail_batch_cut(_sci_file, _ref_file, _diff_file, _xcens, _ycens, _size=THUMBNAIL_SIZE, _ext=0):
+    """
+    Open the science, reference and difference images once (memory-mapped) and cut the
+    stamps of every position, with the shared sci/ref display range of each trio.
+
+    Returns:
+        (dict): 'sci', 'ref' and 'diff' stamps, 'shapes', and 'vmin'/'vmax' per trio
+    """
+
+    with fits.open(_sci_file, memmap=True) as _sci_hdu, fits.open(_ref_file, memmap=True) as _ref_hdu, \
+            fits.open(_diff_file, memmap=True) as _diff_hdu:
+        _sci, _shapes = thumbnail_stamps(_sci_hdu[_ext].data, _xcens, _ycens, _size)
+        _ref, _ = thumbnail_stamps(_ref_hdu[_ext].data, _xcens, _ycens, _size)
+        _diff, _ = thumbnail_stamps(_diff_hdu[_ext].data, _xcens, _ycens, _size)
+
+    #sci and ref file should be scaled the same way for display.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        _vmin = np.fmin(np.nanmin(_sci, axis=(1, 2)), np.nanmin(_ref, axis=(1, 2)))
+        _vmax = np.fmax(np.nanmax(_sci, axis=(1, 2)), np.nanmax(_ref, axis=(1, 2)))
+    if THUMBNAIL_INTERVAL == 'zscale':
+        for _i in range(len(_vmin)):
+            _vmin[_i], _vmax[_i] = stamp_limits(np.concatenate([_sci[_i], _ref[_i]]), 'zscale')
+    return {'sci': _sci, 'ref': _ref, 'diff': _diff, 'shapes': _shapes, 'vmin': _vmin, 'vmax': _vmax}
+
+
+# +
+# (hidden) function: _thumbnail_encode()
+# -
+def _thumbnail_encode(_stamps, _out_dir, _names, _shapes, _vmin, _vmax):
+    """ write the trios of a block of stamps, _stamps is (3, n, size, size) in sci/ref/diff order """
+    for _i, _name in enumerate(_names):
+        _h, _w = _shapes[_i]
+        png_save(os.path.join(_out_dir, f"scithumb_{_name}"), _stamps[0, _i, :_h, :_w],
+                 vmin=_vmin[_i], vmax=_vmax[_i], interval=THUMBNAIL_INTERVAL, stretch=THUMBNAIL_STRETCH)
+        png_save(os.path.join(_out_dir, f"refthumb_{_name}"), _stamps[1, _i, :_h, :_w],
+                 vmin=_vmin[_i], vmax=_vmax[_i], interval=THUMBNAIL_INTERVAL, stretch=THUMBNAIL_STRETCH)
+        png_save(os.path.join(_out_dir, f"diffthumb_{_name}"), _stamps[2, _i, :_h, :_w],
+                 interval=THUMBNAIL_INTERVAL, stretch=THUMBNAIL_STRETCH)
+    return len(_names)
+
+
+# +
+# (hidden) function: _thumbnail_encode_shared()
+# -
+def _thumbnail_encode_shared(_shm_name, _shm_shape, _start, _stop, _out_dir, _names, _shapes, _vmin, _vmax,
+                             _tracker=None):
+    """ process pool worker, encodes stamps _start:_stop of a shared memory block without copying them """
+    _shm = shared_memory.SharedMemory(name=_shm_name)
+    # only the parent owns (unlinks) the block: a worker forked before the parent's resource tracker (_tracker, its pid)
+    # started has a tracker of its own, which would unlink the block when the worker exits
+    if resource_tracker._resource_tracker._pid not in (None, _tracker):
+        resource_tracker.unregister(_shm._name, 'shared_memory')
+    _stamps = None
+    try:
+        _stamps = np.ndarray(_shm_shape, dtype=np.float64, buffer=_shm.buf)
+        return _thumbnail_encode(_stamps[:, _start:_stop], _out_dir, _names, _shapes, _vmin, _vmax)
+    finally:
+        del _stamps
+        _shm.close()
+
+
+# +
+# function: make_thumbnail_batch()
+# -
+def make_thumbnail_batch(_sci_file, _ref_file, _diff_file, _out_dir, _xcens, _ycens, _labels,
+                         _size=THUMBNAIL_SIZE, _ext=0, _workers=1, _pool=None, _progress=False):
+    """
+    Create the sci/ref/diff thumbnail trios of many candidates of one subtraction,
+    reading each image once. With more than one worker (or a process pool) the stamps
+    are placed in shared memory and the PNG encoding is spread over processes; every
+    file only depends on its own stamp, so the output does not depend on the workers.
+
+    Parameters:
+        _sci_file (str): input science image fits file.
+        _ref_file (str): input reference image fits file.
+        _diff_file (str): input difference image fits file.
+        _out_dir (str): output directory
+        _xcens (array-like): x positions where thumbnails should be centered
+        _ycens (array-like): y positions where thumbnails should be centered
+        _labels (list): label of each trio, e.g. 'id123'
+        _size (int): size of square in pixels for thumbnail
+        _ext (int or str): fits extension to be read.
+        _workers (int): number of encoding processes, if no _pool is given
+        _pool (ProcessPoolExecutor): pool to encode in, shared across calls
+        _progress (bool): print progress
+    Returns:
+        (int): number of trios written
+    """
+
+    _n = len(_labels)
+    if _n == 0:
+        return 0
+    _cut = thumbnail_batch_cut(_sci_file, _ref_file, _diff_file, _xcens, _ycens, _size, _ext)
+    _names = [f"x{int(_xcens[_i])}_y{int(_ycens[_i])}_{_labels[_i]}.png" for _i in range(_n)]
+
+    # serial
+    if _pool is None and _workers <= 1:
+        _stamps = np.stack([_cut['sci'], _cut['ref'], _cut['diff']])
+        _done = _thumbnail_encode(_stamps, _out_dir, _names, _cut['shapes'], _cut['vmin'], _cut['vmax'])
+        if _progress:
+            print(f'thumbnails: {_done}/{_n}')
+        return _done
+
+    # parallel, in contiguous chunks of stamps read from shared memory
+    _shape = (3, _n, _size, _size)
+    _shm = shared_memory.SharedMemory(create=True, size=int(np.prod(_shape)) * np.dtype(np.float64).itemsize)
+    _executor = _pool if _pool is not None else ProcessPoolExecutor(max_workers=_workers)
+    _stamps = None
+    try:
+        _stamps = np.ndarray(_shape, dtype=np.float64, buffer=_shm.buf)
+        _stamps[0], _stamps[1], _stamps[2] = _cut['sci'], _cut['ref'], _cut['diff']
+        del _cut['sci'], _cut['ref'], _cut['diff']
+        _chunk = max(1, int(math.ceil(_n / float(4 * max(_workers, 1)))))
+        _futures = [_executor.submit(_thumbnail_encode_shared, _shm.name, _shape, _i, min(_i + _chunk, _n), _out_dir,
+                                     _names[_i:_i + _chunk], _cut['shapes'][_i:_i + _chunk],
+                                     _cut['vmin'][_i:_i + _chunk], _cut['vmax'][_i:_i + _chunk],
+                                     resource_tracker._resource_tracker._pid)
+                    for _i in range(0, _n, _chunk)]
+        _done = 0
+        for _future in as_completed(_futures):
+            _done += _future.result()
+            if _progress:
+                print(f'thumbnails: {_done}/{_n}')
+        return _done
+    finally:
+        if _pool is None:
+            _executor.shutdown(wait=True)
+        del _stamps
+        _shm.close()
+        _shm.unlink()
+
+
+# +
+# function: make_thumbnail_trio()
+# -
+def make_thumbnail_trio(_sci_file, _ref_file, _diff_file, _out_dir, _xcen, _ycen, _size=50, _ext=0, label=''):
+    """
+    Create a sci/ref/diff thumbnail trio centered at _xcen, _ycen of _size pixels from input images.
+    
+    Parameters:
+        _sci_file (str): input science image fits file. 
+        _ref_file (str): input science image fits file. 
+        _diff_file (str): input science image fits file. 
+        _xcen (int): x position where thumbnail should be centered
+        _ycen (int): y position where thumbnail should be centered
+        _size (int): size of square in pixels for thumbnail 
+        _ext (int or str): fits extension to be read. 
+    
+    Returns:
+    
+    """
+    make_thumbnail_batch(_sci_file, _ref_file, _diff_file, _out_dir, [_xcen], [_ycen], [label], _size, _ext)
+
+
+# +
+# function: thumbnail_store_path()
+# -
+def thumbnail_store_path(_sha256):
+    """ return the path of a stored thumbnail, sharded by the first two byte pairs of its hash, e.g. ab/cd/abcd...png """
+    return os.path.join(THUMBNAIL_STORE_DIR, _sha256[0:2], _sha256[2:4], f'{_sha256}.png')
+
+
+# +
+# function: thumbnail_store_put()
+# -
+def thumbnail_store_put(_path, _remove=True):
+    """
+    Add a PNG to the store under the SHA-256 of its content. A stored file is written whole
+    under a temporary name and renamed into place, and a file that already exists has the
+    same content, so concurrent writers cannot conflict.
+
+    Parameters:
+        _path (str): PNG file
+        _remove (bool): remove _path once it is stored
+    Returns:
+        (_sha256, _size)
+    """
+
+    with open(_path, 'rb') as _fd:
+        _data = _fd.read()
+    _sha256 = hashlib.sha256(_data).hexdigest()
+    _dest = thumbnail_store_path(_sha256)
+    if os.path.exists(_dest):
+        os.utime(_dest)
+    else:
+        os.makedirs(os.path.dirname(_dest), exist_ok=True)
+        _tmp = f'{_dest}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(_tmp, 'wb') as _fd:
+            _fd.write(_data)
+        os.replace(_tmp, _dest)
+    if _remove:
+        os.remove(_path)
+    return _sha256, len(_data)
+
+
+# +
+# (hidden) function: _thumbnails_upsert()
+# -
+def _thumbnails_upsert(_session, _rows):
+    """ record {(cand_id, kind): (sha256, size)} in the thumbnails table and commit, rows of unknown candidates are dropped """
+    if not _rows:
+        return 0
+    _known = {_c for (_c,) in _session.query(candidatesRecord.id).
+                                        filter(candidatesRecord.id.in_({_k[0] for _k in _rows}))}
+    _values = [{'cand_id': _c, 'kind': _k, 'sha256': _v[0], 'size': _v[1]}
+               for (_c, _k), _v in _rows.items() if _c in _known]
+    try:
+        if _values:
+            _stmt = insert(thumbnailsRecord.__table__).values(_values)
+            _session.execute(_stmt.on_conflict_do_update(index_elements=['cand_id', 'kind'],
+                                                         set_={'sha256': _stmt.excluded.sha256,
+                                                               'size': _stmt.excluded.size}))
+        _session.commit()
+    except Exception:
+        _session.rollback()
+        raise
+    return len(_values)
+
+
+# +
+# function: thumbnails_ingest()
+# -
+def thumbnails_ingest(_session, _dir=THUMBNAIL_DIR, _remove=True, _progress=False):
+    """
+    Move the thumbnails of a flat directory, named as thumbnail_filename() names them, into
+    the store and record their hashes in the thumbnails table, THUMBNAIL_STORE_BATCH per
+    commit. Source files are only removed after their batch is committed, and other files
+    are left alone. This both migrates the old flat THUMBNAIL_DIR and files the output of
+    make_thumbnail_batch().
+
+    Parameters:
+        _session: database session
+        _dir (str): flat thumbnail directory
+        _remove (bool): remove the source files, otherwise they are copied
+        _progress (bool): print progress
+    Returns:
+        (int): number of thumbnails recorded
+    """
+
+    _done, _rows, _paths = 0, {}, []
+    with os.scandir(_dir) as _it:
+        for _e in _it:
+            _match = THUMBNAIL_NAME_RE.match(_e.name)
+            if _match is None or not _e.is_file():
+                continue
+            _rows[(int(_match.group(2)), _match.group(1))] = thumbnail_store_put(_e.path, False)
+            _paths.append(_e.path)
+            if len(_paths) >= THUMBNAIL_STORE_BATCH:
+                _done += _thumbnails_upsert(_session, _rows)
+                if _remove:
+                    for _p in _paths:
+                        os.remove(_p)
+                _rows, _paths = {}, []
+                if _progress:
+                    print(f'thumbnails: {_done} stored from {_dir}')
+    _done += _thumbnails_upsert(_session, _rows)
+    if _remove:
+        for _p in _paths:
+            os.remove(_p)
+    if _progress:
+        print(f'thumbnails: {_done} stored from {_dir}')
+    return _done
+
+
+# +
+# function: thumbnails_evict()
+# -
+# noinspection PyBroadException
+def thumbnails_evict(_max_bytes=THUMBNAIL_CACHE_BYTES):
+    """
+    Keep the thumbnail store and the sprite sheets under _max_bytes together by deleting the
+    least recently served first. Served files have their mtime refreshed, so mtime order is
+    use order. An evicted thumbnail is rendered again from its subtraction by
+    thumbnail_store_get(), and an evicted sheet goes with its offset map, is mapped again by
+    the next page that shows it and composed again on its next request. It scans every file,
+    so it is run as a job, 'thumbnails.py --evict', never from a request.
+
+    Returns:
+        (int): number of files deleted
+    """
+
+    # {key: [(mtime, size, path)]}, a stored thumbnail alone or a sprite sheet with its map
+    _entries = {}
+    for _root, _dirs, _files in os.walk(THUMBNAIL_STORE_DIR):
+        # only the shards, not the private directories of renders in progress
+        _dirs[:] = [_d for _d in _dirs if re.fullmatch('[0-9a-f]{2}', _d)]
+        for _f in _files:
+            if re.fullmatch('[0-9a-f]{64}[.]png', _f):
+                try:
+                    _stat = os.stat(os.path.join(_root, _f))
+                    _entries[_f] = [(_stat.st_mtime, _stat.st_size, os.path.join(_root, _f))]
+                except Exception:
+                    pass
+    if os.path.isdir(THUMBNAIL_SPRITE_DIR):
+        with os.scandir(THUMBNAIL_SPRITE_DIR) as _it:
+            for _e in _it:
+                if os.path.splitext(_e.name)[1] in ['.png', '.json'] and _e.is_file():
+                    try:
+                        _stat = _e.stat()
+                        _entries.setdefault(f'sprite:{os.path.splitext(_e.name)[0]}', []).append(
+                            (_stat.st_mtime, _stat.st_size, _e.path))
+                    except Exception:
+                        pass
+    _total = sum(_f[1] for _files in _entries.values() for _f in _files)
+    if _total <= _max_bytes:
+        return 0
+
+    # evict down to 90% so that the next few renders do not need another run
+    _deleted = 0
+    for _files in sorted(_entries.values(), key=lambda _f: max(_e[0] for _e in _f)):
+        if _total <= 0.9 * _max_bytes:
+            break
+        for _mtime, _size, _path in _files:
+            try:
+                os.remove(_path)
+                _total -= _size
+                _deleted += 1
+            except Exception:
+                pass
+    return _deleted
+
+
+# +
+# (hidden) function: _thumbnail_trio_store()
+# -
+def _thumbnail_trio_store(_session, _cand_id):
+    """ render the sci/ref/diff trio of a candidate (they share one scaling) into the store, False if it does not exist """
+
+    _row = _session.query(candidatesRecord.xpos, candidatesRecord.ypos, candidatesRecord.ispos,
+                          subtractionsRecord.base_dir, subtractionsRecord.filename).\
+                    filter(candidatesRecord.sub_id == subtractionsRecord.id, candidatesRecord.id == _cand_id).first()
+    if _row is None:
+        return False
+    _xcen, _ycen, _ispos, _base_dir, _sub_filename = _row
+
+    os.makedirs(THUMBNAIL_STORE_DIR, exist_ok=True)
+    _tmp_dir = tempfile.mkdtemp(dir=THUMBNAIL_STORE_DIR)
+    try:
+        _sci_file, _ref_file, _diff_file = thumbnail_images(_base_dir, _sub_filename, _ispos)
+        make_thumbnail_trio(_sci_file, _ref_file, _diff_file, _tmp_dir, _xcen, _ycen,
+                            _size=THUMBNAIL_SIZE, _ext=0, label=f'id{_cand_id}')
+        thumbnails_ingest(_session, _tmp_dir)
+    finally:
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+    return True
+
+
+# +
+# function: thumbnail_get()
+# -
+def thumbnail_get(_session, _cand_id, _kind):
+    """
+    Return the content hash of a candidate thumbnail, cutting the sci/ref/diff trio from the
+    subtraction images into the store on first request.
+
+    Parameters:
+        _session: database session
+        _cand_id (int): candidate id
+        _kind (str): one of THUMBNAIL_KINDS
+    Returns:
+        (str): SHA-256 of the PNG, see thumbnail_store_path(), or None if the candidate does not exist
+    """
+
+    if _kind not in THUMBNAIL_KINDS:
+        raise Exception(f'invalid input, _kind={_kind}')
+
+    _query = _session.query(thumbnailsRecord.sha256).\
+                      filter(thumbnailsRecord.cand_id == _cand_id, thumbnailsRecord.kind == _kind)
+    _sha256 = _query.scalar()
+    if _sha256 is not None and os.path.exists(thumbnail_store_path(_sha256)):
+        return _sha256
+    if not _thumbnail_trio_store(_session, _cand_id):
+        return None
+    return _query.scalar()
+
+
+# +
+# function: thumbnail_store_get()
+# -
+def thumbnail_store_get(_session, _sha256):
+    """
+    Return the path of a stored thumbnail by its content hash, rendering it again if it
+    was evicted, or None if no candidate has a thumbnail with this hash.
+    """
+
+    if not re.fullmatch('[0-9a-f]{64}', _sha256):
+        return None
+    _path = thumbnail_store_path(_sha256)
+    if not os.path.exists(_path):
+        _cand_id = _session.query(thumbnailsRecord.cand_id).filter(thumbnailsRecord.sha256 == _sha256).limit(1).scalar()
+        if _cand_id is None:
+            return None
+        _thumbnail_trio_store(_session, _cand_id)
+        if not os.path.exists(_path):
+            return None
+    os.utime(_path)
+    return _path
+
+
+# +
+# function: thumbnails_hashes()
+# -
+def thumbnails_hashes(_session, _cand_ids):
+    """ return {(cand_id, kind): sha256} of the stored thumbnails of some candidates, in one query """
+    if not _cand_ids:
+        return {}
+    return {(_c, _k): _h for _c, _k, _h in _session.query(thumbnailsRecord.cand_id, thumbnailsRecord.kind,
+                                                          thumbnailsRecord.sha256).
+                                                    filter(thumbnailsRecord.cand_id.in_(_cand_ids))}
+
+
+# +
+# function: thumbnail_sprites()
+# -
+def thumbnail_sprites(_cand_ids, _hashes, _rows=THUMBNAIL_SPRITE_ROWS):
+    """
+    Split a page of candidates into sprite sheets of _rows candidates, one row of sci/ref/diff
+    stamps per candidate. A sheet is named by the SHA-256 of the content hashes of its stamps,
+    see thumbnails_hashes(), so its URL never changes what it shows. Only the JSON offset map
+    is written here, the sheet itself is composed by thumbnail_sprite_get() on first request.
+    Candidates without all their stamps in the store are left off the sheets.
+
+    Parameters:
+        _cand_ids (list): candidate ids in page order
+        _hashes (dict): {(cand_id, kind): sha256} from thumbnails_hashes()
+        _rows (int): candidates per sheet
+    Returns:
+        (list): (key, row, rows) of each candidate, or None for those left off
+    """
+
+    os.makedirs(THUMBNAIL_SPRITE_DIR, exist_ok=True)
+    _ids = [int(_c) for _c in _cand_ids if all((int(_c), _k) in _hashes for _k in THUMBNAIL_KINDS)]
+    _placement = {}
+    for _start in range(0, len(_ids), max(_rows, 1)):
+        _block = _ids[_start:_start + max(_rows, 1)]
+        _stamps = [[_hashes[(_c, _k)] for _k in THUMBNAIL_KINDS] for _c in _block]
+        _key = hashlib.sha256(f"{THUMBNAIL_SIZE}:{','.join(str(_c) for _c in _block)}:"
+                              f"{','.join(_h for _row in _stamps for _h in _row)}".encode('utf-8')).hexdigest()
+        _map = os.path.join(THUMBNAIL_SPRITE_DIR, f'{_key}.json')
+        if os.path.exists(_map):
+            os.utime(_map)
+        else:
+            _tmp = f'{_map}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(_tmp, 'w') as _fd:
+                json.dump({'size': THUMBNAIL_SIZE, 'columns': THUMBNAIL_KINDS, 'candidates': _block, 'stamps': _stamps,
+                           'offsets': {str(_c): [0, _r * THUMBNAIL_SIZE] for _r, _c in enumerate(_block)}}, _fd)
+            os.replace(_tmp, _map)
+        _placement.update({_c: (_key, _r, len(_block)) for _r, _c in enumerate(_block)})
+    return [_placement.get(int(_c)) for _c in _cand_ids]
+
+
+# +
+# function: thumbnail_sprite_get()
+# -
+def thumbnail_sprite_get(_session, _key):
+    """
+    Return the paths of a sprite sheet and its offset map, composing the sheet from the stored
+    thumbnails of its map on first request. Each stamp sits at the top left of its cell, so a
+    stamp clipped at an image edge leaves the rest of the cell transparent.
+
+    Parameters:
+        _session: database session
+        _key (str): sheet key from thumbnail_sprites()
+    Returns:
+        (_png, _map) paths, or None if the key is unknown or a stamp is no longer stored
+    """
+
+    if not re.fullmatch('[0-9a-f]{64}', _key):
+        return None
+    _map = os.path.join(THUMBNAIL_SPRITE_DIR, f'{_key}.json')
+    _png = os.path.join(THUMBNAIL_SPRITE_DIR, f'{_key}.png')
+    if not os.path.exists(_map):
+        return None
+    if os.path.exists(_png):
+        os.utime(_png)
+        return _png, _map
+
+    with open(_map, 'r') as _fd:
+        _stamps = json.load(_fd)['stamps']
+    _gray = np.zeros((len(_stamps) * THUMBNAIL_SIZE, len(THUMBNAIL_KINDS) * THUMBNAIL_SIZE), dtype=np.uint8)
+    _alpha = np.zeros_like(_gray)
+    for _r, _row in enumerate(_stamps):
+        for _j, _sha256 in enumerate(_row):
+            _path = thumbnail_store_get(_session, _sha256)
+            if _path is None:
+                return None
+            with open(_path, 'rb') as _fd:
+                _g, _a = png_decode(_fd.read())
+            _h, _w = min(_g.shape[0], THUMBNAIL_SIZE), min(_g.shape[1], THUMBNAIL_SIZE)
+            _y, _x = _r * THUMBNAIL_SIZE, _j * THUMBNAIL_SIZE
+            _gray[_y:_y + _h, _x:_x + _w] = _g[:_h, :_w]
+            _alpha[_y:_y + _h, _x:_x + _w] = 255 if _a is None else _a[:_h, :_w]
+
+    _tmp = f'{_png}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(_tmp, 'wb') as _fd:
+        _fd.write(png_encode(_gray, _alpha))
+    os.replace(_tmp, _png)
+    return _png, _map
+
+
+# +
+# function: thumbnails_render()
+# -
+def thumbnails_render(_galaxy='', _workers=1):
+    """
+    Render the thumbnails of every candidate of a galaxy into the store, one subtraction at
+    a time, encoding on a process pool shared by all subtractions. Candidates that already
+    have stored thumbnails are skipped, so an interrupted run can simply be repeated.
+
+    Parameters:
+        _galaxy (str): galaxy name
+        _workers (int): number of encoding processes
+    Returns:
+        (int): number of thumbnails stored
+    """
+
+    # noinspection PyBroadException
+    try:
+        # connect to database
+        session = db_session()
+    except Exception as e:
+        raise Exception(f'Failed to connect to database, error={e}')
+
+    # group the candidates of the galaxy that are not yet in the store by subtraction and sign
+    _batches = {}
+    _stored = session.query(thumbnailsRecord.id).filter(thumbnailsRecord.cand_id == candidatesRecord.id).exists()
+    _query = session.query(candidatesRecord.id, candidatesRecord.xpos, candidatesRecord.ypos, candidatesRecord.ispos,
+                           subtractionsRecord.base_dir, subtractionsRecord.filename).\
+                     filter(candidatesRecord.sub_id == subtractionsRecord.id,
+                            candidatesRecord.galaxy_id == galaxiesRecord.id, galaxiesRecord.name == _galaxy,
+                            ~_stored).\
+                     order_by(candidatesRecord.id)
+    for _cand_id, _xcen, _ycen, _ispos, _base_dir, _sub_filename in _query:
+        _batch = _batches.setdefault((_base_dir, _sub_filename, bool(_ispos)), ([], [], []))
+        _batch[0].append(f'id{_cand_id}')
+        _batch[1].append(_xcen)
+        _batch[2].append(_ycen)
+
+    os.makedirs(THUMBNAIL_STORE_DIR, exist_ok=True)
+    _done, _total = 0, 3 * sum(len(_b[0]) for _b in _batches.values())
+    _pool = ProcessPoolExecutor(max_workers=_workers) if _workers > 1 else None
+    try:
+        for (_base_dir, _sub_filename, _ispos), (_labels, _xcens, _ycens) in sorted(_batches.items()):
+            _sci_file, _ref_file, _diff_file = thumbnail_images(_base_dir, _sub_filename, _ispos)
+            _tmp_dir = tempfile.mkdtemp(dir=THUMBNAIL_STORE_DIR)
+            try:
+                make_thumbnail_batch(_sci_file, _ref_file, _diff_file, _tmp_dir, _xcens, _ycens, _labels,
+                                     THUMBNAIL_SIZE, 0, _workers, _pool, False)
+                _done += thumbnails_ingest(session, _tmp_dir)
+            finally:
+                shutil.rmtree(_tmp_dir, ignore_errors=True)
+            print(f'{_galaxy}: {_done}/{_total} thumbnails, {_sub_filename} ispos={_ispos}')
+    finally:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        session.close()
+    return _done
+
+
+# +
+# main()
+# -
+if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _p = argparse.ArgumentParser(description='Render the candidate thumbnails of a galaxy, migrate a flat directory, '
+                                             'or evict thumbnails',
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    _p.add_argument('-g', '--galaxy', default='', help="""Galaxy name [%(default)s]""")
+    _p.add_argument('--workers', default=os.cpu_count() or 1, type=int, help="""Encoding processes [%(default)s]""")
+    _p.add_argument('--migrate', default=False, action='store_true',
+                    help='if present, move the thumbnails of --directory into the store')
+    _p.add_argument('--directory', default=THUMBNAIL_DIR, help="""Flat thumbnail directory [%(default)s]""")
+    _p.add_argument('--keep', default=False, action='store_true', help='if present, copy rather than move')
+    _p.add_argument('--evict', default=False, action='store_true',
+                    help=f'if present, keep the store and sprite sheets under {THUMBNAIL_CACHE_BYTES} bytes')
+    args = _p.parse_args()
+
+    # execute
+    if args.migrate:
+        # noinspection PyBroadException
+        try:
+            session = db_session()
+        except Exception as e:
+            raise Exception(f'Failed to connect to database, error={e}')
+        thumbnails_ingest(session, os.path.abspath(os.path.expanduser(args.directory)), not args.keep, True)
+        session.close()
+    elif args.evict:
+        print(f'thumbnails: {thumbnails_evict()} files evicted from {THUMBNAIL_STORE_DIR} and {THUMBNAIL_SPRITE_DIR}')
+    elif args.galaxy.strip():
+        thumbnails_render(args.galaxy.strip(), int(args.workers))
+    else:
+        print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+import math
+import os
+import struct
+import warnings
+import zlib
+import numpy as np
+from astropy.visualization import AsinhStretch
+from astropy.visualization import ZScaleInterval
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    from dsrc.utils.thumbnails_png import png_decode, png_save
+"""
+
+
+# +
+# constant(s)
+# -
+# matplotlib's 'gray' colormap as 8-bit values, as plt.imsave() writes them
+GRAY_LUT = (np.linspace(0.0, 1.0, 256) * 255).astype(np.uint8)
+PNG_COMPRESSION = int(os.getenv('DISPARU_PNG_COMPRESSION', 6))
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+THUMBNAIL_INTERVALS = ['minmax', 'zscale']
+THUMBNAIL_STRETCHES = ['linear', 'asinh']
+
+
+# +
+# function: stamp_limits()
+# -
+def stamp_limits(_data, _interval=THUMBNAIL_INTERVALS[0]):
+    """ return the (vmin, vmax) display range of a stamp, ignoring NaNs, or NaNs if every pixel is NaN """
+    _finite = np.asarray(_data, dtype=np.float64)
+    _finite = _finite[np.isfinite(_finite)]
+    if _finite.size == 0:
+        return math.nan, math.nan
+    if _interval == 'zscale':
+        return tuple(float(_v) for _v in ZScaleInterval().get_limits(_finite))
+    return float(_finite.min()), float(_finite.max())
+
+
+# +
+# function: stamp_gray()
+# -
+def stamp_gray(_data, _vmin=None, _vmax=None, _interval=THUMBNAIL_INTERVALS[0], _stretch=THUMBNAIL_STRETCHES[0]):
+    """
+    Map a stamp to 8-bit gray levels. The linear stretch reproduces plt.imsave(cmap='gray'):
+    values are normalized to [vmin, vmax], scaled by 256 and truncated, values below or above
+    the range take the first or last level, and NaNs are transparent, every pixel if a limit is
+    NaN. If vmin == vmax every pixel, NaN or not, takes the first level.
+
+    Parameters:
+        _data (numpy.ndarray): 2d stamp
+        _vmin (float): lower display limit, default: from _interval
+        _vmax (float): upper display limit, default: from _interval
+        _interval (str): one of THUMBNAIL_INTERVALS, used for the missing limits
+        _stretch (str): one of THUMBNAIL_STRETCHES
+    Returns:
+        _gray (numpy.ndarray): uint8 gray levels
+        _alpha (numpy.ndarray): uint8 alpha, or None if no pixel is NaN
+    """
+
+    _x = np.array(_data, dtype=np.float64)
+    if _vmin is None or _vmax is None:
+        _lo, _hi = stamp_limits(_x, _interval)
+        _vmin = _lo if _vmin is None else _vmin
+        _vmax = _hi if _vmax is None else _vmax
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if _vmin == _vmax:
+            _x.fill(0.0)
+        else:
+            _x -= _vmin
+            _x /= (_vmax - _vmin)
+        _bad = np.isnan(_x)
+        if _stretch == 'asinh':
+            _x = AsinhStretch()(np.clip(_x, 0.0, 1.0), clip=True)
+        _x *= 256.0
+        _x[_bad] = 0.0
+        _index = np.clip(np.floor(_x), 0, 255).astype(np.uint8)
+
+    _gray = GRAY_LUT[_index]
+    if not _bad.any():
+        return _gray, None
+    _alpha = np.full(_gray.shape, 255, dtype=np.uint8)
+    _alpha[_bad] = 0
+    _gray[_bad] = 0
+    return _gray, _alpha
+
+
+# +
+# (hidden) function: _png_chunk()
+# -
+def _png_chunk(_type, _payload):
+    return struct.pack('>I', len(_payload)) + _type + _payload + \
+        struct.pack('>I', zlib.crc32(_payload, zlib.crc32(_type)) & 0xffffffff)
+
+
+# +
+# function: png_encode()
+# -
+def png_encode(_gray, _alpha=None, _compression=PNG_COMPRESSION):
+    """ encode 8-bit gray levels, and optionally alpha, as a gray or gray+alpha PNG """
+    _gray = np.ascontiguousarray(_gray, dtype=np.uint8)
+    _height, _width = _gray.shape
+    if _alpha is None:
+        _color_type, _pixels = 0, _gray
+    else:
+        _color_type = 4
+        _pixels = np.empty((_height, _width * 2), dtype=np.uint8)
+        _pixels[:, 0::2] = _gray
+        _pixels[:, 1::2] = _alpha
+    # each scanline starts with filter type 0 (none)
+    _raw = np.zeros((_height, _pixels.shape[1] + 1), dtype=np.uint8)
+    _raw[:, 1:] = _pixels
+    return PNG_SIGNATURE + \
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', _width, _height, 8, _color_type, 0, 0, 0)) + \
+        _png_chunk(b'IDAT', zlib.compress(_raw.tobytes(), _compression)) + \
+        _png_chunk(b'IEND', b'')
+
+
+# +
+# (hidden) function: _png_unfilter()
+# -
+def _png_unfilter(_raw, _height, _stride, _bpp):
+    """ undo the per-scanline filters of 8-bit image data, see the PNG specification section 9 """
+    _rows = np.frombuffer(_raw, dtype=np.uint8).reshape(_height, _stride + 1)
+    _out = np.zeros((_height, _stride), dtype=np.uint8)
+    _prior = np.zeros(_stride, dtype=np.int32)
+    for _y in range(_height):
+        _filter, _line = int(_rows[_y, 0]), _rows[_y, 1:].astype(np.int32)
+        if _filter == 0:
+            _cur = _line
+        elif _filter == 1:
+            # sub: a running sum per byte of the pixel
+            _cur = np.cumsum(_line.reshape(-1, _bpp), axis=0).reshape(-1) & 0xff
+        elif _filter == 2:
+            _cur = (_line + _prior) & 0xff
+        elif _filter in [3, 4]:
+            _cur = _line.copy()
+            for _i in range(_stride):
+                _a = int(_cur[_i - _bpp]) if _i >= _bpp else 0
+                _b = int(_prior[_i])
+                if _filter == 3:
+                    _cur[_i] = (_cur[_i] + (_a + _b) // 2) & 0xff
+                    continue
+                _c = int(_prior[_i - _bpp]) if _i >= _bpp else 0
+                _p = _a + _b - _c
+                _pa, _pb, _pc = abs(_p - _a), abs(_p - _b), abs(_p - _c)
+                _cur[_i] = (_cur[_i] + (_a if _pa <= _pb and _pa <= _pc else _b if _pb <= _pc else _c)) & 0xff
+        else:
+            raise Exception(f'invalid input, PNG filter type {_filter}')
+        _out[_y] = _cur
+        _prior = _cur
+    return _out
+
+
+# +
+# function: png_decode()
+# -
+def png_decode(_data):
+    """
+    Decode an 8-bit, non-interlaced gray, gray+alpha, RGB or RGBA PNG, as written by png_encode()
+    or plt.imsave(), to gray levels and alpha. Color is reduced to its red channel, which is the
+    gray level of a gray colormap.
+
+    Parameters:
+        _data (bytes): PNG file content
+    Returns:
+        _gray (numpy.ndarray): uint8 gray levels
+        _alpha (numpy.ndarray): uint8 alpha, or None if the PNG has no alpha channel
+    """
+
+    if not _data.startswith(PNG_SIGNATURE):
+        raise Exception(f'invalid input, not a PNG')
+    _pos, _header, _idat = len(PNG_SIGNATURE), None, []
+    while _pos + 8 <= len(_data):
+        _length, _type = struct.unpack('>I4s', _data[_pos:_pos + 8])
+        _payload = _data[_pos + 8:_pos + 8 + _length]
+        _pos += 12 + _length
+        if _type == b'IHDR':
+            _header = struct.unpack('>IIBBBBB', _payload)
+        elif _type == b'IDAT':
+            _idat.append(_payload)
+        elif _type == b'IEND':
+            break
+    if _header is None or not _idat:
+        raise Exception(f'invalid input, PNG without IHDR or IDAT')
+
+    _width, _height, _depth, _color_type, _, _, _interlace = _header
+    _channels = {0: 1, 2: 3, 4: 2, 6: 4}.get(_color_type)
+    if _depth != 8 or _channels is None or _interlace != 0:
+        raise Exception(f'invalid input, PNG bit depth {_depth}, color type {_color_type}, interlace {_interlace}')
+    _pixels = _png_unfilter(zlib.decompress(b''.join(_idat)), _height, _width * _channels, _channels)
+    _pixels = _pixels.reshape(_height, _width, _channels)
+    _alpha = _pixels[:, :, -1].copy() if _color_type in [4, 6] else None
+    return _pixels[:, :, 0].copy(), _alpha
+
+
+# +
+# function: png_save()
+# -
+def png_save(_path, _data, vmin=None, vmax=None, interval=THUMBNAIL_INTERVALS[0], stretch=THUMBNAIL_STRETCHES[0]):
+    """ write a stamp as an 8-bit PNG, a drop-in for plt.imsave(_path, _data, cmap='gray', vmin=, vmax=) """
+    with open(_path, 'wb') as _fd:
+        _fd.write(png_encode(*stamp_gray(_data, vmin, vmax, interval, stretch)))
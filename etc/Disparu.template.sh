@@ -39,6 +39,14 @@ export DISPARU_DB_NAME="disparu"
 export DISPARU_DB_USER="disparu"
 export DISPARU_DB_PASS="db_secret"
 
+# optional: connection pool, statement timeout (ms) and read-only replica
+#export DISPARU_DB_POOL_SIZE=5
+#export DISPARU_DB_MAX_OVERFLOW=10
+#export DISPARU_DB_POOL_RECYCLE=1800
+#export DISPARU_DB_STATEMENT_TIMEOUT=0
+#export DISPARU_DB_RO_HOST=""
+#export DISPARU_DB_RO_PORT=5435
+
 
 # +
 # env(s)
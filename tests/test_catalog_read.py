@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from dsrc.utils.catalog_read import catalog_read, catalog_records
+
+import math
+import os
+import pytest
+
+
+# +
+# constant(s)
+# -
+# blank and 'nan' cells, a duplicate row, a blank line, short lines and a line of spaces
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'catalog.txt')
+CATALOG_FORMAT = {'num': [0, 5, 'int', '', ''], 'x': [5, 15, 'float', '', ''], 'name': [15, 25, 'str', '', ''],
+                  'mag': [25, 33, 'float', '', '']}
+CATALOG_SKIP = 1
+
+
+# +
+# (hidden) function: _read_lines()
+# -
+def _read_lines(_file='', _format=None, _skip=0):
+    """ the line-by-line, cell-by-cell reader that catalog_read() replaced, in file order """
+    with open(_file, 'r') as _fd:
+        _lines = [_l for _l in _fd.readlines()[_skip:] if _l.strip() != '']
+    _all_results = []
+    for _e in _lines:
+        _this_result = {}
+        for _l in _format:
+            _value = _e[_format[_l][0]:_format[_l][1]].strip()
+            if _format[_l][2].strip().lower() == 'int':
+                _this_result[_l] = -1 if _value == '' else int(_value)
+            elif _format[_l][2].strip().lower() == 'float':
+                _this_result[_l] = float(math.nan) if _value == '' else float(_value)
+            else:
+                _this_result[_l] = _value
+        _all_results.append(_this_result)
+    return _all_results
+
+
+# +
+# fixture: rows()
+# -
+@pytest.fixture(scope='module')
+def rows():
+    return catalog_records(catalog_read(CATALOG_FILE, CATALOG_FORMAT, CATALOG_SKIP)), \
+        _read_lines(CATALOG_FILE, CATALOG_FORMAT, CATALOG_SKIP)
+
+
+# +
+# test: catalog_read() gives the rows of the line-by-line reader, in file order
+# -
+def test_catalog_read_rows(rows):
+    _new, _old = rows
+    assert len(_new) == len(_old) == 5
+    assert _new[0] == _new[3]
+
+
+# +
+# test: catalog_read() gives the cells of the line-by-line reader, of the same type, NaN equal to NaN
+# -
+@pytest.mark.parametrize('column', list(CATALOG_FORMAT))
+def test_catalog_read_cells(rows, column):
+    for _n, _o in zip(*rows):
+        assert type(_n[column]) == type(_o[column])
+        if isinstance(_o[column], float) and math.isnan(_o[column]):
+            assert math.isnan(_n[column])
+        else:
+            assert _n[column] == _o[column]
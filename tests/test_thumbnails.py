@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from astropy.io import fits
+from dsrc.utils.thumbnails import THUMBNAIL_KINDS, THUMBNAIL_SIZE, thumbnail_batch_cut
+
+import os
+import numpy as np
+import pytest
+
+
+# +
+# constant(s)
+# -
+IMAGE_SHAPE = (3 * THUMBNAIL_SIZE - 7, 2 * THUMBNAIL_SIZE + 11)
+HALF = THUMBNAIL_SIZE / 2
+NY, NX = IMAGE_SHAPE
+
+# inside, at fractional positions, straddling the NaN block, and clipped at every edge and corner
+POSITIONS = [(NX / 2 - 10, NY / 2 - 30), (NX / 2, NY / 2), (NX / 2 + 0.7, NY / 2 - 0.3),
+             (0.0, NY / 2), (0.4, 0.6), (HALF - 0.1, HALF + 0.1), (NX - 1.0, NY / 2), (NX - 0.5, NY - 0.5),
+             (NX / 2, 0.0), (NX / 2, NY - 1.0), (NX - HALF + 0.5, HALF - 0.5), (3.0, NY - 2.0)]
+
+
+# +
+# (hidden) function: _trio_slices()
+# -
+def _trio_slices(_sci_file, _ref_file, _diff_file, _xcen, _ycen, _size=THUMBNAIL_SIZE, _ext=0):
+    """ the per-candidate cut of make_thumbnail_trio() before thumbnail_batch_cut(), stamps and sci/ref limits """
+    with fits.open(_sci_file) as _sci_hdu, fits.open(_ref_file) as _ref_hdu, fits.open(_diff_file) as _diff_hdu:
+        _sci_data, _ref_data, _diff_data = _sci_hdu[_ext].data, _ref_hdu[_ext].data, _diff_hdu[_ext].data
+        _ymin = int(np.maximum(_ycen-_size/2, 0.0))
+        _ymax = int(np.minimum(_ycen+_size/2, np.shape(_sci_data)[0]))
+        _xmin = int(np.maximum(_xcen-_size/2, 0.0))
+        _xmax = int(np.minimum(_xcen+_size/2, np.shape(_sci_data)[1]))
+        _sci_thumb = np.array(_sci_data[_ymin:_ymax, _xmin:_xmax], dtype=np.float64)
+        _ref_thumb = np.array(_ref_data[_ymin:_ymax, _xmin:_xmax], dtype=np.float64)
+        _diff_thumb = np.array(_diff_data[_ymin:_ymax, _xmin:_xmax], dtype=np.float64)
+    _sciref_min = np.minimum(np.amin(_sci_thumb.flatten()), np.amin(_ref_thumb.flatten()))
+    _sciref_max = np.maximum(np.amax(_sci_thumb.flatten()), np.amax(_ref_thumb.flatten()))
+    return _sci_thumb, _ref_thumb, _diff_thumb, _sciref_min, _sciref_max
+
+
+# +
+# fixture: images()
+# -
+@pytest.fixture(scope='module')
+def images(tmp_path_factory):
+    """ sci/ref/diff FITS images of noise with a block of NaNs """
+    _dir = tmp_path_factory.mktemp('images')
+    _rng = np.random.default_rng(0)
+    _files = []
+    for _kind in THUMBNAIL_KINDS:
+        _image = _rng.normal(100.0, 10.0, IMAGE_SHAPE).astype(np.float32)
+        _image[NY // 2:NY // 2 + 4, NX // 2:NX // 2 + 3] = np.nan
+        _files.append(os.path.join(_dir, f'{_kind}.fits'))
+        fits.PrimaryHDU(_image).writeto(_files[-1])
+    return _files
+
+
+# +
+# fixture: batch_cut()
+# -
+@pytest.fixture(scope='module')
+def batch_cut(images):
+    return thumbnail_batch_cut(*images, [_p[0] for _p in POSITIONS], [_p[1] for _p in POSITIONS], THUMBNAIL_SIZE)
+
+
+# +
+# test: the batch cut gives the old slices, NaN padded where clipped
+# -
+@pytest.mark.parametrize('ix', range(len(POSITIONS)))
+def test_batch_cut_stamps(images, batch_cut, ix):
+    _old = _trio_slices(*images, *POSITIONS[ix])
+    _h, _w = batch_cut['shapes'][ix]
+    assert (_h, _w) == _old[0].shape
+    for _j, _kind in enumerate(THUMBNAIL_KINDS):
+        _stamp = batch_cut[_kind][ix]
+        np.testing.assert_array_equal(_stamp[:_h, :_w], _old[_j])
+        assert np.isnan(_stamp[_h:, :]).all() and np.isnan(_stamp[:, _w:]).all()
+
+
+# +
+# test: the batch cut gives the old sci/ref limits
+# -
+@pytest.mark.parametrize('ix', range(len(POSITIONS)))
+def test_batch_cut_limits(images, batch_cut, ix):
+    _old = _trio_slices(*images, *POSITIONS[ix])
+    if np.isnan(_old[3]) or np.isnan(_old[4]):
+        # np.amin() gave NaN limits, a blank stamp, for any stamp with a NaN, the batch limits ignore NaNs
+        _finite = np.concatenate([_old[0][np.isfinite(_old[0])], _old[1][np.isfinite(_old[1])]])
+        assert (batch_cut['vmin'][ix], batch_cut['vmax'][ix]) == (_finite.min(), _finite.max())
+    else:
+        assert (batch_cut['vmin'][ix], batch_cut['vmax'][ix]) == (_old[3], _old[4])
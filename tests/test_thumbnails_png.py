@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from dsrc.utils.thumbnails_png import GRAY_LUT, png_decode, png_encode, png_save, stamp_limits
+
+import math
+import os
+import time
+import numpy as np
+import pytest
+
+
+# +
+# constant(s)
+# -
+_RNG = np.random.default_rng(0)
+_NOISE = _RNG.normal(100.0, 10.0, (50, 50))
+_NAN = _NOISE.copy()
+_NAN[:3, :3] = np.nan
+
+# name: (stamp, vmin, vmax), None limits are those of stamp_limits() as the thumbnails pass them
+CASES = {
+    'noise': (_NOISE, None, None),
+    'nan': (_NAN, None, None),
+    'all nan': (np.full((50, 50), np.nan), None, None),
+    'vmin == vmax': (np.full((50, 50), 7.0), None, None),
+    'nan, vmin == vmax': (_NAN, 90.0, 90.0),
+    'outside limits': (_NAN, 95.0, 105.0),
+    'clipped edge': (_NAN[:, 17:], None, None),
+    'clipped corner': (_NOISE[:12, :31], 90.0, 90.0),
+}
+
+
+# +
+# (hidden) function: _imsave_reference()
+# -
+def _imsave_reference(_data, _vmin, _vmax):
+    """ matplotlib's Normalize and 256-level 'gray' colormap lookup, as plt.imsave() applies them, pixel by pixel """
+    _gray = np.zeros(np.shape(_data), dtype=np.uint8)
+    _alpha = np.full(np.shape(_data), 255, dtype=np.uint8)
+    for _ix in np.ndindex(*np.shape(_data)):
+        # vmin == vmax maps everything to 0, NaN included, else a NaN value or limit is transparent
+        _x = 0.0 if _vmin == _vmax else (float(_data[_ix]) - _vmin) / (_vmax - _vmin)
+        if math.isnan(_x):
+            _alpha[_ix] = 0
+            continue
+        _gray[_ix] = GRAY_LUT[255 if _x >= 1.0 else 0 if _x < 0.0 else min(int(_x * 256.0), 255)]
+    return _gray, _alpha
+
+
+# +
+# (hidden) function: _read()
+# -
+def _read(_path):
+    """ decoded gray levels and alpha of a PNG, opaque if it has no alpha channel """
+    with open(_path, 'rb') as _fd:
+        _gray, _alpha = png_decode(_fd.read())
+    return _gray, np.full(_gray.shape, 255, dtype=np.uint8) if _alpha is None else _alpha
+
+
+# +
+# (hidden) function: _limits()
+# -
+def _limits(_data, _vmin, _vmax):
+    _lo, _hi = stamp_limits(_data)
+    return _lo if _vmin is None else _vmin, _hi if _vmax is None else _vmax
+
+
+# +
+# (hidden) function: _assert_same_pixels()
+# -
+def _assert_same_pixels(_ours, _theirs):
+    # transparent pixels only need to agree on being transparent
+    assert _ours[0].shape == _theirs[0].shape
+    np.testing.assert_array_equal(_ours[1], _theirs[1])
+    _shown = _theirs[1] > 0
+    np.testing.assert_array_equal(_ours[0][_shown], _theirs[0][_shown])
+
+
+# +
+# test: png_save() gives the pixels of the plt.imsave() mapping
+# -
+@pytest.mark.parametrize('case', list(CASES))
+def test_png_save_reference(tmp_path, case):
+    _data, _vmin, _vmax = CASES[case]
+    _vmin, _vmax = _limits(_data, _vmin, _vmax)
+    png_save(os.path.join(tmp_path, 'png.png'), _data, vmin=_vmin, vmax=_vmax)
+    _assert_same_pixels(_read(os.path.join(tmp_path, 'png.png')), _imsave_reference(_data, _vmin, _vmax))
+
+
+# +
+# test: png_save() gives the pixels of plt.imsave(), the limits are always given: without them
+# plt.imsave() takes NaN limits from a stamp with any NaN and leaves it blank
+# -
+@pytest.mark.parametrize('case', list(CASES))
+def test_png_save_imsave(tmp_path, case):
+    plt = pytest.importorskip('matplotlib.pyplot')
+    _data, _vmin, _vmax = CASES[case]
+    _vmin, _vmax = _limits(_data, _vmin, _vmax)
+    png_save(os.path.join(tmp_path, 'png.png'), _data, vmin=_vmin, vmax=_vmax)
+    plt.imsave(os.path.join(tmp_path, 'mpl.png'), _data, cmap='gray', vmin=_vmin, vmax=_vmax)
+    _assert_same_pixels(_read(os.path.join(tmp_path, 'png.png')), _read(os.path.join(tmp_path, 'mpl.png')))
+
+
+# +
+# test: png_decode() reads back what png_encode() writes
+# -
+@pytest.mark.parametrize('alpha', [False, True])
+def test_png_decode(alpha):
+    _gray = _RNG.integers(0, 256, (37, 50), dtype=np.uint8)
+    _alpha = _RNG.integers(0, 256, (37, 50), dtype=np.uint8) if alpha else None
+    _decoded = png_decode(png_encode(_gray, _alpha))
+    np.testing.assert_array_equal(_decoded[0], _gray)
+    assert _decoded[1] is None if _alpha is None else np.array_equal(_decoded[1], _alpha)
+
+
+# +
+# test: png_save() is faster per stamp than plt.imsave()
+# -
+def test_png_save_benchmark(tmp_path):
+    plt = pytest.importorskip('matplotlib.pyplot')
+    _count = 200
+    _stamps = _RNG.normal(100.0, 10.0, (_count, 50, 50))
+    _stamps[:, :3, :3] = np.nan
+    _vmin, _vmax = np.nanmin(_stamps, axis=(1, 2)), np.nanmax(_stamps, axis=(1, 2))
+
+    _start = time.perf_counter()
+    for _i in range(_count):
+        png_save(os.path.join(tmp_path, f'png_{_i}.png'), _stamps[_i], vmin=_vmin[_i], vmax=_vmax[_i])
+    _ours = time.perf_counter() - _start
+
+    _start = time.perf_counter()
+    for _i in range(_count):
+        plt.imsave(os.path.join(tmp_path, f'mpl_{_i}.png'), _stamps[_i], cmap='gray', vmin=_vmin[_i], vmax=_vmax[_i])
+    _theirs = time.perf_counter() - _start
+
+    assert _ours < _theirs, f'png_save {1.0e6 * _ours / _count:.1f} us/stamp, plt.imsave {1.0e6 * _theirs / _count:.1f} us/stamp'
+    for _i in range(_count):
+        _assert_same_pixels(_read(os.path.join(tmp_path, f'png_{_i}.png')),
+                            _read(os.path.join(tmp_path, f'mpl_{_i}.png')))